@@ -0,0 +1,175 @@
+from google.cloud import firestore
+
+# Formato original: um documento por horário ocupado, ID "YYYY-MM-DD_HH:MM_Barbeiro[_BLOQUEADO]"
+COLECAO_AGENDAMENTOS = 'agendamentos'
+# Formato agregado: um documento por dia, ID "YYYY-MM-DD", com um mapa de horários por barbeiro
+# agenda_dias/{dia} -> {'barbeiros': {barbeiro: {'HH:MM': dados, 'HH:MM_BLOQUEADO': dados}}}
+COLECAO_DIAS = 'agenda_dias'
+
+# Layouts de armazenamento. A troca segura é: slots -> duplo -> (migrar_agenda_dias.py) -> dias
+LAYOUT_SLOTS = 'slots'  # só 'agendamentos'
+LAYOUT_DUPLO = 'duplo'  # grava nos dois e lê os slots (o agregado só vale depois da migração)
+LAYOUT_DIAS = 'dias'    # só 'agenda_dias': carregar um dia é ler um documento
+LAYOUTS = (LAYOUT_SLOTS, LAYOUT_DUPLO, LAYOUT_DIAS)
+
+SUFIXO_BLOQUEIO = '_BLOQUEADO'
+
+# Limite de escritas de um batch do Firestore
+MAXIMO_ESCRITAS_BATCH = 500
+
+
+def grava_slots(layout):
+    return layout in (LAYOUT_SLOTS, LAYOUT_DUPLO)
+
+
+def grava_dias(layout):
+    return layout in (LAYOUT_DUPLO, LAYOUT_DIAS)
+
+
+def escritas_por_slot(layout):
+    """Quantas escritas de batch gravar ou apagar um horário custa no layout."""
+    return int(grava_slots(layout)) + int(grava_dias(layout))
+
+
+def separar_id(doc_id):
+    """"2025-08-22_10:30_Aluizio_BLOQUEADO" -> ("2025-08-22", "Aluizio", "10:30_BLOQUEADO")."""
+    data_para_id, horario, resto = doc_id.split('_', 2)
+    if resto.endswith(SUFIXO_BLOQUEIO):
+        return data_para_id, resto[:-len(SUFIXO_BLOQUEIO)], horario + SUFIXO_BLOQUEIO
+    return data_para_id, resto, horario
+
+
+def montar_id(data_para_id, barbeiro, chave_slot):
+    """Inverso de separar_id."""
+    if chave_slot.endswith(SUFIXO_BLOQUEIO):
+        return f"{data_para_id}_{chave_slot[:-len(SUFIXO_BLOQUEIO)]}_{barbeiro}{SUFIXO_BLOQUEIO}"
+    return f"{data_para_id}_{chave_slot}_{barbeiro}"
+
+
+def ocupados_do_documento(data_para_id, dados):
+    """
+    Converte o documento agregado do dia no mesmo ocupados_map do formato original
+    ({doc_id: dados}), para que tabela, máscaras e cache não precisem saber do layout.
+    """
+    ocupados_map = {}
+    for barbeiro, slots in ((dados or {}).get('barbeiros') or {}).items():
+        for chave_slot, dados_slot in slots.items():
+            ocupados_map[montar_id(data_para_id, barbeiro, chave_slot)] = dados_slot
+    return ocupados_map
+
+
+def agrupar_por_dia(ocupados_map):
+    """Inverso de ocupados_do_documento para vários dias: {dia: {'barbeiros': {...}}}."""
+    por_dia = {}
+    for doc_id, dados in ocupados_map.items():
+        data_para_id, barbeiro, chave_slot = separar_id(doc_id)
+        barbeiros = por_dia.setdefault(data_para_id, {'barbeiros': {}})['barbeiros']
+        barbeiros.setdefault(barbeiro, {})[chave_slot] = dados
+    return por_dia
+
+
+def ref_dia(db, data_para_id):
+    return db.collection(COLECAO_DIAS).document(data_para_id)
+
+
+def consultar_dias(db, ids):
+    """
+    Lê os documentos agregados dos dias `ids` ('YYYY-MM-DD') em uma chamada só,
+    uma leitura por dia. Dias sem documento não aparecem no resultado.
+    """
+    por_dia = {}
+    for doc in db.get_all([ref_dia(db, data_para_id) for data_para_id in ids]):
+        if doc.exists:
+            por_dia[doc.id] = ocupados_do_documento(doc.id, doc.to_dict())
+    return por_dia
+
+
+def refs_para_verificar(db, doc_ids, layout):
+    """
+    Referências que uma transação precisa ler para saber se os horários `doc_ids`
+    estão livres. No layout duplo lê os dois formatos: um dia ainda não migrado
+    só tem os slots.
+    """
+    refs = []
+    if grava_dias(layout):
+        for data_para_id in sorted({doc_id[:10] for doc_id in doc_ids}):
+            refs.append(ref_dia(db, data_para_id))
+    if grava_slots(layout):
+        refs.extend(db.collection(COLECAO_AGENDAMENTOS).document(doc_id) for doc_id in doc_ids)
+    return refs
+
+
+def ocupados_lidos(snapshots):
+    """
+    {doc_id (formato original): dados} dos horários ocupados segundo os snapshots lidos
+    com refs_para_verificar. No layout duplo os slots (lidos depois) prevalecem.
+    """
+    ocupados = {}
+    for doc in snapshots:
+        if not doc.exists:
+            continue
+        if doc.reference.parent.id == COLECAO_DIAS:
+            ocupados.update(ocupados_do_documento(doc.id, doc.to_dict()))
+        else:
+            ocupados[doc.id] = doc.to_dict()
+    return ocupados
+
+
+def gravar_slot(escritor, db, doc_id, dados, layout):
+    """Grava um horário pela transação ou batch `escritor`, nos formatos do layout."""
+    if grava_slots(layout):
+        escritor.set(db.collection(COLECAO_AGENDAMENTOS).document(doc_id), dados)
+    if grava_dias(layout):
+        data_para_id, barbeiro, chave_slot = separar_id(doc_id)
+        escritor.set(ref_dia(db, data_para_id), {'barbeiros': {barbeiro: {chave_slot: dados}}}, merge=True)
+
+
+def apagar_slot(escritor, db, doc_id, layout):
+    if grava_slots(layout):
+        escritor.delete(db.collection(COLECAO_AGENDAMENTOS).document(doc_id))
+    if grava_dias(layout):
+        data_para_id, barbeiro, chave_slot = separar_id(doc_id)
+        escritor.set(ref_dia(db, data_para_id),
+                     {'barbeiros': {barbeiro: {chave_slot: firestore.DELETE_FIELD}}}, merge=True)
+
+
+def dia_vazio(dados):
+    """True se o documento do dia não tem mais nenhum horário (os campos são apagados com DELETE_FIELD)."""
+    return not any(((dados or {}).get('barbeiros') or {}).values())
+
+
+def apagar_dias_vazios(db, ids):
+    """
+    Apaga os documentos dos dias `ids` que ficaram sem nenhum horário, cada um numa
+    transação: uma gravação no mesmo dia feita entre a leitura e a exclusão faz a
+    transação ser repetida, e o dia deixa de estar vazio.
+
+    Returns:
+        int: quantos documentos foram apagados.
+    """
+    apagados = 0
+    for data_para_id in ids:
+        ref = ref_dia(db, data_para_id)
+
+        @firestore.transactional
+        def na_transacao(transaction):
+            doc, = transaction.get_all([ref])
+            if doc.exists and dia_vazio(doc.to_dict()):
+                transaction.delete(ref)
+                return True
+            return False
+
+        apagados += na_transacao(db.transaction())
+    return apagados
+
+
+def ler_slot(db, doc_id, layout):
+    """Dados de um horário, ou None se ele está livre. No layout duplo os slots ainda são a fonte."""
+    if grava_slots(layout):
+        doc = db.collection(COLECAO_AGENDAMENTOS).document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+    data_para_id, barbeiro, chave_slot = separar_id(doc_id)
+    doc = ref_dia(db, data_para_id).get()
+    if not doc.exists:
+        return None
+    return ((doc.to_dict() or {}).get('barbeiros') or {}).get(barbeiro, {}).get(chave_slot)
@@ -0,0 +1,141 @@
+"""
+Agendamento recorrente: o cliente de sempre marca de uma vez as próximas visitas
+(ex: a cada 2 ou 3 semanas, no mesmo horário e com o mesmo barbeiro).
+
+A disponibilidade de todas as datas sai de UMA chamada a `ocupacao_periodo` com
+os dias da série, que lê só esses dias (nos slots, uma consulta pelo campo 'data') e todos os
+agendamentos, com os bloqueios do corte + barba, as entradas no índice por
+telefone e os eventos, são gravados com UM `armazenamento.reservar`: no mesmo
+commit, ou nada é gravado. As datas que não dão vão para 'conflitos'.
+"""
+from datetime import datetime, timedelta
+
+from regras_horario import grade_do_dia
+from indice_telefone import normalizar_telefone
+from reservas import horarios_necessarios, horarios_seguintes, ids_do_atendimento, montar_atendimento
+
+# Maior série aceita de uma vez: limita as datas lidas e gravadas no mesmo commit
+MAX_OCORRENCIAS = 12
+INTERVALOS_SEMANAS = (1, 2, 3, 4)
+
+# Se alguém ocupar uma das datas entre a leitura e o commit, a série é lida e conferida de novo
+TENTATIVAS = 2
+
+
+class _DatasOcupadas(ValueError):
+    """Alguma data da série foi ocupada depois da leitura (a transação não gravou nada). Leva os IDs ocupados."""
+
+
+def datas_da_serie(primeira_data, intervalo_semanas, ocorrencias):
+    """As `ocorrencias` datas a partir de `primeira_data`, a cada `intervalo_semanas` semanas."""
+    if intervalo_semanas not in INTERVALOS_SEMANAS:
+        raise ValueError(f"O intervalo precisa ser de {INTERVALOS_SEMANAS[0]} a {INTERVALOS_SEMANAS[-1]} semanas.")
+    if not 1 <= ocorrencias <= MAX_OCORRENCIAS:
+        raise ValueError(f"A série pode ter de 1 a {MAX_OCORRENCIAS} agendamentos.")
+    return [primeira_data + timedelta(weeks=intervalo_semanas * i) for i in range(ocorrencias)]
+
+
+def _resultado(ids_dias):
+    return {
+        'dias': ids_dias,      # dias da série (o chamador invalida o cache deles)
+        'agendados': [],       # IDs dos agendamentos gravados agora
+        'ja_agendados': [],    # IDs que este mesmo envio já tinha gravado (envio repetido)
+        'conflitos': [],       # (data_para_id, motivo) das datas que ficaram de fora
+        'commits': 0,
+    }
+
+
+def _planejar(por_dia, datas, horario, barbeiro, seguintes, telefone, id_envio):
+    """Separa as datas da série em livres, já agendadas por este envio e com conflito."""
+    resultado = _resultado([data.strftime('%Y-%m-%d') for data in datas])
+    livres = []
+    for data, data_para_id in zip(datas, resultado['dias']):
+        regra = grade_do_dia(data, barbeiro).regra(horario)
+        if regra:
+            resultado['conflitos'].append((data_para_id, regra.mensagem.format(barbeiro=barbeiro)))
+            continue
+        ocupados_map = por_dia.get(data_para_id, {})
+        chave = f"{data_para_id}_{horario}_{barbeiro}"
+        if id_envio and ocupados_map.get(chave, {}).get('id_envio') == id_envio:
+            resultado['ja_agendados'].append(chave)
+            continue
+        if chave in ocupados_map or f"{chave}_BLOQUEADO" in ocupados_map:
+            agendamento = ocupados_map.get(chave, {})
+            if agendamento.get('nome') == 'Fechado':
+                motivo = "fechado pela barbearia"
+            elif agendamento.get('telefone_normalizado') and agendamento['telefone_normalizado'] == normalizar_telefone(telefone):
+                motivo = "você já tem este horário agendado"
+            else:
+                motivo = "horário ocupado"
+            resultado['conflitos'].append((data_para_id, motivo))
+            continue
+        seguinte_ocupado = next((h for h in seguintes if any(doc_id in ocupados_map for doc_id in
+                                                             ids_do_atendimento(data_para_id, [h], barbeiro))), None)
+        if seguinte_ocupado:
+            resultado['conflitos'].append((data_para_id, f"o horário seguinte ({seguinte_ocupado}) está ocupado"))
+        else:
+            livres.append(data)
+    return resultado, livres
+
+
+def agendar_serie(armazenamento, primeira_data, horario, nome, telefone, servicos, barbeiro, intervalo_semanas,
+                  ocorrencias, id_envio=None, todas_ou_nenhuma=False):
+    """
+    Agenda a série com uma leitura de todas as datas e um único commit.
+
+    As datas com conflito (horário ocupado, fechado pelas regras de funcionamento)
+    ficam de fora e as outras são agendadas; com `todas_ou_nenhuma`, qualquer
+    conflito faz a série inteira não ser gravada. Com `id_envio` (gravado em cada
+    agendamento), repetir o mesmo envio não gera conflito com o que ele já gravou.
+
+    Sem st.*, como `reservar_atendimento`.
+
+    Returns:
+        dict: ver `_resultado`.
+
+    Raises:
+        ValueError: série inválida, ou as datas continuaram sendo ocupadas durante as tentativas.
+    """
+    seguintes = horarios_seguintes(horario, horarios_necessarios(servicos) - 1)
+    if any(h >= "20:00" for h in seguintes):
+        raise ValueError(f"O barbeiro {barbeiro} não poderá atender para corte e barba, pois o horário {horario} é o último do dia. Por favor, escolha serviços que caibam em 30 minutos ou selecione outro horário.")
+    datas = datas_da_serie(primeira_data, intervalo_semanas, ocorrencias)
+    # Horários que a transação achou ocupados: entram na próxima leitura mesmo que a consulta
+    # não os traga (ex: um "Fechado" criado à mão no console, sem o campo 'data')
+    vistos_ocupados = set()
+
+    for tentativa in range(1, TENTATIVAS + 1):
+        # Uma única leitura traz todas as datas da série (e só elas)
+        por_dia = armazenamento.ocupacao_periodo([data.strftime('%Y-%m-%d') for data in datas])
+        for doc_id in vistos_ocupados:
+            por_dia.setdefault(doc_id[:10], {}).setdefault(doc_id, {})
+        resultado, livres = _planejar(por_dia, datas, horario, barbeiro, seguintes, telefone, id_envio)
+        if not livres or (todas_ou_nenhuma and resultado['conflitos']):
+            return resultado
+
+        ids_verificar, gravacoes, indices, eventos = [], {}, [], []
+        for data in livres:
+            # O campo 'data' é gravado como datetime, como no agendamento avulso (o Firestore não aceita date)
+            data_obj = datetime(data.year, data.month, data.day)
+            chave, gravacoes_data, indice, evento = montar_atendimento(data_obj, horario, nome, telefone, servicos,
+                                                                       barbeiro, seguintes, id_envio)
+            ids_verificar += ids_do_atendimento(chave[:10], [horario] + seguintes, barbeiro)
+            gravacoes.update(gravacoes_data)
+            indices += [indice] if indice else []
+            eventos.append(evento)
+            resultado['agendados'].append(chave)
+
+        def validar(ocupados):
+            if ocupados:
+                raise _DatasOcupadas(set(ocupados))
+
+        try:
+            armazenamento.reservar(ids_verificar, gravacoes, validar, indices, eventos)
+        except _DatasOcupadas as e:
+            vistos_ocupados.update(e.args[0])
+            if tentativa == TENTATIVAS:
+                raise ValueError("Algumas datas foram ocupadas enquanto a série era agendada e nada foi gravado. "
+                                 "Por favor, tente novamente.")
+            continue
+        resultado['commits'] = 1
+        return resultado
@@ -0,0 +1,220 @@
+"""
+Análise da ocupação para a área da barbearia: ocupação por barbeiro, por horário e
+por dia da semana e o mix de serviços, calculados com pandas a partir dos
+agendamentos e bloqueios de cada mês.
+
+Cada mês é lido uma vez (uma consulta por faixa no banco, mais o arquivo mensal de
+arquivar_agendamentos.py, se houver) e reduzido a contagens pequenas, que ficam em
+cache: os meses que já terminaram não expiram e o mês corrente é relido depois de
+`ttl_mes_aberto` segundos. Um período de vários meses soma as contagens guardadas,
+sem ler nada de novo.
+
+O agendamento cancelado é apagado, mas o cancelamento soma um no contador do mês
+(ver contagem_cancelamentos.py) no mesmo commit: a taxa de cancelamento de cada
+barbeiro sai desse contador e dos agendamentos que ficaram.
+"""
+import threading
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from arquivar_agendamentos import PASTA_ARQUIVO, dias_do_mes, ler_mes, meses_entre
+from regras_horario import BARBEIROS, HORARIOS, INDICE_HORARIO, grade_do_dia
+from reservas import SERVICOS_CORTE
+
+DIAS_SEMANA = ("Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado", "Domingo")
+
+# Categorias do mix de serviços, na ordem em que são testadas (a primeira que casar vale)
+CATEGORIAS_SERVICO = ("Visagismo", "Corte + barba", "Corte", "Barba", "Outros")
+SERVICOS_VISAGISMO = ("Abordagem de visagismo", "Consultoria de visagismo")
+
+COLUNAS_OCUPACAO = ["abertos", "bloqueados", "ocupados"]
+COLUNAS_CANCELAMENTO = ["agendamentos", "cancelamentos"]
+
+
+def quadro_de_documentos(documentos):
+    """
+    DataFrame com uma linha por documento: dia, horario, barbeiro, se é bloqueio e
+    os serviços (os IDs têm o formato 'YYYY-MM-DD_HH:MM_Barbeiro[_BLOQUEADO]').
+    """
+    ids = pd.Series(list(documentos), dtype=object)
+    # astype(object): sem documentos as colunas vazias viriam como float e o merge com a grade falharia
+    partes = ids.str.split('_', expand=True).reindex(columns=range(4)).astype(object)
+    dados = list(documentos.values())
+    quadro = pd.DataFrame({
+        'id': ids,
+        'dia': pd.to_datetime(partes[0], format='%Y-%m-%d'),
+        'horario': partes[1],
+        'barbeiro': partes[2],
+        'nome': [d.get('nome') for d in dados],
+        'servicos': [list(d.get('servicos') or []) for d in dados],
+    })
+    # "_BLOQUEADO" (bloqueio avulso, em lote ou do corte + barba) e "Fechado" manual
+    quadro['bloqueio'] = partes[3].eq('BLOQUEADO').to_numpy() | quadro['nome'].isin(['BLOQUEADO', 'Fechado']).to_numpy()
+    return quadro
+
+
+def quadro_de_horarios(mes, barbeiros):
+    """Um registro por (dia, barbeiro, horário) aberto pelas regras de funcionamento no mês."""
+    linhas = []
+    for dia in dias_do_mes(mes):
+        data = date.fromisoformat(dia)
+        for barbeiro in barbeiros:
+            grade = grade_do_dia(data, barbeiro)
+            linhas.extend((dia, horario, barbeiro) for horario, regra in zip(HORARIOS, grade.regras) if regra is None)
+    quadro = pd.DataFrame(linhas, columns=['dia', 'horario', 'barbeiro'])
+    quadro['dia'] = pd.to_datetime(quadro['dia'], format='%Y-%m-%d')
+    return quadro
+
+
+def categorias_de_servico(agendamentos):
+    """Series com a categoria (CATEGORIAS_SERVICO) de cada agendamento."""
+    servicos = agendamentos[['id', 'servicos']].explode('servicos')
+    tem = servicos.assign(
+        corte=servicos['servicos'].isin(SERVICOS_CORTE),
+        barba=servicos['servicos'].eq("Barba"),
+        visagismo=servicos['servicos'].isin(SERVICOS_VISAGISMO),
+    ).groupby('id', sort=False)[['corte', 'barba', 'visagismo']].any().reindex(agendamentos['id'], fill_value=False)
+    categoria = np.select(
+        [tem['visagismo'], tem['corte'] & tem['barba'], tem['corte'], tem['barba']],
+        CATEGORIAS_SERVICO[:-1],
+        default=CATEGORIAS_SERVICO[-1],
+    )
+    return pd.Series(categoria, index=agendamentos.index)
+
+
+def agregar_mes(mes, documentos, barbeiros=BARBEIROS, cancelamentos=None):
+    """
+    Reduz os documentos do mês a contagens que podem ser somadas entre meses.
+
+    Cada horário aberto pelas regras fica 'livre', 'bloqueado' (pela barbearia) ou
+    'ocupado' (por cliente, contando o horário seguinte do corte + barba).
+    `cancelamentos` é o contador do mês ({barbeiro: quantidade}).
+
+    Returns:
+        dict: 'barbeiro', 'horario' e 'dia_semana' (DataFrames com COLUNAS_OCUPACAO),
+        'cancelamento' (DataFrame por barbeiro com COLUNAS_CANCELAMENTO),
+        'categorias' e 'servicos' (Series de contagens) e 'agendamentos' (int).
+    """
+    horarios = quadro_de_horarios(mes, barbeiros)
+    docs = quadro_de_documentos(documentos) if documentos else quadro_de_documentos({})
+    agendamentos = docs[~docs['bloqueio']]
+    bloqueios = docs[docs['bloqueio']]
+
+    # O bloqueio logo depois de um corte + barba é do cliente, não da barbearia
+    combos = agendamentos[categorias_de_servico(agendamentos).eq("Corte + barba")]
+    indice_seguinte = combos['horario'].map(INDICE_HORARIO) + 1
+    seguintes = combos.assign(
+        horario=pd.Series([HORARIOS[i] if pd.notna(i) and i < len(HORARIOS) else None for i in indice_seguinte],
+                          index=combos.index, dtype=object),
+        do_cliente=True,
+    )[['dia', 'horario', 'barbeiro', 'do_cliente']]
+    bloqueios = bloqueios.merge(seguintes, on=['dia', 'horario', 'barbeiro'], how='left')
+    do_cliente = bloqueios['do_cliente'].eq(True)
+
+    estados = pd.concat([
+        agendamentos[['dia', 'horario', 'barbeiro']].assign(estado='ocupado'),
+        bloqueios.loc[do_cliente, ['dia', 'horario', 'barbeiro']].assign(estado='ocupado'),
+        bloqueios.loc[~do_cliente, ['dia', 'horario', 'barbeiro']].assign(estado='bloqueado'),
+    ]).drop_duplicates(['dia', 'horario', 'barbeiro'])
+    # Documentos em horários que as regras fecham (ex: encaixe no domingo) ficam de fora
+    grade = horarios.merge(estados, on=['dia', 'horario', 'barbeiro'], how='left')
+    grade['dia_semana'] = grade['dia'].dt.dayofweek
+    grade = grade.assign(
+        abertos=1,
+        bloqueados=grade['estado'].eq('bloqueado').astype(int),
+        ocupados=grade['estado'].eq('ocupado').astype(int),
+    )
+
+    cancelamento = pd.DataFrame({
+        'agendamentos': agendamentos.groupby('barbeiro').size(),
+        'cancelamentos': pd.Series(cancelamentos or {}, dtype=int),
+    }).reindex(barbeiros).fillna(0).astype(int)
+
+    return {
+        'barbeiro': grade.groupby('barbeiro')[COLUNAS_OCUPACAO].sum(),
+        'cancelamento': cancelamento,
+        'horario': grade.groupby('horario')[COLUNAS_OCUPACAO].sum(),
+        'dia_semana': grade.groupby('dia_semana')[COLUNAS_OCUPACAO].sum(),
+        'categorias': categorias_de_servico(agendamentos).value_counts(),
+        'servicos': agendamentos['servicos'].explode().dropna().value_counts(),
+        'agendamentos': len(agendamentos),
+    }
+
+
+def somar_agregados(lista):
+    """Soma os agregados de vários meses (mesmo formato de `agregar_mes`)."""
+    soma = {}
+    for chave, colunas in (('barbeiro', COLUNAS_OCUPACAO), ('horario', COLUNAS_OCUPACAO),
+                           ('dia_semana', COLUNAS_OCUPACAO), ('cancelamento', COLUNAS_CANCELAMENTO)):
+        partes = [agregados[chave] for agregados in lista]
+        soma[chave] = pd.concat(partes).groupby(level=0).sum() if partes else pd.DataFrame(columns=colunas)
+    for chave in ('categorias', 'servicos'):
+        partes = [agregados[chave] for agregados in lista if len(agregados[chave])]
+        soma[chave] = pd.concat(partes).groupby(level=0).sum().sort_values(ascending=False) if partes else pd.Series(dtype=int)
+    soma['agendamentos'] = sum(agregados['agendamentos'] for agregados in lista)
+    return soma
+
+
+def taxa_de_ocupacao(contagens):
+    """Acrescenta a coluna 'ocupacao' (ocupados / horários que sobraram abertos)."""
+    disponiveis = (contagens['abertos'] - contagens['bloqueados']).replace(0, np.nan)
+    return contagens.assign(ocupacao=(contagens['ocupados'] / disponiveis).fillna(0.0))
+
+
+def taxa_de_cancelamento(contagens):
+    """Acrescenta a coluna 'taxa' (cancelamentos / tudo o que foi agendado, cancelado ou não)."""
+    total = (contagens['agendamentos'] + contagens['cancelamentos']).replace(0, np.nan)
+    return contagens.assign(taxa=(contagens['cancelamentos'] / total).fillna(0.0))
+
+
+class AnaliseOcupacao:
+    """
+    Agregados por mês guardados em memória, compartilhados por todas as sessões.
+
+    Um mês que já terminou não muda mais (só sai do banco para o arquivo, com o
+    mesmo conteúdo) e fica guardado para sempre; o mês corrente e os seguintes
+    expiram depois de `ttl_mes_aberto` segundos.
+    """
+
+    def __init__(self, armazenamento, pasta_arquivo=PASTA_ARQUIVO, barbeiros=BARBEIROS, ttl_mes_aberto=300):
+        self.armazenamento = armazenamento
+        self.pasta_arquivo = pasta_arquivo
+        self.barbeiros = list(barbeiros)
+        self.ttl_mes_aberto = ttl_mes_aberto
+        self._lock = threading.Lock()
+        self._meses = {}  # 'AAAA-MM' -> (instante, agregados); instante None = mês fechado
+
+    def documentos_do_mes(self, mes):
+        """{doc_id: dados} do mês: o que já foi arquivado mais o que ainda está no banco."""
+        documentos = ler_mes(self.pasta_arquivo, mes)
+        # Uma consulta por faixa traz o mês inteiro
+        for ocupados_map in self.armazenamento.ocupacao_periodo(dias_do_mes(mes)).values():
+            documentos.update(ocupados_map)
+        return documentos
+
+    def mes(self, mes):
+        """Agregados do mês (ver `agregar_mes`), do cache quando possível."""
+        with self._lock:
+            entrada = self._meses.get(mes)
+        if entrada is not None:
+            instante, agregados = entrada
+            if instante is None or time.monotonic() - instante <= self.ttl_mes_aberto:
+                return agregados
+
+        agregados = agregar_mes(mes, self.documentos_do_mes(mes), self.barbeiros,
+                                self.armazenamento.cancelamentos_do_mes(mes))
+        fechado = mes < date.today().strftime('%Y-%m')
+        with self._lock:
+            self._meses[mes] = (None if fechado else time.monotonic(), agregados)
+        return agregados
+
+    def periodo(self, primeiro_mes, ultimo_mes):
+        """Agregados somados de `primeiro_mes` a `ultimo_mes` ('AAAA-MM', inclusive)."""
+        return somar_agregados([self.mes(mes) for mes in meses_entre(primeiro_mes, ultimo_mes)])
+
+    def invalidar(self, mes):
+        with self._lock:
+            self._meses.pop(mes, None)
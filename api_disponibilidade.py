@@ -0,0 +1,260 @@
+"""
+API JSON (somente leitura) com os horários livres de cada barbeiro, para o bot do
+WhatsApp e o link da bio sem abrir uma sessão do Streamlit.
+
+Uso (junto com o app, no mesmo processo e com o mesmo cache):
+    AGENDA_API_PORTA=8502 streamlit run "si (2) (1).py"
+
+Uso (processo separado):
+    python api_disponibilidade.py --credenciais credenciais.json [--porta 8502] [--layout slots]
+    python api_disponibilidade.py --backend sqlite --sqlite agenda_local.db
+
+    GET /disponibilidade?inicio=AAAA-MM-DD&dias=7
+
+Resposta: para cada dia, o status de cada horário por barbeiro (o mesmo texto das
+células da tabela) e a lista dos horários livres. Vem com ETag: quem manda
+If-None-Match com a ETag anterior recebe 304 sem corpo enquanto nada mudar.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from cache_ocupacao import carregar_periodo
+from regras_horario import BARBEIROS, HORARIOS, grade_do_dia
+from tabela_disponibilidade import status_do_horario
+
+logger = logging.getLogger(__name__)
+
+# Maior período (em dias) que uma requisição pode pedir
+MAX_DIAS = 14
+
+
+def grade_disponibilidade(data, ocupados_map, barbeiros):
+    """{barbeiro: {horário: status}} do dia, com as mesmas regras da tabela."""
+    data_para_id = data.strftime('%Y-%m-%d')
+    grade = {}
+    for barbeiro in barbeiros:
+        regras = grade_do_dia(data, barbeiro)
+        grade[barbeiro] = {
+            horario: status_do_horario(regras.regra(horario), ocupados_map, f"{data_para_id}_{horario}_{barbeiro}")
+            for horario in HORARIOS
+        }
+    return grade
+
+
+class ApiDisponibilidade:
+    """
+    Monta as respostas a partir do CacheOcupacao (o mesmo do app) e as guarda pelas
+    versões dos snapshots dos dias pedidos: enquanto nenhum dia muda, a resposta e a
+    ETag são reaproveitadas sem recalcular a grade.
+    """
+
+    def __init__(self, armazenamento, cache, barbeiros=BARBEIROS, ouvinte=None, metricas=None, max_entradas=256):
+        self.armazenamento = armazenamento
+        self.cache = cache
+        self.barbeiros = list(barbeiros)
+        # Opcionais: o listener dos próximos dias (OuvinteDisponibilidade) e metricas.Metricas
+        self.ouvinte = ouvinte
+        self.metricas = metricas
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._respostas = OrderedDict()  # (inicio, dias, versões) -> (etag, corpo)
+        self._servidor = None
+
+    def resposta(self, inicio, dias):
+        """(etag, corpo JSON em bytes) da disponibilidade de `dias` dias a partir de `inicio`."""
+        if self.ouvinte is not None:
+            # Abre o listener do dia novo quando vira o dia (barato se nada mudou)
+            self.ouvinte.acompanhar(date.today())
+        por_dia = carregar_periodo(self.armazenamento, self.cache, inicio, dias)
+
+        # Versão e mapa lidos juntos, como na tabela; sem versão (ex: a entrada acabou de
+        # ser invalidada) a resposta é montada com o mapa carregado e não fica guardada
+        snapshots = {}
+        for data_para_id, ocupados_map in por_dia.items():
+            snapshot = self.cache.obter_com_versao(data_para_id)
+            snapshots[data_para_id] = snapshot if snapshot else (None, ocupados_map)
+        versoes = tuple(versao for versao, _ in snapshots.values())
+        chave = (inicio, dias, versoes)
+        guardar = None not in versoes
+
+        if guardar:
+            with self._lock:
+                pronta = self._respostas.get(chave)
+                if pronta is not None:
+                    self._respostas.move_to_end(chave)
+                    return pronta
+
+        agenda = {}
+        for i in range(dias):
+            data = inicio + timedelta(days=i)
+            data_para_id = data.strftime('%Y-%m-%d')
+            grade = grade_disponibilidade(data, snapshots[data_para_id][1], self.barbeiros)
+            agenda[data_para_id] = {
+                barbeiro: {
+                    'horarios': horarios,
+                    'livres': [horario for horario, status in horarios.items() if status == "Disponível"],
+                }
+                for barbeiro, horarios in grade.items()
+            }
+        corpo = json.dumps({
+            'inicio': inicio.strftime('%Y-%m-%d'),
+            'dias': dias,
+            'barbeiros': self.barbeiros,
+            'agenda': agenda,
+        }, ensure_ascii=False).encode()
+        pronta = (f'"{hashlib.sha1(corpo).hexdigest()[:20]}"', corpo)
+
+        if guardar:
+            with self._lock:
+                self._respostas[chave] = pronta
+                while len(self._respostas) > self.max_entradas:
+                    self._respostas.popitem(last=False)
+        return pronta
+
+    def servir(self, porta, endereco='0.0.0.0'):
+        """Sobe (uma vez) um servidor HTTP em segundo plano com GET /disponibilidade."""
+        if self._servidor is not None:
+            return self
+        self._servidor = ThreadingHTTPServer((endereco, porta), _handler(self))
+        threading.Thread(target=self._servidor.serve_forever, name="api-disponibilidade", daemon=True).start()
+        return self
+
+    def parar(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
+
+
+def ler_parametros(query, hoje):
+    """(inicio, dias) da query string. Raises ValueError com a mensagem para o cliente."""
+    parametros = parse_qs(query)
+    try:
+        inicio = datetime.strptime(parametros['inicio'][0], '%Y-%m-%d').date() if 'inicio' in parametros else hoje
+    except ValueError:
+        raise ValueError("inicio precisa estar no formato AAAA-MM-DD") from None
+    try:
+        dias = int(parametros.get('dias', ['1'])[0])
+    except ValueError:
+        raise ValueError("dias precisa ser um número inteiro") from None
+    if inicio < hoje:
+        raise ValueError("inicio não pode ser uma data passada")
+    if not 1 <= dias <= MAX_DIAS:
+        raise ValueError(f"dias precisa estar entre 1 e {MAX_DIAS}")
+    return inicio, dias
+
+
+def _handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            inicio_requisicao = time.perf_counter()
+            url = urlsplit(self.path)
+            if url.path != '/disponibilidade':
+                status = self._enviar_erro(404, "caminho desconhecido (use /disponibilidade)")
+            else:
+                try:
+                    inicio, dias = ler_parametros(url.query, date.today())
+                except ValueError as e:
+                    status = self._enviar_erro(400, str(e))
+                else:
+                    try:
+                        etag, corpo = api.resposta(inicio, dias)
+                    except Exception:
+                        logger.exception("Falha ao montar a disponibilidade de %s (+%d dias)", inicio, dias)
+                        status = self._enviar_erro(503, "disponibilidade indisponível no momento")
+                    else:
+                        status = self._enviar(etag, corpo)
+            if api.metricas is not None:
+                api.metricas.incrementar('agenda_api_requisicoes_total', status=status)
+                api.metricas.observar('agenda_duracao_segundos', time.perf_counter() - inicio_requisicao, span='api.disponibilidade')
+
+        def _enviar(self, etag, corpo):
+            # If-None-Match pode trazer várias ETags separadas por vírgula (ou *)
+            enviadas = {valor.strip() for valor in self.headers.get('If-None-Match', '').split(',')}
+            if etag in enviadas or '*' in enviadas:
+                self.send_response(304)
+                self._cabecalhos_comuns(etag)
+                self.end_headers()
+                return 304
+            self.send_response(200)
+            self._cabecalhos_comuns(etag)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+            return 200
+
+        def _cabecalhos_comuns(self, etag):
+            self.send_header('ETag', etag)
+            # O cliente guarda, mas sempre confirma com If-None-Match (que custa só um 304)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+
+        def _enviar_erro(self, codigo, mensagem):
+            corpo = json.dumps({'erro': mensagem}, ensure_ascii=False).encode()
+            self.send_response(codigo)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(corpo)
+            return codigo
+
+        def log_message(self, *args):
+            pass  # O bot consulta a cada poucos segundos: não precisa ir para o log
+
+    return Handler
+
+
+def main():
+    from agenda_dias import LAYOUT_SLOTS, LAYOUTS
+    from armazenamento import BACKENDS, criar_armazenamento
+    from cache_ocupacao import CacheOcupacao
+    from politica_chamadas import ArmazenamentoProtegido
+
+    parser = argparse.ArgumentParser(description="API JSON com a disponibilidade dos barbeiros.")
+    parser.add_argument("--porta", type=int, default=8502)
+    parser.add_argument("--backend", choices=BACKENDS, default='firestore')
+    parser.add_argument("--credenciais", help="JSON da conta de serviço do Firebase (backend firestore)")
+    parser.add_argument("--layout", choices=LAYOUTS, default=LAYOUT_SLOTS, help="O mesmo LAYOUT_ARMAZENAMENTO do app")
+    parser.add_argument("--sqlite", default="agenda_local.db", help="Arquivo do backend sqlite")
+    parser.add_argument("--ttl", type=int, default=60, help="Segundos que um dia sem listener fica em cache")
+    parser.add_argument("--dias-ouvidos", type=int, default=7, help="Dias à frente com listener em tempo real")
+    args = parser.parse_args()
+
+    db = None
+    if args.backend == 'firestore':
+        if not args.credenciais:
+            parser.error("--backend firestore precisa de --credenciais")
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        firebase_admin.initialize_app(credentials.Certificate(args.credenciais))
+        db = firestore.client()
+
+    # Com o banco lento, a requisição recebe 503 no prazo em vez de ficar presa
+    armazenamento = ArmazenamentoProtegido(criar_armazenamento(args.backend, db, args.layout, args.sqlite))
+    cache = CacheOcupacao(args.ttl)
+    ouvinte = None
+    if armazenamento.tempo_real:
+        from ouvinte_disponibilidade import OuvinteDisponibilidade
+        ouvinte = OuvinteDisponibilidade(db, cache, args.dias_ouvidos, args.layout)
+
+    logging.basicConfig(level=logging.INFO)
+    ApiDisponibilidade(armazenamento, cache, ouvinte=ouvinte).servir(args.porta)
+    print(f"API de disponibilidade em http://0.0.0.0:{args.porta}/disponibilidade")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,800 @@
+import copy
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta, timezone
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from agenda_dias import (
+    COLECAO_AGENDAMENTOS, COLECAO_DIAS, LAYOUT_SLOTS, MAXIMO_ESCRITAS_BATCH, apagar_dias_vazios, apagar_slot,
+    consultar_dias, dia_vazio, escritas_por_slot, grava_dias, grava_slots, gravar_slot, ler_slot, ocupados_lidos,
+    refs_para_verificar,
+)
+from contagem_cancelamentos import cancelamentos_do_mes, registrar_cancelamento
+from eventos_agenda import (
+    adiar_evento, concluir_evento, descartar_evento, eventos_pendentes, registrar_evento, reservar_evento,
+)
+from indice_telefone import (
+    agendamentos_do_telefone, itens_do_indice, normalizar_telefone, registrar_no_indice, remover_do_indice,
+)
+
+BACKENDS = ('firestore', 'sqlite', 'memoria')
+
+
+class Armazenamento(ABC):
+    """
+    Onde os horários ficam guardados. Os dados de cada horário são identificados
+    pelo ID no formato "YYYY-MM-DD_HH:MM_Barbeiro[_BLOQUEADO]" e a ocupação de um
+    dia é o mesmo ocupados_map ({doc_id: dados}) em qualquer backend.
+
+    `reservar` é a única operação que precisa ser atômica: os horários são
+    verificados e gravados juntos, e duas reservas concorrentes do mesmo
+    horário nunca passam as duas.
+    """
+
+    # True se o backend tem listener em tempo real (ver OuvinteDisponibilidade)
+    tempo_real = False
+    # True enquanto o banco está fora do ar e as chamadas são recusadas (ver politica_chamadas.py)
+    modo_degradado = False
+
+    @abstractmethod
+    def ocupacao_periodo(self, ids):
+        """
+        {'YYYY-MM-DD': ocupados_map} dos dias `ids` (em ordem); dias vazios podem faltar.
+        Só esses dias são lidos, mesmo quando não são seguidos (ex: uma série a cada 4 semanas).
+        """
+
+    @abstractmethod
+    def ler(self, doc_id):
+        """Dados do horário, ou None se ele está livre."""
+
+    @abstractmethod
+    def reservar(self, ids_verificar, gravacoes, validar, indice=None, evento=None):
+        """
+        Em uma transação: lê os horários `ids_verificar`, chama `validar(ocupados)`
+        com o conjunto dos que já estão ocupados (ela levanta ValueError se houver
+        conflito) e grava `gravacoes` ({doc_id: dados}). Com `indice`
+        (telefone_normalizado, doc_id, entrada), o índice por telefone é
+        atualizado no mesmo commit; com `evento` (ver eventos_agenda.novo_evento),
+        o evento entra na fila no mesmo commit. Os dois também podem ser listas,
+        para reservar vários agendamentos de uma vez (ver agendamento_recorrente.py).
+        """
+
+    @abstractmethod
+    def gravar(self, doc_id, dados):
+        ...
+
+    @abstractmethod
+    def apagar(self, doc_id, telefone_indice=None, evento=None, cancelamento=None):
+        """
+        Apaga o horário e, com `telefone_indice`, a sua entrada no índice por
+        telefone; com `evento`, grava o evento na fila; com `cancelamento`
+        (mes, barbeiro), soma um no contador de cancelamentos do mês. Tudo no
+        mesmo commit.
+        """
+
+    @abstractmethod
+    def liberar_bloqueios(self, doc_id, ids_bloqueio, pode_liberar):
+        """
+        Em uma transação: lê o horário `doc_id`, chama `pode_liberar(dados ou None)`
+        e, se ela retornar True, apaga os horários `ids_bloqueio`. Um agendamento
+        gravado em `doc_id` entre a leitura e a exclusão faz a transação ler de novo.
+
+        Returns:
+            bool: se os bloqueios foram apagados.
+        """
+
+    @abstractmethod
+    def gravar_lote(self, gravacoes):
+        """
+        Grava muitos horários ({doc_id: dados}) com o mínimo de commits que o backend
+        permite. Sem verificação: quem chama já separou os horários livres.
+
+        Returns:
+            int: quantos commits foram feitos.
+        """
+
+    @abstractmethod
+    def apagar_lote(self, ids, telefones=None):
+        """
+        Apaga muitos horários com o mínimo de commits. Com `telefones`
+        ({doc_id: telefone_normalizado}), as entradas no índice por telefone
+        saem nos mesmos commits.
+
+        Returns:
+            int: quantos commits foram feitos.
+        """
+
+    @abstractmethod
+    def primeiro_dia(self):
+        """'YYYY-MM-DD' do horário mais antigo guardado, ou None se não há nenhum."""
+
+    @abstractmethod
+    def agendamentos_do_telefone(self, telefone, a_partir_de):
+        """Ver indice_telefone.agendamentos_do_telefone."""
+
+    @abstractmethod
+    def remover_do_indice(self, telefone_normalizado, doc_id):
+        ...
+
+    @abstractmethod
+    def cancelamentos_do_mes(self, mes):
+        """Ver contagem_cancelamentos.cancelamentos_do_mes."""
+
+    @abstractmethod
+    def eventos_pendentes(self, limite=50, disponiveis=False):
+        """Ver eventos_agenda.eventos_pendentes."""
+
+    @abstractmethod
+    def reservar_evento(self, evento_id, segundos):
+        """Ver eventos_agenda.reservar_evento."""
+
+    @abstractmethod
+    def adiar_evento(self, evento_id, tentativas, segundos, erro):
+        """Ver eventos_agenda.adiar_evento."""
+
+    @abstractmethod
+    def descartar_evento(self, evento_id, dados, erro):
+        """Tira o evento da fila e o guarda entre os eventos falhos (ver eventos_agenda.descartar_evento)."""
+
+    @abstractmethod
+    def concluir_evento(self, evento_id):
+        """Tira o evento da fila (não é erro se ele já saiu)."""
+
+
+def como_lista(item_ou_lista):
+    """`indice`/`evento` de `reservar`: None, um item (tupla) ou uma lista de itens."""
+    if not item_ou_lista:
+        return []
+    return item_ou_lista if isinstance(item_ou_lista, list) else [item_ou_lista]
+
+
+def resolver_marcadores(dados):
+    """Troca o SERVER_TIMESTAMP pelo horário atual, como o Firestore faria ao gravar."""
+    return {
+        chave: datetime.now(timezone.utc) if valor is firestore.SERVER_TIMESTAMP else valor
+        for chave, valor in dados.items()
+    }
+
+
+# --- Firestore -------------------------------------------------------------------------
+
+def consultar_periodo(db, inicio_id, fim_id):
+    """
+    Uma única consulta por faixa de ID (do dia `inicio_id` até o fim do dia `fim_id`,
+    ambos 'YYYY-MM-DD'), separada por dia: {'YYYY-MM-DD': ocupados_map}.
+    Dias sem nenhum documento não aparecem no resultado.
+    """
+    docs = db.collection(COLECAO_AGENDAMENTOS) \
+             .order_by(FieldPath.document_id()) \
+             .start_at([inicio_id]) \
+             .end_at([fim_id + '\uf8ff']) \
+             .stream()
+
+    por_dia = {}
+    for doc in docs:
+        por_dia.setdefault(doc.id[:10], {})[doc.id] = doc.to_dict()
+    return por_dia
+
+
+# Limite de valores de um filtro 'in' do Firestore
+MAXIMO_VALORES_IN = 30
+
+
+def consultar_datas(db, ids):
+    """
+    Os dias `ids` ('YYYY-MM-DD', não seguidos) numa consulta pelo campo 'data' (até
+    MAXIMO_VALORES_IN dias por consulta), separada por dia como `consultar_periodo`.
+    Todo horário é gravado com 'data' à meia-noite do dia (ver reservas.montar_atendimento).
+    """
+    por_dia = {}
+    for inicio in range(0, len(ids), MAXIMO_VALORES_IN):
+        datas = [datetime.strptime(data_para_id, '%Y-%m-%d') for data_para_id in ids[inicio:inicio + MAXIMO_VALORES_IN]]
+        docs = db.collection(COLECAO_AGENDAMENTOS).where(filter=firestore.FieldFilter('data', 'in', datas)).stream()
+        for doc in docs:
+            por_dia.setdefault(doc.id[:10], {})[doc.id] = doc.to_dict()
+    return por_dia
+
+
+def faixas_de_dias(ids):
+    """Agrupa os dias `ids` (em ordem, 'YYYY-MM-DD') em faixas de dias seguidos: [[primeiro, último]]."""
+    faixas = []
+    for data_para_id in ids:
+        if faixas and date.fromisoformat(data_para_id) - date.fromisoformat(faixas[-1][1]) == timedelta(days=1):
+            faixas[-1][1] = data_para_id
+        else:
+            faixas.append([data_para_id, data_para_id])
+    return faixas
+
+
+def consultar_ocupacao(db, ids, layout=LAYOUT_SLOTS):
+    """
+    Ocupação dos dias `ids` (em ordem, 'YYYY-MM-DD') conforme o layout de armazenamento
+    (ver agenda_dias.py). No layout duplo os slots ainda são a fonte, como em `ler_slot`:
+    antes da migração, o agregado de um dia tem só o que foi gravado depois da troca.
+
+    Nos slots um período contínuo é uma consulta por faixa de ID. Dias espaçados (ex:
+    uma série a cada semana) vêm juntos numa consulta pelo campo 'data', sem ler os
+    dias entre eles; só as faixas de dias seguidos no meio deles têm consulta própria.
+    """
+    if grava_slots(layout):
+        faixas = faixas_de_dias(ids)
+        if len(faixas) == 1:
+            return consultar_periodo(db, ids[0], ids[-1])
+        por_dia = consultar_datas(db, [inicio_id for inicio_id, fim_id in faixas if inicio_id == fim_id])
+        for inicio_id, fim_id in faixas:
+            if inicio_id != fim_id:
+                por_dia.update(consultar_periodo(db, inicio_id, fim_id))
+        return por_dia
+    return consultar_dias(db, ids)
+
+
+class ArmazenamentoFirestore(Armazenamento):
+    """O banco de produção, no layout escolhido (ver agenda_dias.py)."""
+
+    tempo_real = True
+
+    def __init__(self, db, layout=LAYOUT_SLOTS):
+        self.db = db
+        self.layout = layout
+
+    def ocupacao_periodo(self, ids):
+        return consultar_ocupacao(self.db, ids, self.layout)
+
+    def ler(self, doc_id):
+        return ler_slot(self.db, doc_id, self.layout)
+
+    def reservar(self, ids_verificar, gravacoes, validar, indice=None, evento=None):
+        # No layout por dia é uma só leitura (o documento do dia), qualquer que seja o número de horários
+        refs = refs_para_verificar(self.db, ids_verificar, self.layout)
+
+        @firestore.transactional
+        def na_transacao(transaction):
+            # Uma única leitura em lote para todos os horários
+            validar(set(ocupados_lidos(transaction.get_all(refs))))
+            for doc_id, dados in gravacoes.items():
+                gravar_slot(transaction, self.db, doc_id, dados, self.layout)
+            for telefone_normalizado, doc_id, entrada in como_lista(indice):
+                registrar_no_indice(transaction, self.db, telefone_normalizado, doc_id, entrada)
+            for item in como_lista(evento):
+                registrar_evento(transaction, self.db, item)
+
+        na_transacao(self.db.transaction())
+
+    def gravar(self, doc_id, dados):
+        batch = self.db.batch()
+        gravar_slot(batch, self.db, doc_id, dados, self.layout)
+        batch.commit()
+
+    def apagar(self, doc_id, telefone_indice=None, evento=None, cancelamento=None):
+        batch = self.db.batch()
+        apagar_slot(batch, self.db, doc_id, self.layout)
+        if telefone_indice:
+            remover_do_indice(batch, self.db, telefone_indice, doc_id)
+        if evento:
+            registrar_evento(batch, self.db, evento)
+        if cancelamento:
+            registrar_cancelamento(batch, self.db, *cancelamento)
+        batch.commit()
+
+    def liberar_bloqueios(self, doc_id, ids_bloqueio, pode_liberar):
+        refs = refs_para_verificar(self.db, [doc_id], self.layout)
+
+        @firestore.transactional
+        def na_transacao(transaction):
+            if not pode_liberar(ocupados_lidos(transaction.get_all(refs)).get(doc_id)):
+                return False
+            for id_bloqueio in ids_bloqueio:
+                apagar_slot(transaction, self.db, id_bloqueio, self.layout)
+            return True
+
+        return na_transacao(self.db.transaction())
+
+    def gravar_lote(self, gravacoes):
+        return self._em_batches(list(gravacoes.items()),
+                                lambda batch, item: gravar_slot(batch, self.db, item[0], item[1], self.layout))
+
+    def apagar_lote(self, ids, telefones=None):
+        telefones = telefones or {}
+
+        def apagar(batch, doc_id):
+            apagar_slot(batch, self.db, doc_id, self.layout)
+            if doc_id in telefones:
+                remover_do_indice(batch, self.db, telefones[doc_id], doc_id)
+        commits = self._em_batches(list(ids), apagar, lambda doc_id: escritas_por_slot(self.layout) + (doc_id in telefones))
+        if grava_dias(self.layout):
+            # O DELETE_FIELD deixa o documento do dia vazio para trás (ex: mês arquivado)
+            apagar_dias_vazios(self.db, sorted({doc_id[:10] for doc_id in ids}))
+        return commits
+
+    def _em_batches(self, itens, escrever, escritas=None):
+        # Cada horário custa uma escrita por formato gravado (duas no layout duplo), mais a do índice
+        commits = 0
+        batch, no_batch = None, 0
+        for item in itens:
+            custo = escritas(item) if escritas else escritas_por_slot(self.layout)
+            if batch is not None and no_batch + custo > MAXIMO_ESCRITAS_BATCH:
+                batch.commit()
+                commits += 1
+                batch = None
+            if batch is None:
+                batch, no_batch = self.db.batch(), 0
+            escrever(batch, item)
+            no_batch += custo
+        if batch is not None:
+            batch.commit()
+            commits += 1
+        return commits
+
+    def primeiro_dia(self):
+        primeiros = []
+        if grava_slots(self.layout):
+            primeiros += [doc.id[:10] for doc in self.db.collection(COLECAO_AGENDAMENTOS)
+                          .order_by(FieldPath.document_id()).limit(1).stream()]
+        if grava_dias(self.layout):
+            primeiros += self._primeiro_dia_agregado()
+        return min(primeiros) if primeiros else None
+
+    def _primeiro_dia_agregado(self, tamanho_pagina=50):
+        """
+        [dia] do documento agregado mais antigo que ainda tem algum horário ([] se não há).
+        Os documentos vazios de dias que já passaram (deixados por arquivamentos antigos)
+        são apagados no caminho, para não serem lidos de novo a cada execução.
+        """
+        hoje = date.today().strftime('%Y-%m-%d')
+        consulta = self.db.collection(COLECAO_DIAS).order_by(FieldPath.document_id()).limit(tamanho_pagina)
+        ultimo_id = None
+        while True:
+            pagina = list((consulta if ultimo_id is None else consulta.start_after([ultimo_id])).stream())
+            if not pagina:
+                return []
+            vazios = []
+            for doc in pagina:
+                if not dia_vazio(doc.to_dict()):
+                    apagar_dias_vazios(self.db, vazios)
+                    return [doc.id]
+                if doc.id < hoje:
+                    vazios.append(doc.id)
+            apagar_dias_vazios(self.db, vazios)
+            ultimo_id = pagina[-1].id
+
+    def agendamentos_do_telefone(self, telefone, a_partir_de):
+        return agendamentos_do_telefone(self.db, telefone, a_partir_de)
+
+    def remover_do_indice(self, telefone_normalizado, doc_id):
+        batch = self.db.batch()
+        remover_do_indice(batch, self.db, telefone_normalizado, doc_id)
+        batch.commit()
+
+    def cancelamentos_do_mes(self, mes):
+        return cancelamentos_do_mes(self.db, mes)
+
+    def eventos_pendentes(self, limite=50, disponiveis=False):
+        return eventos_pendentes(self.db, limite, disponiveis)
+
+    def reservar_evento(self, evento_id, segundos):
+        return reservar_evento(self.db, evento_id, segundos)
+
+    def adiar_evento(self, evento_id, tentativas, segundos, erro):
+        adiar_evento(self.db, evento_id, tentativas, segundos, erro)
+
+    def descartar_evento(self, evento_id, dados, erro):
+        descartar_evento(self.db, evento_id, dados, erro)
+
+    def concluir_evento(self, evento_id):
+        concluir_evento(self.db, evento_id)
+
+
+# --- Memória ---------------------------------------------------------------------------
+
+class ArmazenamentoMemoria(Armazenamento):
+    """
+    Tudo em dicionários do processo, atrás de um lock. Sem rede e sem disco:
+    serve para rodar o app, testes de carga e profiling offline.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dias = {}       # 'YYYY-MM-DD' -> {doc_id: dados}
+        self._telefones = {}  # telefone normalizado -> {doc_id: entrada}
+        self._eventos = {}    # evento_id -> dados
+        self._eventos_falhos = {}  # evento_id -> dados (ver descartar_evento)
+        self._cancelamentos = {}  # 'AAAA-MM' -> {barbeiro: quantidade}
+
+    def ocupacao_periodo(self, ids):
+        with self._lock:
+            return {data_para_id: copy.deepcopy(self._dias[data_para_id])
+                    for data_para_id in ids if self._dias.get(data_para_id)}
+
+    def ler(self, doc_id):
+        with self._lock:
+            return copy.deepcopy(self._dias.get(doc_id[:10], {}).get(doc_id))
+
+    def reservar(self, ids_verificar, gravacoes, validar, indice=None, evento=None):
+        with self._lock:
+            validar({doc_id for doc_id in ids_verificar if doc_id in self._dias.get(doc_id[:10], {})})
+            for doc_id, dados in gravacoes.items():
+                self._gravar(doc_id, dados)
+            for telefone_normalizado, doc_id, entrada in como_lista(indice):
+                self._telefones.setdefault(telefone_normalizado, {})[doc_id] = copy.deepcopy(entrada)
+            for evento_id, dados in como_lista(evento):
+                self._eventos[evento_id] = copy.deepcopy(dados)
+
+    def gravar(self, doc_id, dados):
+        with self._lock:
+            self._gravar(doc_id, dados)
+
+    def _gravar(self, doc_id, dados):
+        self._dias.setdefault(doc_id[:10], {})[doc_id] = copy.deepcopy(resolver_marcadores(dados))
+
+    def apagar(self, doc_id, telefone_indice=None, evento=None, cancelamento=None):
+        with self._lock:
+            self._dias.get(doc_id[:10], {}).pop(doc_id, None)
+            if telefone_indice:
+                self._telefones.get(telefone_indice, {}).pop(doc_id, None)
+            if evento:
+                self._eventos[evento[0]] = copy.deepcopy(evento[1])
+            if cancelamento:
+                mes, barbeiro = cancelamento
+                por_barbeiro = self._cancelamentos.setdefault(mes, {})
+                por_barbeiro[barbeiro] = por_barbeiro.get(barbeiro, 0) + 1
+
+    def liberar_bloqueios(self, doc_id, ids_bloqueio, pode_liberar):
+        with self._lock:
+            if not pode_liberar(copy.deepcopy(self._dias.get(doc_id[:10], {}).get(doc_id))):
+                return False
+            for id_bloqueio in ids_bloqueio:
+                self._dias.get(id_bloqueio[:10], {}).pop(id_bloqueio, None)
+            return True
+
+    def gravar_lote(self, gravacoes):
+        with self._lock:
+            for doc_id, dados in gravacoes.items():
+                self._gravar(doc_id, dados)
+        return 1
+
+    def apagar_lote(self, ids, telefones=None):
+        telefones = telefones or {}
+        with self._lock:
+            for doc_id in ids:
+                self._dias.get(doc_id[:10], {}).pop(doc_id, None)
+                if doc_id in telefones:
+                    self._telefones.get(telefones[doc_id], {}).pop(doc_id, None)
+        return 1
+
+    def primeiro_dia(self):
+        with self._lock:
+            return min((data_para_id for data_para_id, ocupados_map in self._dias.items() if ocupados_map), default=None)
+
+    def agendamentos_do_telefone(self, telefone, a_partir_de):
+        with self._lock:
+            entradas = copy.deepcopy(self._telefones.get(normalizar_telefone(telefone), {}))
+        return itens_do_indice(entradas, a_partir_de)
+
+    def remover_do_indice(self, telefone_normalizado, doc_id):
+        with self._lock:
+            self._telefones.get(telefone_normalizado, {}).pop(doc_id, None)
+
+    def cancelamentos_do_mes(self, mes):
+        with self._lock:
+            return dict(self._cancelamentos.get(mes, {}))
+
+    def eventos_pendentes(self, limite=50, disponiveis=False):
+        agora = datetime.now(timezone.utc)
+        with self._lock:
+            if disponiveis:
+                ids = sorted((dados['disponivel_em'], evento_id) for evento_id, dados in self._eventos.items()
+                             if dados['disponivel_em'] <= agora)
+                ids = [evento_id for _, evento_id in ids]
+            else:
+                ids = sorted(self._eventos)
+            return [(evento_id, copy.deepcopy(self._eventos[evento_id])) for evento_id in ids[:limite]]
+
+    def reservar_evento(self, evento_id, segundos):
+        agora = datetime.now(timezone.utc)
+        with self._lock:
+            dados = self._eventos.get(evento_id)
+            if dados is None or dados['disponivel_em'] > agora:
+                return None
+            dados['disponivel_em'] = agora + timedelta(seconds=segundos)
+            return copy.deepcopy(dados)
+
+    def adiar_evento(self, evento_id, tentativas, segundos, erro):
+        with self._lock:
+            if evento_id in self._eventos:
+                self._eventos[evento_id].update(tentativas=tentativas, ultimo_erro=erro,
+                                                disponivel_em=datetime.now(timezone.utc) + timedelta(seconds=segundos))
+
+    def descartar_evento(self, evento_id, dados, erro):
+        with self._lock:
+            self._eventos.pop(evento_id, None)
+            self._eventos_falhos[evento_id] = {**copy.deepcopy(dados), 'ultimo_erro': erro,
+                                               'descartado_em': datetime.now(timezone.utc)}
+
+    def concluir_evento(self, evento_id):
+        with self._lock:
+            self._eventos.pop(evento_id, None)
+
+
+# --- SQLite ----------------------------------------------------------------------------
+
+def _codificar(valor):
+    if isinstance(valor, datetime):
+        return {'$data': valor.isoformat()}
+    raise TypeError(f"Tipo não suportado: {type(valor).__name__}")
+
+
+def _decodificar(objeto):
+    if set(objeto) == {'$data'}:
+        return datetime.fromisoformat(objeto['$data'])
+    return objeto
+
+
+def instante(momento):
+    """Datetime em UTC como texto de tamanho fixo, para o SQLite comparar e ordenar como texto."""
+    return momento.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+def para_json(dados):
+    return json.dumps(dados, default=_codificar, ensure_ascii=False)
+
+
+def de_json(texto):
+    return json.loads(texto, object_hook=_decodificar)
+
+
+class ArmazenamentoSQLite(Armazenamento):
+    """
+    Um arquivo SQLite local (ou ":memory:"). `reservar` roda em uma transação
+    BEGIN IMMEDIATE, então a verificação e a gravação são atômicas também
+    entre processos que usam o mesmo arquivo.
+    """
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS agendamentos (
+            doc_id TEXT PRIMARY KEY,
+            dia    TEXT NOT NULL,
+            dados  TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS agendamentos_dia ON agendamentos (dia);
+        CREATE TABLE IF NOT EXISTS telefones (
+            telefone TEXT NOT NULL,
+            doc_id   TEXT NOT NULL,
+            dados    TEXT NOT NULL,
+            PRIMARY KEY (telefone, doc_id)
+        );
+        CREATE TABLE IF NOT EXISTS eventos (
+            evento_id     TEXT PRIMARY KEY,
+            dados         TEXT NOT NULL,
+            disponivel_em TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS eventos_falhos (
+            evento_id TEXT PRIMARY KEY,
+            dados     TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS cancelamentos (
+            mes        TEXT NOT NULL,
+            barbeiro   TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            PRIMARY KEY (mes, barbeiro)
+        );
+    """
+
+    def __init__(self, caminho):
+        # Uma conexão por processo, usada por várias threads (script, pré-carga) atrás do lock
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            if caminho != ':memory:':
+                self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.executescript(self.ESQUEMA)
+            # Arquivos criados antes da coluna: os eventos que já estavam lá ficam disponíveis na hora
+            colunas = {linha[1] for linha in self._conexao.execute("PRAGMA table_info(eventos)")}
+            if 'disponivel_em' not in colunas:
+                self._conexao.execute("ALTER TABLE eventos ADD COLUMN disponivel_em TEXT NOT NULL DEFAULT ''")
+
+    def ocupacao_periodo(self, ids):
+        por_dia = {}
+        marcadores = ",".join("?" * len(ids))
+        with self._lock:
+            linhas = self._conexao.execute(
+                f"SELECT dia, doc_id, dados FROM agendamentos WHERE dia IN ({marcadores})", list(ids)
+            ).fetchall()
+        for dia, doc_id, dados in linhas:
+            por_dia.setdefault(dia, {})[doc_id] = de_json(dados)
+        return por_dia
+
+    def ler(self, doc_id):
+        with self._lock:
+            linha = self._conexao.execute("SELECT dados FROM agendamentos WHERE doc_id = ?", (doc_id,)).fetchone()
+        return None if linha is None else de_json(linha[0])
+
+    def reservar(self, ids_verificar, gravacoes, validar, indice=None, evento=None):
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                marcadores = ",".join("?" * len(ids_verificar))
+                ocupados = {linha[0] for linha in self._conexao.execute(
+                    f"SELECT doc_id FROM agendamentos WHERE doc_id IN ({marcadores})", list(ids_verificar))}
+                validar(ocupados)
+                for doc_id, dados in gravacoes.items():
+                    self._gravar(doc_id, dados)
+                for telefone_normalizado, doc_id, entrada in como_lista(indice):
+                    self._conexao.execute("INSERT OR REPLACE INTO telefones VALUES (?, ?, ?)",
+                                          (telefone_normalizado, doc_id, para_json(entrada)))
+                for item in como_lista(evento):
+                    self._gravar_evento(item)
+                self._conexao.execute("COMMIT")
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def gravar(self, doc_id, dados):
+        with self._lock:
+            self._gravar(doc_id, dados)
+
+    def _gravar(self, doc_id, dados):
+        self._conexao.execute("INSERT OR REPLACE INTO agendamentos VALUES (?, ?, ?)",
+                              (doc_id, doc_id[:10], para_json(resolver_marcadores(dados))))
+
+    def _gravar_evento(self, evento):
+        evento_id, dados = evento
+        self._conexao.execute("INSERT OR REPLACE INTO eventos VALUES (?, ?, ?)",
+                              (evento_id, para_json(dados), instante(dados['disponivel_em'])))
+
+    def apagar(self, doc_id, telefone_indice=None, evento=None, cancelamento=None):
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                self._conexao.execute("DELETE FROM agendamentos WHERE doc_id = ?", (doc_id,))
+                if telefone_indice:
+                    self._conexao.execute("DELETE FROM telefones WHERE telefone = ? AND doc_id = ?",
+                                          (telefone_indice, doc_id))
+                if evento:
+                    self._gravar_evento(evento)
+                if cancelamento:
+                    self._conexao.execute("INSERT INTO cancelamentos VALUES (?, ?, 1) ON CONFLICT (mes, barbeiro) "
+                                          "DO UPDATE SET quantidade = quantidade + 1", cancelamento)
+                self._conexao.execute("COMMIT")
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def liberar_bloqueios(self, doc_id, ids_bloqueio, pode_liberar):
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                linha = self._conexao.execute("SELECT dados FROM agendamentos WHERE doc_id = ?", (doc_id,)).fetchone()
+                liberar = pode_liberar(de_json(linha[0]) if linha else None)
+                if liberar:
+                    self._conexao.executemany("DELETE FROM agendamentos WHERE doc_id = ?",
+                                              [(id_bloqueio,) for id_bloqueio in ids_bloqueio])
+                self._conexao.execute("COMMIT")
+                return liberar
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def gravar_lote(self, gravacoes):
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                for doc_id, dados in gravacoes.items():
+                    self._gravar(doc_id, dados)
+                self._conexao.execute("COMMIT")
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+        return 1
+
+    def apagar_lote(self, ids, telefones=None):
+        telefones = telefones or {}
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                self._conexao.executemany("DELETE FROM agendamentos WHERE doc_id = ?", [(doc_id,) for doc_id in ids])
+                self._conexao.executemany("DELETE FROM telefones WHERE telefone = ? AND doc_id = ?",
+                                          [(telefone, doc_id) for doc_id, telefone in telefones.items()])
+                self._conexao.execute("COMMIT")
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+        return 1
+
+    def primeiro_dia(self):
+        with self._lock:
+            return self._conexao.execute("SELECT MIN(dia) FROM agendamentos").fetchone()[0]
+
+    def agendamentos_do_telefone(self, telefone, a_partir_de):
+        with self._lock:
+            linhas = self._conexao.execute("SELECT doc_id, dados FROM telefones WHERE telefone = ?",
+                                           (normalizar_telefone(telefone),)).fetchall()
+        return itens_do_indice({doc_id: de_json(dados) for doc_id, dados in linhas}, a_partir_de)
+
+    def remover_do_indice(self, telefone_normalizado, doc_id):
+        with self._lock:
+            self._conexao.execute("DELETE FROM telefones WHERE telefone = ? AND doc_id = ?",
+                                  (telefone_normalizado, doc_id))
+
+    def cancelamentos_do_mes(self, mes):
+        with self._lock:
+            linhas = self._conexao.execute("SELECT barbeiro, quantidade FROM cancelamentos WHERE mes = ?", (mes,)).fetchall()
+        return dict(linhas)
+
+    def eventos_pendentes(self, limite=50, disponiveis=False):
+        with self._lock:
+            if disponiveis:
+                linhas = self._conexao.execute(
+                    "SELECT evento_id, dados FROM eventos WHERE disponivel_em <= ? ORDER BY disponivel_em, evento_id LIMIT ?",
+                    (instante(datetime.now(timezone.utc)), limite)).fetchall()
+            else:
+                linhas = self._conexao.execute("SELECT evento_id, dados FROM eventos ORDER BY evento_id LIMIT ?",
+                                               (limite,)).fetchall()
+        return [(evento_id, de_json(dados)) for evento_id, dados in linhas]
+
+    def _atualizar_evento(self, evento_id, dados):
+        self._conexao.execute("UPDATE eventos SET dados = ?, disponivel_em = ? WHERE evento_id = ?",
+                              (para_json(dados), instante(dados['disponivel_em']), evento_id))
+
+    def reservar_evento(self, evento_id, segundos):
+        agora = datetime.now(timezone.utc)
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                linha = self._conexao.execute("SELECT dados, disponivel_em FROM eventos WHERE evento_id = ?",
+                                              (evento_id,)).fetchone()
+                if linha is None or linha[1] > instante(agora):
+                    self._conexao.execute("COMMIT")
+                    return None
+                dados = de_json(linha[0])
+                dados['disponivel_em'] = agora + timedelta(seconds=segundos)
+                self._atualizar_evento(evento_id, dados)
+                self._conexao.execute("COMMIT")
+                return dados
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def adiar_evento(self, evento_id, tentativas, segundos, erro):
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                linha = self._conexao.execute("SELECT dados FROM eventos WHERE evento_id = ?", (evento_id,)).fetchone()
+                if linha is not None:
+                    dados = {**de_json(linha[0]), 'tentativas': tentativas, 'ultimo_erro': erro,
+                             'disponivel_em': datetime.now(timezone.utc) + timedelta(seconds=segundos)}
+                    self._atualizar_evento(evento_id, dados)
+                self._conexao.execute("COMMIT")
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def descartar_evento(self, evento_id, dados, erro):
+        dados = {**dados, 'ultimo_erro': erro, 'descartado_em': datetime.now(timezone.utc)}
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                self._conexao.execute("INSERT OR REPLACE INTO eventos_falhos VALUES (?, ?)", (evento_id, para_json(dados)))
+                self._conexao.execute("DELETE FROM eventos WHERE evento_id = ?", (evento_id,))
+                self._conexao.execute("COMMIT")
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def concluir_evento(self, evento_id):
+        with self._lock:
+            self._conexao.execute("DELETE FROM eventos WHERE evento_id = ?", (evento_id,))
+
+
+def criar_armazenamento(backend, db=None, layout=LAYOUT_SLOTS, caminho_sqlite='agenda_local.db'):
+    """Monta o backend pelo nome (ver BACKENDS). O Firestore precisa do cliente `db`."""
+    if backend == 'firestore':
+        return ArmazenamentoFirestore(db, layout) if db else None
+    if backend == 'sqlite':
+        return ArmazenamentoSQLite(caminho_sqlite)
+    if backend == 'memoria':
+        return ArmazenamentoMemoria()
+    raise ValueError(f"Backend de armazenamento desconhecido: {backend!r} (use um de {BACKENDS})")
@@ -0,0 +1,168 @@
+"""
+Arquivamento dos meses passados: tira da base os agendamentos e bloqueios que já
+aconteceram e guarda cada mês em um arquivo compactado.
+
+Uso (agendado, ex: todo dia 1º no cron ou no Cloud Scheduler):
+    python arquivar_agendamentos.py credenciais.json [--pasta arquivo] [--ate AAAA-MM] [--simular]
+    python arquivar_agendamentos.py --backend sqlite --sqlite agenda_local.db
+
+Para cada mês completo até `--ate` (padrão: o mês passado), a partir do mês do
+horário mais antigo ainda guardado:
+    1. lê o mês inteiro com uma consulta por faixa;
+    2. grava arquivo/AAAA-MM.jsonl.gz (um documento por linha, em ordem de ID),
+       somando ao arquivo que já existir, e confere o que foi gravado;
+    3. só então apaga os documentos em lotes (e as entradas do índice por telefone).
+
+Se parar no meio, é só rodar de novo: o arquivo do mês é completado e o que
+já foi apagado não volta. Relatórios e histórico leem os meses arquivados com
+`ler_mes`.
+"""
+import argparse
+import gzip
+import os
+from datetime import date, datetime, timedelta
+
+from armazenamento import de_json, para_json
+
+# Pasta padrão dos arquivos mensais
+PASTA_ARQUIVO = "arquivo"
+
+
+def caminho_do_mes(pasta, mes):
+    return os.path.join(pasta, f"{mes}.jsonl.gz")
+
+
+def meses_entre(primeiro_mes, ultimo_mes):
+    """'AAAA-MM' de `primeiro_mes` até `ultimo_mes`, inclusive."""
+    ano, mes = map(int, primeiro_mes.split('-'))
+    while f"{ano:04d}-{mes:02d}" <= ultimo_mes:
+        yield f"{ano:04d}-{mes:02d}"
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+
+
+def dias_do_mes(mes):
+    ano, numero = map(int, mes.split('-'))
+    dia = date(ano, numero, 1)
+    dias = []
+    while dia.month == numero:
+        dias.append(dia.strftime('%Y-%m-%d'))
+        dia += timedelta(days=1)
+    return dias
+
+
+def ler_mes(pasta, mes):
+    """{doc_id: dados} do mês arquivado (vazio se o mês não tem arquivo)."""
+    caminho = caminho_do_mes(pasta, mes)
+    if not os.path.exists(caminho):
+        return {}
+    documentos = {}
+    with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+        for linha in arquivo:
+            registro = de_json(linha)
+            documentos[registro['id']] = registro['dados']
+    return documentos
+
+
+def gravar_mes(pasta, mes, documentos):
+    """
+    Grava o arquivo do mês com os documentos já arquivados mais `documentos`.
+    Escreve num arquivo temporário e troca de nome no fim, então um arquivo pela
+    metade nunca substitui o anterior.
+
+    Returns:
+        dict: todos os documentos que ficaram no arquivo.
+    """
+    os.makedirs(pasta, exist_ok=True)
+    todos = ler_mes(pasta, mes)
+    todos.update(documentos)
+    caminho = caminho_do_mes(pasta, mes)
+    temporario = caminho + ".tmp"
+    with gzip.open(temporario, 'wt', encoding='utf-8') as arquivo:
+        for doc_id in sorted(todos):
+            arquivo.write(para_json({'id': doc_id, 'dados': todos[doc_id]}) + "\n")
+    with open(temporario, 'rb') as arquivo:
+        os.fsync(arquivo.fileno())
+    os.replace(temporario, caminho)
+    return todos
+
+
+def arquivar_mes(armazenamento, pasta, mes, simular=False):
+    """
+    Arquiva e apaga os documentos do mês.
+
+    Returns:
+        tuple: (documentos arquivados, commits de exclusão).
+
+    Raises:
+        RuntimeError: se o arquivo gravado não tiver todos os documentos (nada é apagado).
+    """
+    por_dia = armazenamento.ocupacao_periodo(dias_do_mes(mes))
+    documentos = {doc_id: dados for ocupados_map in por_dia.values() for doc_id, dados in ocupados_map.items()}
+    if not documentos or simular:
+        return len(documentos), 0
+
+    gravar_mes(pasta, mes, documentos)
+    conferido = ler_mes(pasta, mes)
+    faltando = set(documentos) - set(conferido)
+    if faltando:
+        raise RuntimeError(f"{mes}: {len(faltando)} documento(s) não foram para o arquivo; nada foi apagado")
+
+    # Só os agendamentos gravados com o índice têm entrada nele
+    telefones = {doc_id: dados['telefone_normalizado'] for doc_id, dados in documentos.items()
+                 if dados.get('telefone_normalizado')}
+    commits = armazenamento.apagar_lote(sorted(documentos), telefones)
+    return len(documentos), commits
+
+
+def arquivar(armazenamento, pasta, ultimo_mes, simular=False):
+    primeiro_dia = armazenamento.primeiro_dia()
+    if primeiro_dia is None or primeiro_dia[:7] > ultimo_mes:
+        print("Nada para arquivar.")
+        return
+    total = 0
+    for mes in meses_entre(primeiro_dia[:7], ultimo_mes):
+        quantidade, commits = arquivar_mes(armazenamento, pasta, mes, simular)
+        total += quantidade
+        if quantidade:
+            destino = "simulação, nada foi gravado" if simular else f"{caminho_do_mes(pasta, mes)}, {commits} commit(s)"
+            print(f"{mes}: {quantidade} documento(s) ({destino})")
+    acao = "encontrado(s)" if simular else "arquivado(s)"
+    print(f"Concluído: {total} documento(s) {acao} até {ultimo_mes}.")
+
+
+def main():
+    from agenda_dias import LAYOUT_SLOTS, LAYOUTS
+    from armazenamento import BACKENDS, criar_armazenamento
+
+    mes_passado = (date.today().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    parser = argparse.ArgumentParser(description="Arquiva os meses passados em arquivos .jsonl.gz.")
+    parser.add_argument("credenciais", nargs="?", help="JSON da conta de serviço do Firebase (backend firestore)")
+    parser.add_argument("--backend", choices=BACKENDS, default='firestore')
+    parser.add_argument("--layout", choices=LAYOUTS, default=LAYOUT_SLOTS, help="O mesmo LAYOUT_ARMAZENAMENTO do app")
+    parser.add_argument("--sqlite", default="agenda_local.db", help="Arquivo do backend sqlite")
+    parser.add_argument("--pasta", default=PASTA_ARQUIVO, help="Onde ficam os arquivos mensais")
+    parser.add_argument("--ate", default=mes_passado, help="Último mês a arquivar (AAAA-MM); padrão: o mês passado")
+    parser.add_argument("--simular", action="store_true", help="Só lê e conta, sem gravar nem apagar")
+    args = parser.parse_args()
+
+    try:
+        datetime.strptime(args.ate, '%Y-%m')
+    except ValueError:
+        parser.error("--ate precisa estar no formato AAAA-MM")
+    if args.ate > mes_passado:
+        parser.error(f"--ate precisa ser um mês que já terminou (até {mes_passado})")
+
+    db = None
+    if args.backend == 'firestore':
+        if not args.credenciais:
+            parser.error("o backend firestore precisa do JSON de credenciais")
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        firebase_admin.initialize_app(credentials.Certificate(args.credenciais))
+        db = firestore.client()
+
+    arquivar(criar_armazenamento(args.backend, db, args.layout, args.sqlite), args.pasta, args.ate, args.simular)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark da geração da imagem de resumo.
+
+Uso:
+    python bench_resumo_imagem.py [repeticoes]
+
+Compara o caminho antigo (decodificar o template e recarregar a fonte a cada
+imagem) com o RenderizadorResumo reaproveitado, em cada formato de saída.
+"""
+import io
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from resumo_imagem import (
+    FORMATOS_SAIDA, LARGURA_MAXIMA_NOME, POSICAO_DETALHES, POSICAO_NOME, COR_TEXTO,
+    TAMANHO_FONTE_CORPO, RenderizadorResumo, texto_resumo,
+)
+
+TEMPLATE = "template_resumo.png"
+FONTE = "font.ttf"
+PEDIDO = dict(
+    nome="Maximiliano Albuquerque de Souza",
+    data="22/08/2025",
+    horario="10:30",
+    barbeiro="Lucas Borges",
+    servicos=["Degradê", "Barba", "Abordagem de visagismo"],
+)
+
+
+def gerar_como_antes(nome, data, horario, barbeiro, servicos):
+    # Reprodução do fluxo anterior, só para comparação
+    img = Image.open(TEMPLATE).convert("RGBA")
+    draw = ImageDraw.Draw(img)
+    tamanho = 85
+    font_nome = ImageFont.truetype(FONTE, tamanho)
+    while font_nome.getbbox(nome)[2] > LARGURA_MAXIMA_NOME and tamanho > 30:
+        tamanho -= 5
+        font_nome = ImageFont.truetype(FONTE, tamanho)
+    font_corpo = ImageFont.truetype(FONTE, TAMANHO_FONTE_CORPO)
+    draw.text(POSICAO_NOME, nome, fill=COR_TEXTO, font=font_nome)
+    draw.multiline_text(POSICAO_DETALHES, texto_resumo(data, horario, barbeiro, servicos),
+                        fill=COR_TEXTO, font=font_corpo, spacing=10)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def medir(funcao, repeticoes):
+    tempos = []
+    resultado = b""
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos), min(tempos), len(resultado)
+
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    inicio = time.perf_counter()
+    renderizador = RenderizadorResumo(TEMPLATE, FONTE)
+    print(f"Carga inicial do renderizador: {(time.perf_counter() - inicio) * 1000:.1f} ms\n")
+
+    print(f"{'caminho':<28}{'mediana (ms)':>14}{'mínimo (ms)':>14}{'tamanho (KB)':>14}")
+    linhas = [("antes (PNG)", lambda: gerar_como_antes(**PEDIDO))]
+    for formato in FORMATOS_SAIDA:
+        linhas.append((f"renderizador ({formato})",
+                       lambda formato=formato: renderizador.renderizar(**PEDIDO, formato=formato)))
+
+    for nome, funcao in linhas:
+        mediana, minimo, tamanho = medir(funcao, repeticoes)
+        print(f"{nome:<28}{mediana:>14.1f}{minimo:>14.1f}{tamanho / 1024:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
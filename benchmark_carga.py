@@ -0,0 +1,340 @@
+"""
+Teste de carga do fluxo de agendamento.
+
+Uso:
+    python benchmark_carga.py [--backend memoria|sqlite|firestore] [--clientes 50] [--acoes 20]
+                              [--dias 7] [--atraso-ms 0] [--semente 1] [--fluxo atual|legado]
+                              [--sem-cache]
+
+Cada cliente é uma thread que olha a disponibilidade da semana, agenda com
+"Sem preferência", agenda corte + barba (dois horários) e cancela, usando as
+mesmas funções do app (carregar_periodo, máscaras, reservar_atendimento,
+cancelar_reserva e o TrabalhadorEventos, que libera o horário seguinte depois do
+cancelamento), sem o Streamlit. No fim mostra:
+
+- latência p50/p95/p99 de cada operação;
+- conflitos (reservas recusadas pela transação) e novas tentativas por agendamento;
+- leituras e escritas por agendamento, contadas como o Firestore cobraria no layout por horário;
+- a conferência final: nenhum agendamento confirmado pode ter sido sobrescrito e
+  nenhum horário pode estar ocupado por dois atendimentos.
+
+--backend firestore usa o emulador (FIRESTORE_EMULATOR_HOST precisa estar definido).
+--atraso-ms soma um atraso a cada chamada ao armazenamento, simulando a ida à rede.
+--fluxo legado reproduz o fluxo antigo, sem transação (verifica, grava o agendamento
+e só depois bloqueia o horário seguinte), para mostrar a janela de agendamento duplo.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from armazenamento import ArmazenamentoFirestore, ArmazenamentoMemoria, ArmazenamentoSQLite
+from cache_ocupacao import CacheOcupacao, carregar_periodo
+from eventos_agenda import AGENDAMENTO_CANCELADO
+from mascara_disponibilidade import mascaras_do_dia
+from metricas import ArmazenamentoMedido, Conta, Metricas
+from regras_horario import BARBEIROS, HORARIOS
+from reservas import cancelar_reserva, dados_bloqueio, horarios_necessarios, horarios_seguintes, reservar_atendimento
+from trabalhador_eventos import TrabalhadorEventos, liberar_horario_seguinte
+
+PESOS_ACOES = {
+    'navegar': 50,
+    'agendar_sem_preferencia': 25,
+    'agendar_corte_barba': 15,
+    'cancelar': 10,
+}
+SERVICOS_SIMPLES = ["Social"]
+SERVICOS_CORTE_BARBA = ["Degradê", "Barba"]
+# Quantas vezes o cliente tenta outro horário depois de um conflito
+MAX_TENTATIVAS = 3
+
+
+class ComAtraso:
+    """Repassa as chamadas para outro backend somando `atraso` segundos a cada uma."""
+
+    def __init__(self, interno, atraso):
+        self.interno = interno
+        self.atraso = atraso
+
+    def __getattr__(self, nome):
+        atributo = getattr(self.interno, nome)
+        if not callable(atributo) or not self.atraso:
+            return atributo
+
+        def com_atraso(*args, **kwargs):
+            time.sleep(self.atraso)
+            return atributo(*args, **kwargs)
+        return com_atraso
+
+
+def reservar_como_antes(armazenamento, data_obj, horario, nome, telefone, servicos, barbeiro, quantidade_bloqueios=0):
+    """Fluxo anterior à transação: cada horário é conferido e gravado em passos separados."""
+    data_para_id = data_obj.strftime('%Y-%m-%d')
+    chave_agendamento = f"{data_para_id}_{horario}_{barbeiro}"
+    seguintes = horarios_seguintes(horario, quantidade_bloqueios)
+    for h in [horario] + seguintes:
+        for sufixo in ("", "_BLOQUEADO"):
+            if armazenamento.ler(f"{data_para_id}_{h}_{barbeiro}{sufixo}") is not None:
+                raise ValueError("Horário já ocupado por outra pessoa.")
+    armazenamento.gravar(chave_agendamento, {
+        'data': data_obj, 'horario': horario, 'nome': nome, 'telefone': telefone,
+        'servicos': servicos, 'barbeiro': barbeiro,
+    })
+    for h in seguintes:
+        armazenamento.gravar(f"{data_para_id}_{h}_{barbeiro}_BLOQUEADO", dados_bloqueio(data_obj, h, barbeiro))
+    return chave_agendamento
+
+
+class Resultados:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias = defaultdict(list)        # operação -> [ms]
+        self.contagens = defaultdict(int)          # evento -> quantidade
+        self.custos = defaultdict(lambda: [0, 0])  # operação -> [leituras, escritas]
+        self.confirmados = {}                      # doc_id -> (telefone, servicos) ainda ativos
+
+    def registrar(self, operacao, inicio, conta):
+        with self._lock:
+            self.latencias[operacao].append((time.perf_counter() - inicio) * 1000)
+            self.custos[operacao][0] += conta.leituras
+            self.custos[operacao][1] += conta.escritas
+
+    def contar(self, evento, quantidade=1):
+        with self._lock:
+            self.contagens[evento] += quantidade
+
+
+class Cliente:
+    def __init__(self, numero, armazenamento, metricas, cache, resultados, dias, inicio, semente, fluxo, trabalhador=None):
+        self.rnd = random.Random(semente * 100003 + numero)
+        self.nome = f"Cliente {numero}"
+        self.telefone = f"(11) 9{numero:04d}-{self.rnd.randrange(10000):04d}"
+        self.armazenamento = armazenamento
+        self.metricas = metricas
+        self.cache = cache
+        self.resultados = resultados
+        self.dias = [inicio + timedelta(days=i) for i in range(dias)]
+        self.reservar = reservar_atendimento if fluxo == 'atual' else reservar_como_antes
+        self.trabalhador = trabalhador
+        self.meus = []  # [(doc_id, servicos)]
+
+    def executar(self, acoes):
+        operacoes = list(PESOS_ACOES)
+        pesos = [PESOS_ACOES[operacao] for operacao in operacoes]
+        for _ in range(acoes):
+            operacao = self.rnd.choices(operacoes, pesos)[0]
+            if operacao == 'cancelar' and not self.meus:
+                operacao = 'navegar'
+            # Leituras e escritas desta operação, contadas pelo ArmazenamentoMedido na conta da thread
+            conta = Conta()
+            self.metricas.usar_conta(conta)
+            inicio = time.perf_counter()
+            getattr(self, operacao)()
+            self.resultados.registrar(operacao, inicio, conta)
+
+    def _ocupacao(self, dia):
+        if self.cache is None:
+            return self.armazenamento.ocupacao_periodo([dia.strftime('%Y-%m-%d')]).get(dia.strftime('%Y-%m-%d'), {})
+        return carregar_periodo(self.armazenamento, self.cache, dia, 1).get(dia.strftime('%Y-%m-%d'), {})
+
+    def navegar(self):
+        dia = self.rnd.choice(self.dias)
+        if self.cache is None:
+            self.armazenamento.ocupacao_periodo([(dia + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)])
+        else:
+            carregar_periodo(self.armazenamento, self.cache, dia, 7)
+
+    def agendar_sem_preferencia(self):
+        self._agendar(SERVICOS_SIMPLES)
+
+    def agendar_corte_barba(self):
+        self._agendar(SERVICOS_CORTE_BARBA)
+
+    def _agendar(self, servicos):
+        quantidade = horarios_necessarios(servicos)
+        dia = self.rnd.choice(self.dias)
+        for tentativa in range(MAX_TENTATIVAS):
+            if tentativa:
+                self.resultados.contar('novas_tentativas')
+            # Como na tela: o cliente escolhe um dos horários que a tabela mostra livres
+            mascaras = mascaras_do_dia(dia, self._ocupacao(dia), BARBEIROS)
+            opcoes = [(indice, barbeiro) for barbeiro in BARBEIROS
+                      for indice in range(len(HORARIOS)) if mascaras[barbeiro].comporta(indice, quantidade)]
+            if not opcoes:
+                self.resultados.contar('dia_lotado')
+                return
+            indice, barbeiro = self.rnd.choice(opcoes)
+            data_obj = datetime(dia.year, dia.month, dia.day)
+            self.resultados.contar('tentativas_de_reserva')
+            try:
+                doc_id = self.reservar(self.armazenamento, data_obj, HORARIOS[indice], self.nome, self.telefone,
+                                       servicos, barbeiro, quantidade - 1)
+            except ValueError:
+                self.resultados.contar('conflitos')
+                continue
+            finally:
+                # Como o app: depois de gravar (ou de um conflito) o dia é lido de novo
+                if self.cache is not None:
+                    self.cache.invalidar(dia.strftime('%Y-%m-%d'))
+            self.meus.append((doc_id, servicos))
+            with self.resultados._lock:
+                self.resultados.confirmados[doc_id] = (self.telefone, servicos)
+            self.resultados.contar('agendamentos')
+            return
+        self.resultados.contar('desistencias')
+
+    def cancelar(self):
+        doc_id, servicos = self.meus.pop(self.rnd.randrange(len(self.meus)))
+        resultado = cancelar_reserva(self.armazenamento, doc_id, self.telefone)
+        if isinstance(resultado, dict):
+            # Como o app: o horário seguinte de um corte + barba é liberado pelo TrabalhadorEventos
+            if self.trabalhador is not None:
+                self.trabalhador.acordar()
+            self.resultados.contar('cancelamentos')
+        else:
+            # O agendamento foi sobrescrito por outro cliente (só acontece sem transação)
+            self.resultados.contar(f'cancelamento_{resultado}')
+        with self.resultados._lock:
+            self.resultados.confirmados.pop(doc_id, None)
+        if self.cache is not None:
+            self.cache.invalidar(doc_id[:10])
+
+
+def conferir(armazenamento, resultados, dias):
+    """Lista de problemas encontrados no estado final do armazenamento."""
+    ids = [dia.strftime('%Y-%m-%d') for dia in dias]
+    ocupados = {}
+    for ocupados_map in armazenamento.ocupacao_periodo(ids).values():
+        ocupados.update(ocupados_map)
+
+    problemas = []
+    for doc_id, (telefone, servicos) in resultados.confirmados.items():
+        dados = ocupados.get(doc_id)
+        if dados is None or dados.get('telefone') != telefone:
+            problemas.append(f"{doc_id}: agendamento confirmado foi sobrescrito ou sumiu")
+            continue
+        data_para_id, horario, barbeiro = doc_id.split('_', 2)
+        for h in horarios_seguintes(horario, horarios_necessarios(servicos) - 1):
+            if f"{data_para_id}_{h}_{barbeiro}" in ocupados:
+                problemas.append(f"{doc_id}: horário seguinte {h} também foi agendado")
+            if f"{data_para_id}_{h}_{barbeiro}_BLOQUEADO" not in ocupados:
+                problemas.append(f"{doc_id}: horário seguinte {h} não ficou bloqueado")
+    # Todo bloqueio do teste é o horário seguinte de um corte + barba: depois do cancelamento
+    # o TrabalhadorEventos precisa tê-lo liberado
+    bloqueios_esperados = set()
+    for doc_id, dados in ocupados.items():
+        if not doc_id.endswith('_BLOQUEADO'):
+            data_para_id, horario, barbeiro = doc_id.split('_', 2)
+            bloqueios_esperados.update(f"{data_para_id}_{h}_{barbeiro}_BLOQUEADO"
+                                       for h in horarios_seguintes(horario, horarios_necessarios(dados.get('servicos', [])) - 1))
+    for doc_id in ocupados:
+        if doc_id.endswith('_BLOQUEADO') and doc_id[:-len('_BLOQUEADO')] in ocupados:
+            problemas.append(f"{doc_id[:-len('_BLOQUEADO')]}: agendado e bloqueado ao mesmo tempo")
+        elif doc_id.endswith('_BLOQUEADO') and doc_id not in bloqueios_esperados:
+            problemas.append(f"{doc_id}: bloqueio de um corte + barba cancelado não foi liberado")
+    return problemas
+
+
+def percentis(valores):
+    if len(valores) < 2:
+        return (valores[0],) * 3 if valores else (0.0,) * 3
+    cortes = statistics.quantiles(valores, n=100, method='inclusive')
+    return cortes[49], cortes[94], cortes[98]
+
+
+def criar_backend(nome, pasta_temporaria):
+    if nome == 'memoria':
+        return ArmazenamentoMemoria()
+    if nome == 'sqlite':
+        return ArmazenamentoSQLite(os.path.join(pasta_temporaria, 'carga.db'))
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("--backend firestore precisa do emulador (defina FIRESTORE_EMULATOR_HOST)")
+    from google.cloud import firestore
+    return ArmazenamentoFirestore(firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-agenda")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do fluxo de agendamento.")
+    parser.add_argument("--backend", choices=('memoria', 'sqlite', 'firestore'), default='memoria')
+    parser.add_argument("--clientes", type=int, default=50, help="Clientes simultâneos (threads)")
+    parser.add_argument("--acoes", type=int, default=20, help="Ações de cada cliente")
+    parser.add_argument("--dias", type=int, default=7, help="Quantos dias a partir de amanhã os clientes disputam")
+    parser.add_argument("--atraso-ms", type=float, default=0.0, help="Atraso somado a cada chamada ao armazenamento")
+    parser.add_argument("--semente", type=int, default=1)
+    parser.add_argument("--fluxo", choices=('atual', 'legado'), default='atual')
+    parser.add_argument("--sem-cache", action="store_true", help="Toda leitura vai ao armazenamento")
+    args = parser.parse_args()
+
+    pasta_temporaria = tempfile.mkdtemp(prefix="carga_agenda_")
+    try:
+        backend = criar_backend(args.backend, pasta_temporaria)
+        # Mesma medição do app: leituras e escritas contadas como o Firestore cobraria no layout por horário
+        metricas = Metricas()
+        armazenamento = ArmazenamentoMedido(ComAtraso(backend, args.atraso_ms / 1000), metricas)
+        cache = None if args.sem_cache else CacheOcupacao(ttl=60)
+        resultados = Resultados()
+        trabalhador = TrabalhadorEventos(armazenamento, {
+            AGENDAMENTO_CANCELADO: [liberar_horario_seguinte(armazenamento, cache)],
+        }).iniciar()
+        inicio_periodo = date.today() + timedelta(days=1)
+        clientes = [Cliente(numero, armazenamento, metricas, cache, resultados, args.dias, inicio_periodo, args.semente, args.fluxo,
+                            trabalhador)
+                    for numero in range(args.clientes)]
+
+        threads = [threading.Thread(target=cliente.executar, args=(args.acoes,)) for cliente in clientes]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+        # A conferência olha o estado final: espera o trabalhador liberar os horários pendentes
+        trabalhador.drenar()
+        trabalhador.parar()
+
+        total_operacoes = sum(len(valores) for valores in resultados.latencias.values())
+        print(f"backend={args.backend} fluxo={args.fluxo} clientes={args.clientes} acoes={args.acoes} "
+              f"dias={args.dias} atraso={args.atraso_ms}ms cache={'não' if args.sem_cache else 'sim'}")
+        print(f"{total_operacoes} operações em {duracao:.2f} s ({total_operacoes / duracao:.0f} op/s)\n")
+
+        print(f"{'operação':<26}{'n':>7}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}{'leit./op':>10}{'escr./op':>10}")
+        for operacao in PESOS_ACOES:
+            valores = resultados.latencias.get(operacao)
+            if not valores:
+                continue
+            p50, p95, p99 = percentis(valores)
+            leituras, escritas = resultados.custos[operacao]
+            print(f"{operacao:<26}{len(valores):>7}{p50:>11.2f}{p95:>11.2f}{p99:>11.2f}"
+                  f"{leituras / len(valores):>10.1f}{escritas / len(valores):>10.1f}")
+
+        c = resultados.contagens
+        tentativas = c['tentativas_de_reserva'] or 1
+        agendamentos = c['agendamentos'] or 1
+        custo_agendar = [sum(resultados.custos[op][i] for op in ('agendar_sem_preferencia', 'agendar_corte_barba')) for i in (0, 1)]
+        print()
+        print(f"agendamentos: {c['agendamentos']}  cancelamentos: {c['cancelamentos']}  "
+              f"dia lotado: {c['dia_lotado']}  desistências: {c['desistencias']}")
+        print(f"conflitos: {c['conflitos']} de {c['tentativas_de_reserva']} reservas ({100 * c['conflitos'] / tentativas:.1f}%)  "
+              f"novas tentativas por agendamento: {c['novas_tentativas'] / agendamentos:.2f}")
+        print(f"por agendamento confirmado: {custo_agendar[0] / agendamentos:.1f} leituras, "
+              f"{custo_agendar[1] / agendamentos:.1f} escritas")
+
+        problemas = conferir(backend, resultados, clientes[0].dias)
+        problemas += [f"cancelamento recusado ({evento[len('cancelamento_'):]}): {quantidade}"
+                      for evento, quantidade in c.items() if evento.startswith('cancelamento_')]
+        print(f"\nconferência: {'OK' if not problemas else f'{len(problemas)} problema(s)'}")
+        for problema in problemas[:20]:
+            print(f"  - {problema}")
+        raise SystemExit(1 if problemas else 0)
+    finally:
+        shutil.rmtree(pasta_temporaria, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+
+from regras_horario import HORARIOS, grade_do_dia
+from reservas import dados_bloqueio, horarios_necessarios
+
+# Maior período que um bloqueio em lote aceita (evita fechar meses por engano)
+MAX_DIAS_LOTE = 62
+
+
+class _HorariosAgendados(ValueError):
+    """Horários agendados depois da leitura do período (a transação do dia não gravou nada)."""
+
+    def __init__(self, ids):
+        super().__init__(f"{len(ids)} horário(s) agendado(s) durante o bloqueio")
+        self.ids = ids
+
+
+def horarios_do_periodo(data_inicio, data_fim, barbeiros, horarios=None):
+    """(data, barbeiro, horário) de cada dia de `data_inicio` a `data_fim` (inclusive); sem `horarios`, o dia inteiro."""
+    horarios = list(HORARIOS) if not horarios else sorted(horarios)
+    for i in range((data_fim - data_inicio).days + 1):
+        data = data_inicio + timedelta(days=i)
+        for barbeiro in barbeiros:
+            for horario in horarios:
+                yield data, barbeiro, horario
+
+
+def _ocupacao(armazenamento, data_inicio, data_fim):
+    if data_fim < data_inicio:
+        raise ValueError("A data final precisa ser igual ou posterior à inicial.")
+    dias = (data_fim - data_inicio).days + 1
+    if dias > MAX_DIAS_LOTE:
+        raise ValueError(f"O período pode ter no máximo {MAX_DIAS_LOTE} dias.")
+    ids = [(data_inicio + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(dias)]
+    # Uma única consulta traz todos os dias do período
+    return ids, armazenamento.ocupacao_periodo(ids)
+
+
+def _resultado(ids_dias):
+    return {
+        'dias': ids_dias,          # dias lidos (o chamador invalida o cache deles)
+        'alterados': [],           # IDs gravados (bloqueio) ou apagados (desbloqueio)
+        'ja_estavam': 0,           # horários que já estavam como pedido
+        'fora_do_expediente': 0,   # horários que as regras já fecham (almoço, domingo...)
+        'conflitos': [],           # (doc_id, motivo) dos horários que foram pulados
+        'commits': 0,
+    }
+
+
+def _bloquear_dia(armazenamento, gravacoes, resultado):
+    """
+    Grava os bloqueios de um dia ({doc_id: dados}) com `armazenamento.reservar`: a
+    transação confere de novo que nenhum dos horários foi agendado desde a leitura.
+    Os que foram vão para 'conflitos' e o resto do dia é gravado numa nova transação.
+    """
+    gravacoes = dict(gravacoes)
+    while gravacoes:
+        agendamentos = [doc_id[:-len('_BLOQUEADO')] for doc_id in gravacoes]
+
+        def validar(ocupados):
+            if ocupados:
+                raise _HorariosAgendados(sorted(ocupados))
+
+        try:
+            armazenamento.reservar(agendamentos, gravacoes, validar)
+        except _HorariosAgendados as e:
+            for chave in e.ids:
+                resultado['conflitos'].append((chave, "agendado enquanto o bloqueio era aplicado"))
+                gravacoes.pop(f"{chave}_BLOQUEADO")
+            continue
+        resultado['commits'] += 1
+        resultado['alterados'] += sorted(gravacoes)
+        return
+
+
+def bloquear_periodo(armazenamento, data_inicio, data_fim, barbeiros, horarios=None):
+    """
+    Bloqueia os horários do período (férias, folga, dia fechado) com uma leitura
+    do período e uma transação por dia.
+
+    Horários com agendamento de cliente não são bloqueados: vão para 'conflitos',
+    para a barbearia remarcar. A transação de cada dia confere os agendamentos de
+    novo, então um agendamento feito entre a leitura e a gravação também vai para
+    'conflitos' em vez de ficar agendado e bloqueado ao mesmo tempo.
+
+    Returns:
+        dict: ver `_resultado`.
+
+    Raises:
+        ValueError: período inválido.
+    """
+    ids_dias, por_dia = _ocupacao(armazenamento, data_inicio, data_fim)
+    resultado = _resultado(ids_dias)
+    por_dia_gravacoes = {}
+    for data, barbeiro, horario in horarios_do_periodo(data_inicio, data_fim, barbeiros, horarios):
+        if grade_do_dia(data, barbeiro).regra(horario):
+            resultado['fora_do_expediente'] += 1
+            continue
+        ocupados_map = por_dia.get(data.strftime('%Y-%m-%d'), {})
+        chave = f"{data.strftime('%Y-%m-%d')}_{horario}_{barbeiro}"
+        agendamento = ocupados_map.get(chave)
+        if f"{chave}_BLOQUEADO" in ocupados_map or (agendamento and agendamento.get('nome') == 'Fechado'):
+            resultado['ja_estavam'] += 1
+        elif agendamento:
+            resultado['conflitos'].append((chave, f"agendado para {agendamento.get('nome', 'cliente')}"))
+        else:
+            # O campo 'data' é gravado como datetime, como no bloqueio avulso (o Firestore não aceita date)
+            data_obj = datetime(data.year, data.month, data.day)
+            por_dia_gravacoes.setdefault(chave[:10], {})[f"{chave}_BLOQUEADO"] = dados_bloqueio(data_obj, horario, barbeiro)
+
+    for data_para_id in sorted(por_dia_gravacoes):
+        _bloquear_dia(armazenamento, por_dia_gravacoes[data_para_id], resultado)
+    resultado['alterados'].sort()
+    return resultado
+
+
+def desbloquear_periodo(armazenamento, data_inicio, data_fim, barbeiros, horarios=None):
+    """
+    Libera os horários bloqueados do período, com uma leitura e exclusões em lote.
+
+    O bloqueio do horário seguinte a um corte + barba faz parte daquele
+    agendamento: ele não é apagado e vai para 'conflitos'.
+
+    Returns:
+        dict: ver `_resultado`.
+
+    Raises:
+        ValueError: período inválido.
+    """
+    ids_dias, por_dia = _ocupacao(armazenamento, data_inicio, data_fim)
+    resultado = _resultado(ids_dias)
+    apagar = []
+    for data, barbeiro, horario in horarios_do_periodo(data_inicio, data_fim, barbeiros, horarios):
+        ocupados_map = por_dia.get(data.strftime('%Y-%m-%d'), {})
+        chave_bloqueio = f"{data.strftime('%Y-%m-%d')}_{horario}_{barbeiro}_BLOQUEADO"
+        if chave_bloqueio not in ocupados_map:
+            resultado['ja_estavam'] += 1
+            continue
+        horario_anterior = (datetime.strptime(horario, '%H:%M') - timedelta(minutes=30)).strftime('%H:%M')
+        anterior = ocupados_map.get(f"{data.strftime('%Y-%m-%d')}_{horario_anterior}_{barbeiro}")
+        if anterior and horarios_necessarios(anterior.get('servicos', [])) > 1:
+            resultado['conflitos'].append((chave_bloqueio, f"faz parte do corte + barba de {anterior.get('nome', 'cliente')} às {horario_anterior}"))
+        else:
+            apagar.append(chave_bloqueio)
+
+    if apagar:
+        resultado['commits'] = armazenamento.apagar_lote(apagar)
+        resultado['alterados'] = apagar
+    return resultado
@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# Instante das entradas invalidadas: sempre passou do TTL, mas o snapshot fica para ultimo_conhecido
+VENCIDA = float('-inf')
+
+
+class CacheOcupacao:
+    """
+    Cache do ocupados_map de cada dia, compartilhado por todas as sessões do processo.
+
+    As entradas são indexadas pela data no formato dos IDs ('YYYY-MM-DD'), expiram
+    após `ttl` segundos e devem ser invalidadas por toda função que grava no dia.
+    Cada invalidação vence a entrada na hora (ela continua guardada para
+    `ultimo_conhecido`) e avança a geração do dia, o que descarta buscas que
+    começaram antes dela (evita guardar um snapshot já desatualizado).
+
+    Dias acompanhados por um listener em tempo real são guardados com `fixar`:
+    não expiram pelo TTL e são substituídos a cada snapshot recebido.
+
+    Todo snapshot guardado recebe uma versão nova (crescente no processo), que
+    identifica o conteúdo: quem deriva algo do snapshot pode guardar o resultado
+    por (dia, versão) e reaproveitá-lo enquanto a versão não mudar.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # 'YYYY-MM-DD' -> (instante, versao, ocupados_map); instante None = fixado, VENCIDA = invalidado
+        self._entradas = {}
+        self._geracoes = {}  # 'YYYY-MM-DD' -> contador de invalidações
+        self._ultima_versao = 0
+
+    def obter(self, data_para_id):
+        """Retorna o ocupados_map do dia, ou None se não houver entrada válida."""
+        entrada = self.obter_com_versao(data_para_id)
+        return None if entrada is None else entrada[1]
+
+    def obter_com_versao(self, data_para_id):
+        """Retorna (versao, ocupados_map) do dia, ou None se não houver entrada válida."""
+        with self._lock:
+            entrada = self._entradas.get(data_para_id)
+            if entrada is None:
+                return None
+            instante, versao, ocupados_map = entrada
+            if instante is not None and time.monotonic() - instante > self.ttl:
+                # A entrada vencida fica guardada para ultimo_conhecido até ser substituída
+                return None
+            return versao, ocupados_map
+
+    def ultimo_conhecido(self, data_para_id):
+        """
+        O último ocupados_map guardado do dia, mesmo vencido ou invalidado (None se
+        o dia nunca foi carregado). Para o modo somente leitura, quando o banco não
+        responde: pode estar desatualizado (ex: sem a gravação que invalidou o dia).
+        """
+        with self._lock:
+            entrada = self._entradas.get(data_para_id)
+            return None if entrada is None else entrada[2]
+
+    def geracao(self, data_para_id):
+        """Marca o início de uma busca; deve ser repassada para `guardar`."""
+        with self._lock:
+            return self._geracoes.get(data_para_id, 0)
+
+    def guardar(self, data_para_id, ocupados_map, geracao):
+        """
+        Guarda o snapshot do dia, a menos que o dia tenha sido invalidado
+        depois de `geracao` ter sido obtida.
+        """
+        with self._lock:
+            if self._geracoes.get(data_para_id, 0) != geracao:
+                return False
+            self._ultima_versao += 1
+            self._entradas[data_para_id] = (time.monotonic(), self._ultima_versao, ocupados_map)
+            return True
+
+    def fixar(self, data_para_id, ocupados_map):
+        """Guarda um snapshot vindo do listener; buscas em andamento são descartadas."""
+        with self._lock:
+            self._ultima_versao += 1
+            self._entradas[data_para_id] = (None, self._ultima_versao, ocupados_map)
+            self._geracoes[data_para_id] = self._geracoes.get(data_para_id, 0) + 1
+
+    def invalidar(self, data_para_id):
+        with self._lock:
+            entrada = self._entradas.get(data_para_id)
+            if entrada is not None:
+                self._entradas[data_para_id] = (VENCIDA,) + entrada[1:]
+            self._geracoes[data_para_id] = self._geracoes.get(data_para_id, 0) + 1
+
+
+def carregar_periodo(armazenamento, cache, data_inicio, dias):
+    """
+    Ocupação de `dias` dias a partir de `data_inicio`: {'YYYY-MM-DD': ocupados_map}.
+
+    Os dias que já estão no cache não vão ao banco (nem os que ficam entre eles); os que
+    faltam vêm todos na mesma chamada ao armazenamento e são guardados no cache um a um
+    (inclusive os dias vazios).
+    Não usa st.*, então pode rodar fora da thread do script.
+    """
+    ids = [(data_inicio + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(dias)]
+    resultado = {}
+    faltando = []
+    for data_para_id in ids:
+        ocupados_map = cache.obter(data_para_id)
+        if ocupados_map is None:
+            faltando.append(data_para_id)
+        else:
+            resultado[data_para_id] = ocupados_map
+
+    if faltando:
+        geracoes = {data_para_id: cache.geracao(data_para_id) for data_para_id in faltando}
+        por_dia = armazenamento.ocupacao_periodo(faltando)
+        for data_para_id in faltando:
+            ocupados_map = por_dia.get(data_para_id, {})
+            cache.guardar(data_para_id, ocupados_map, geracoes[data_para_id])
+            resultado[data_para_id] = ocupados_map
+
+    return resultado
+
+
+class PreCarregador:
+    """
+    Carrega períodos no cache em segundo plano (ex: os dias vizinhos do que está na
+    tela), para que a próxima troca de data já encontre tudo em memória.
+    Pedidos repetidos para um período que ainda está carregando são ignorados.
+    """
+
+    def __init__(self, armazenamento, cache, max_threads=2):
+        self.armazenamento = armazenamento
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="pre-carga")
+        self._lock = threading.Lock()
+        self._em_andamento = set()
+
+    def agendar(self, data_inicio, dias):
+        # Com o banco fora do ar (disjuntor aberto) a pré-carga só daria erro
+        if dias <= 0 or self.armazenamento.modo_degradado:
+            return
+        chave = (data_inicio, dias)
+        with self._lock:
+            if chave in self._em_andamento:
+                return
+            self._em_andamento.add(chave)
+        self._executor.submit(self._carregar, data_inicio, dias)
+
+    def _carregar(self, data_inicio, dias):
+        try:
+            carregar_periodo(self.armazenamento, self.cache, data_inicio, dias)
+        except Exception:
+            logger.exception("Falha ao pré-carregar %d dia(s) a partir de %s", dias, data_inicio)
+        finally:
+            with self._lock:
+                self._em_andamento.discard((data_inicio, dias))
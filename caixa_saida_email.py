@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from email.mime.text import MIMEText
+
+logger = logging.getLogger(__name__)
+
+
+class _Entrega:
+    """Resultado do envio de uma mensagem da fila, para quem espera por ele (ver `enviar`)."""
+
+    def __init__(self):
+        self.concluida = threading.Event()
+        self.erro = None  # A última falha de SMTP, se a caixa desistiu da mensagem
+
+    def concluir(self, erro=None):
+        self.erro = erro
+        self.concluida.set()
+
+
+class CaixaSaidaEmail:
+    """
+    Fila de e-mails enviada por uma thread em segundo plano.
+
+    O script só enfileira a mensagem e segue em frente; a thread reaproveita a
+    mesma sessão SMTP autenticada entre envios, manda as mensagens em lotes e,
+    se o servidor falhar, reconecta e tenta de novo com espera exponencial.
+
+    Com `pasta_spool`, cada mensagem também é gravada em disco até ser entregue,
+    então o que ficou pendente é reenviado quando o processo reinicia.
+    Host, porta e STARTTLS são parâmetros para permitir testar contra um
+    servidor SMTP local. Com `metricas`, conta os e-mails enviados, as tentativas
+    que falharam e as mensagens de que a caixa desistiu.
+    """
+
+    def __init__(self, usuario, senha, host='smtp.gmail.com', porta=587, usar_starttls=True,
+                 remetente=None, destinatario=None, pasta_spool=None, tamanho_lote=20,
+                 max_tentativas=5, espera_base=1.0, espera_maxima=60.0, tempo_ocioso=60.0, metricas=None):
+        self.usuario = usuario
+        self.senha = senha
+        self.host = host
+        self.porta = porta
+        self.usar_starttls = usar_starttls
+        self.remetente = remetente or usuario
+        self.destinatario = destinatario or self.remetente
+        self.pasta_spool = pasta_spool
+        self.tamanho_lote = tamanho_lote
+        self.max_tentativas = max_tentativas
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.tempo_ocioso = tempo_ocioso
+        self.metricas = metricas
+
+        self._fila = queue.Queue()
+        self._thread = None
+        self._smtp = None
+        # Mensagens na fila (ID -> _Entrega) e IDs já entregues pelo processo (os mais
+        # recentes), para ignorar repetições
+        self._lock_ids = threading.Lock()
+        self._entregas = {}
+        self._ids_entregues = OrderedDict()
+        self.max_ids_lembrados = 1000
+
+    def iniciar(self):
+        if self._thread is not None:
+            return self
+        if self.pasta_spool:
+            os.makedirs(self.pasta_spool, exist_ok=True)
+            for mensagem in self._ler_spool():
+                with self._lock_ids:
+                    self._entregas[mensagem['id']] = _Entrega()
+                self._fila.put(mensagem)
+        self._thread = threading.Thread(target=self._trabalhar, name="caixa-saida-email", daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self, timeout=10):
+        """Entrega o que já está na fila (dentro do timeout) e encerra a thread."""
+        if self._thread is not None:
+            self._fila.put(None)  # Sentinela: a thread termina ao chegar nela
+            self._thread.join(timeout)
+            self._thread = None
+
+    def enfileirar(self, assunto, mensagem, destinatario=None, item_id=None):
+        """
+        Agenda o envio e retorna imediatamente o ID da mensagem. Com `item_id`, uma
+        mensagem com o mesmo ID que este processo já tem na fila ou já entregou não
+        é enfileirada de novo.
+        """
+        item_id = item_id or uuid.uuid4().hex
+        self._colocar(assunto, mensagem, destinatario, item_id)
+        return item_id
+
+    def enviar(self, assunto, mensagem, destinatario=None, item_id=None, timeout=120.0):
+        """
+        Como `enfileirar`, mas só retorna quando o servidor SMTP aceita a mensagem.
+
+        Raises:
+            TimeoutError: a mensagem não foi entregue em `timeout` segundos (continua na fila).
+            smtplib.SMTPException, OSError: a caixa desistiu da mensagem depois de `max_tentativas`.
+        """
+        item_id = item_id or uuid.uuid4().hex
+        entrega = self._colocar(assunto, mensagem, destinatario, item_id)
+        if not entrega.concluida.wait(timeout):
+            raise TimeoutError(f"E-mail {item_id} não foi entregue em {timeout:.0f}s")
+        if entrega.erro is not None:
+            raise entrega.erro
+
+    def pendentes(self):
+        return self._fila.qsize()
+
+    def _colocar(self, assunto, mensagem, destinatario, item_id):
+        """Enfileira a mensagem (se o ID ainda não está na fila nem foi entregue) e retorna a _Entrega dela."""
+        with self._lock_ids:
+            entrega = self._entregas.get(item_id)
+            if entrega is not None:
+                return entrega
+            entrega = _Entrega()
+            if item_id in self._ids_entregues:
+                entrega.concluir()
+                return entrega
+            self._entregas[item_id] = entrega
+        item = {
+            'id': item_id,
+            'assunto': assunto,
+            'mensagem': mensagem,
+            'destinatario': destinatario or self.destinatario,
+            'criado_em': time.time(),
+        }
+        if self.pasta_spool:
+            try:
+                self._gravar_spool(item)
+            except Exception as e:
+                # Sem o arquivo a mensagem não vai para a fila: quem já espera por este ID recebe o erro
+                self._finalizar(item, erro=e)
+                raise
+        self._fila.put(item)
+        return entrega
+
+    def _finalizar(self, item, erro=None):
+        """Avisa quem espera pela mensagem. Entregue, o ID é lembrado; com `erro`, pode ser enfileirado de novo."""
+        with self._lock_ids:
+            entrega = self._entregas.pop(item['id'], None)
+            if erro is None:
+                self._ids_entregues[item['id']] = True
+                while len(self._ids_entregues) > self.max_ids_lembrados:
+                    self._ids_entregues.popitem(last=False)
+        if entrega is not None:
+            entrega.concluir(erro)
+
+    def _contar(self, nome, valor=1):
+        if self.metricas is not None:
+            self.metricas.incrementar(nome, valor)
+
+    # --- Thread de envio ---
+
+    def _trabalhar(self):
+        encerrar = False
+        while not encerrar:
+            try:
+                item = self._fila.get(timeout=self.tempo_ocioso)
+            except queue.Empty:
+                # Ninguém mandou nada por um tempo: libera a conexão em vez de deixá-la cair sozinha
+                self._fechar()
+                continue
+
+            # Junta o que já estiver esperando na fila em um único lote
+            encerrar = item is None
+            lote = [] if encerrar else [item]
+            while not encerrar and len(lote) < self.tamanho_lote:
+                try:
+                    proximo = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if proximo is None:
+                    encerrar = True
+                else:
+                    lote.append(proximo)
+
+            if lote:
+                self._enviar_lote(lote)
+        self._fechar()
+
+    def _enviar_lote(self, lote):
+        pendentes = list(lote)
+        tentativa = 0
+        while pendentes:
+            try:
+                smtp = self._conexao()
+                while pendentes:
+                    item = pendentes[0]
+                    smtp.sendmail(self.remetente, [item['destinatario']], self._montar(item).as_string())
+                    self._tirar_do_spool(item)
+                    self._finalizar(item)
+                    self._contar('agenda_emails_enviados_total')
+                    pendentes.pop(0)
+            except (smtplib.SMTPException, OSError) as e:
+                self._fechar()
+                self._contar('agenda_emails_falhas_total')
+                tentativa += 1
+                if tentativa >= self.max_tentativas:
+                    # Com spool a mensagem continua no disco e volta na próxima inicialização
+                    logger.error("Desistindo de %d e-mail(s) após %d tentativas: %s", len(pendentes), tentativa, e)
+                    self._contar('agenda_emails_desistidos_total', len(pendentes))
+                    for item in pendentes:
+                        self._finalizar(item, e)
+                    return
+                espera = min(self.espera_maxima, self.espera_base * 2 ** (tentativa - 1))
+                espera *= random.uniform(0.5, 1.0)  # Jitter para não martelar o servidor em sincronia
+                logger.warning("Falha ao enviar e-mail (tentativa %d): %s. Nova tentativa em %.1fs", tentativa, e, espera)
+                time.sleep(espera)
+
+    def _conexao(self):
+        """Retorna a sessão SMTP aberta, reconectando se o servidor a tiver fechado."""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._fechar()
+
+        smtp = smtplib.SMTP(self.host, self.porta, timeout=30)
+        try:
+            if self.usar_starttls:
+                smtp.starttls()
+            if self.usuario and self.senha:
+                smtp.login(self.usuario, self.senha)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        return smtp
+
+    def _fechar(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+    def _montar(self, item):
+        msg = MIMEText(item['mensagem'])
+        msg['Subject'] = item['assunto']
+        msg['From'] = self.remetente
+        msg['To'] = item['destinatario']
+        return msg
+
+    # --- Spool em disco ---
+
+    def _caminho_spool(self, item_id):
+        return os.path.join(self.pasta_spool, f"{item_id}.json")
+
+    def _gravar_spool(self, item):
+        caminho = self._caminho_spool(item['id'])
+        temporario = caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(item, f, ensure_ascii=False)
+        os.replace(temporario, caminho)  # Troca atômica: nunca fica um arquivo pela metade
+
+    def _ler_spool(self):
+        itens = []
+        for nome in os.listdir(self.pasta_spool):
+            if not nome.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.pasta_spool, nome), encoding="utf-8") as f:
+                    itens.append(json.load(f))
+            except (OSError, ValueError):
+                logger.exception("Ignorando arquivo inválido no spool de e-mail: %s", nome)
+        return sorted(itens, key=lambda item: item.get('criado_em', 0))
+
+    def _tirar_do_spool(self, item):
+        if not self.pasta_spool:
+            return
+        try:
+            os.remove(self._caminho_spool(item['id']))
+        except FileNotFoundError:
+            pass
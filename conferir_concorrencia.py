@@ -0,0 +1,107 @@
+"""
+Conferência da reserva concorrente: muitas threads disputam o mesmo horário ao
+mesmo tempo e exatamente uma pode conseguir, em cada backend.
+
+Uso:
+    python conferir_concorrencia.py [--backend memoria sqlite firestore] [--threads 40] [--rodadas 5]
+
+Em cada rodada as threads esperam numa barreira e chamam reservar_atendimento
+juntas, em duas disputas:
+    - todas pelo mesmo horário simples;
+    - metade por corte + barba às 10:00 (ocupa também as 10:30) e metade por um
+      horário simples às 10:30: também só uma pode passar.
+No fim confere que o documento gravado é do vencedor. Sai com código 1 se algo falhar.
+
+--backend firestore usa o emulador (FIRESTORE_EMULATOR_HOST precisa estar definido).
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+
+from benchmark_carga import criar_backend
+from reservas import reservar_atendimento
+
+
+def disputar(armazenamento, pedidos):
+    """Chama reservar_atendimento(armazenamento, *pedido) em uma thread por pedido, todas juntas."""
+    barreira = threading.Barrier(len(pedidos))
+    vencedores = []
+    erros = []
+
+    def tentar(pedido):
+        barreira.wait()
+        try:
+            vencedores.append((reservar_atendimento(armazenamento, *pedido), pedido))
+        except ValueError:
+            pass  # Horário já ocupado: o esperado para todas menos uma
+        except Exception as e:
+            erros.append(repr(e))
+
+    threads = [threading.Thread(target=tentar, args=(pedido,)) for pedido in pedidos]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return vencedores, erros
+
+
+def conferir_backend(armazenamento, threads, rodadas):
+    """Retorna a lista de problemas encontrados (vazia se tudo certo)."""
+    problemas = []
+    barbeiro = "Aluizio"
+    for rodada in range(rodadas):
+        # Dias úteis diferentes a cada rodada, bem no futuro, para não misturar com dados reais
+        dia = date(2099, 1, 5) + timedelta(weeks=rodada)
+        data_obj = datetime(dia.year, dia.month, dia.day)
+        data_para_id = dia.strftime('%Y-%m-%d')
+
+        pedidos = [(data_obj, "15:00", f"Cliente {i}", f"1190000{i:04d}", ["Social"], barbeiro) for i in range(threads)]
+        vencedores, erros = disputar(armazenamento, pedidos)
+        gravado = armazenamento.ler(f"{data_para_id}_15:00_{barbeiro}")
+        if len(vencedores) != 1 or erros:
+            problemas.append(f"{data_para_id} mesmo horário: {len(vencedores)} reserva(s) aceita(s), erros {erros}")
+        elif not gravado or gravado.get('nome') != vencedores[0][1][2]:
+            problemas.append(f"{data_para_id} mesmo horário: o documento gravado não é do vencedor")
+
+        pedidos = [(data_obj, "10:00", f"Combo {i}", f"1191000{i:04d}", ["Degradê", "Barba"], barbeiro, 1)
+                   if i % 2 == 0 else
+                   (data_obj, "10:30", f"Simples {i}", f"1192000{i:04d}", ["Social"], barbeiro)
+                   for i in range(threads)]
+        vencedores, erros = disputar(armazenamento, pedidos)
+        if len(vencedores) != 1 or erros:
+            problemas.append(f"{data_para_id} horários sobrepostos: {len(vencedores)} reserva(s) aceita(s), erros {erros}")
+        else:
+            ocupados = armazenamento.ocupacao_periodo([data_para_id]).get(data_para_id, {})
+            as_1030 = [doc_id for doc_id in ocupados if doc_id.startswith(f"{data_para_id}_10:30_{barbeiro}")]
+            if len(as_1030) != 1:
+                problemas.append(f"{data_para_id} horários sobrepostos: 10:30 ocupado por {as_1030}")
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confere que reservas concorrentes do mesmo horário não passam juntas.")
+    parser.add_argument("--backend", nargs="+", choices=('memoria', 'sqlite', 'firestore'), default=['memoria', 'sqlite'])
+    parser.add_argument("--threads", type=int, default=40, help="Threads disputando cada horário")
+    parser.add_argument("--rodadas", type=int, default=5)
+    args = parser.parse_args()
+
+    falhou = False
+    for nome in args.backend:
+        pasta_temporaria = tempfile.mkdtemp(prefix="concorrencia_agenda_")
+        try:
+            problemas = conferir_backend(criar_backend(nome, pasta_temporaria), args.threads, args.rodadas)
+        finally:
+            shutil.rmtree(pasta_temporaria, ignore_errors=True)
+        print(f"{nome}: {args.rodadas} rodada(s) x 2 disputas com {args.threads} threads: "
+              f"{'OK' if not problemas else 'FALHOU'}")
+        for problema in problemas:
+            print(f"  - {problema}")
+        falhou = falhou or bool(problemas)
+    sys.exit(1 if falhou else 0)
+
+
+if __name__ == "__main__":
+    main()
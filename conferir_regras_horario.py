@@ -0,0 +1,110 @@
+"""
+Conferência das regras de funcionamento compiladas (regras_horario.py) contra o
+laço original da tabela, que tinha as regras escritas à mão.
+
+Uso:
+    python conferir_regras_horario.py [--dias 400] [--inicio 2025-01-01] [--semente 1]
+
+Para cada dia do período sorteia uma ocupação (agendamentos, bloqueios e
+horários "Fechado") e compara, célula por célula:
+    - o status da tabela (status_do_horario com a grade do dia) com o do laço original;
+    - as máscaras de bits (mascaras_do_dia): um horário é livre só quando a tabela diz "Disponível".
+Sai com código 1 se alguma célula divergir.
+"""
+import argparse
+import random
+import sys
+from datetime import date, timedelta
+
+from mascara_disponibilidade import mascaras_do_dia
+from regras_horario import BARBEIROS, HORARIOS, grade_do_dia
+from tabela_disponibilidade import status_do_horario
+
+
+def status_original(data_obj_tabela, horario, barbeiro, agendamentos_do_dia, data_para_id_tabela):
+    """
+    O laço da tabela antes das regras declaradas, como estava no app. A única diferença:
+    o Lucas às 08:00 fica Indisponível também no sábado, como o formulário já exigia
+    (a tabela antiga mostrava o horário livre, mas o agendamento era recusado).
+    """
+    dia_da_semana_tabela = data_obj_tabela.weekday()
+    intervalo_especial = data_obj_tabela.month == 7 and 10 <= data_obj_tabela.day <= 19
+    if dia_da_semana_tabela < 6 and not intervalo_especial and horario == "08:00" and barbeiro == "Lucas Borges":
+        return "Indisponível"
+    hora_int = int(horario.split(':')[0])
+    chave_agendamento = f"{data_para_id_tabela}_{horario}_{barbeiro}"
+    chave_bloqueio = f"{chave_agendamento}_BLOQUEADO"
+    disponivel = (chave_agendamento not in agendamentos_do_dia) and (chave_bloqueio not in agendamentos_do_dia)
+    dados_agendamento = agendamentos_do_dia.get(chave_agendamento)
+    fechado = bool(dados_agendamento) and dados_agendamento.get('nome') == 'Fechado'
+    if dia_da_semana_tabela < 5:
+        if not intervalo_especial and hora_int in (12, 13):
+            return "Fechado" if fechado else "Almoço"
+        if fechado:
+            return "Fechado"
+        return "Disponível" if disponivel else "Ocupado"
+    elif dia_da_semana_tabela == 5:
+        if fechado:
+            return "Fechado"
+        return "Disponível" if disponivel else "Ocupado"
+    else:
+        if intervalo_especial:
+            if fechado:
+                return "Fechado"
+            return "Disponível" if disponivel else "Ocupado"
+        return "Fechado"
+
+
+def ocupacao_sorteada(rnd, data_para_id, barbeiros):
+    ocupados_map = {}
+    for horario in HORARIOS:
+        for barbeiro in barbeiros:
+            sorteio = rnd.random()
+            if sorteio < 0.2:
+                ocupados_map[f"{data_para_id}_{horario}_{barbeiro}"] = {'nome': 'Cliente'}
+            elif sorteio < 0.3:
+                ocupados_map[f"{data_para_id}_{horario}_{barbeiro}"] = {'nome': 'Fechado'}
+            elif sorteio < 0.4:
+                ocupados_map[f"{data_para_id}_{horario}_{barbeiro}_BLOQUEADO"] = {'nome': 'BLOQUEADO'}
+    return ocupados_map
+
+
+def conferir(inicio, dias, semente, barbeiros=BARBEIROS):
+    """Retorna (células conferidas, lista de divergências)."""
+    rnd = random.Random(semente)
+    celulas = 0
+    divergencias = []
+    for i in range(dias):
+        data = inicio + timedelta(days=i)
+        data_para_id = data.strftime('%Y-%m-%d')
+        ocupados_map = ocupacao_sorteada(rnd, data_para_id, barbeiros)
+        mascaras = mascaras_do_dia(data, ocupados_map, barbeiros)
+        for barbeiro in barbeiros:
+            grade = grade_do_dia(data, barbeiro)
+            for indice, horario in enumerate(HORARIOS):
+                celulas += 1
+                esperado = status_original(data, horario, barbeiro, ocupados_map, data_para_id)
+                status = status_do_horario(grade.regras[indice], ocupados_map, f"{data_para_id}_{horario}_{barbeiro}")
+                livre = bool(mascaras[barbeiro].livres >> indice & 1)
+                if status != esperado or livre != (status == "Disponível"):
+                    divergencias.append(f"{data_para_id} {horario} {barbeiro}: original {esperado}, "
+                                        f"tabela {status}, máscara {'livre' if livre else 'não livre'}")
+    return celulas, divergencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confere as regras compiladas contra o laço original da tabela.")
+    parser.add_argument("--dias", type=int, default=400)
+    parser.add_argument("--inicio", type=date.fromisoformat, default=date(2025, 1, 1), help="Primeiro dia (AAAA-MM-DD)")
+    parser.add_argument("--semente", type=int, default=1)
+    args = parser.parse_args()
+
+    celulas, divergencias = conferir(args.inicio, args.dias, args.semente)
+    for divergencia in divergencias[:50]:
+        print(divergencia)
+    print(f"{celulas} células em {args.dias} dias conferidas: {len(divergencias)} divergência(s).")
+    sys.exit(1 if divergencias else 0)
+
+
+if __name__ == "__main__":
+    main()
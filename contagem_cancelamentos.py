@@ -0,0 +1,24 @@
+from google.cloud import firestore
+
+# Contador de cancelamentos: o agendamento cancelado é apagado, então o cancelamento
+# soma um aqui, no mesmo commit, para a análise de ocupação calcular a taxa.
+# Um documento por mês do agendamento cancelado:
+# cancelamentos/{AAAA-MM} -> {'barbeiros': {barbeiro: quantidade}}
+COLECAO_CANCELAMENTOS = 'cancelamentos'
+
+
+def cancelamento_do_agendamento(doc_id, agendamento):
+    """(mes, barbeiro) que o cancelamento de `doc_id` soma no contador (ver Armazenamento.apagar)."""
+    return doc_id[:7], agendamento.get('barbeiro') or doc_id.split('_')[2]
+
+
+def registrar_cancelamento(escritor, db, mes, barbeiro):
+    """Soma um cancelamento pela transação ou batch `escritor`, sem ler o documento antes."""
+    ref = db.collection(COLECAO_CANCELAMENTOS).document(mes)
+    escritor.set(ref, {'barbeiros': {barbeiro: firestore.Increment(1)}}, merge=True)
+
+
+def cancelamentos_do_mes(db, mes):
+    """{barbeiro: quantidade} dos agendamentos do mês `mes` ('AAAA-MM') que foram cancelados."""
+    doc = db.collection(COLECAO_CANCELAMENTOS).document(mes).get()
+    return dict((doc.to_dict() or {}).get('barbeiros', {})) if doc.exists else {}
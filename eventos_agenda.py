@@ -0,0 +1,98 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# Fila de eventos (outbox): cada agendamento criado ou cancelado grava um documento aqui
+# no mesmo commit da alteração; o TrabalhadorEventos executa as consequências
+# (e-mail, liberar o horário seguinte) e apaga o evento
+COLECAO_EVENTOS = 'eventos'
+# Eventos que falharam `max_tentativas` vezes saem da fila e ficam aqui para análise (dead letter)
+COLECAO_EVENTOS_FALHOS = 'eventos_falhos'
+
+AGENDAMENTO_CRIADO = 'agendamento_criado'
+AGENDAMENTO_CANCELADO = 'agendamento_cancelado'
+
+
+def novo_evento(tipo, doc_id, agendamento):
+    """
+    (evento_id, dados) de um evento do agendamento `doc_id`. Os IDs crescem com o
+    tempo, então a fila é consumida na ordem em que as alterações aconteceram.
+    """
+    evento_id = f"{time.time_ns():020d}-{random.getrandbits(32):08x}"
+    criado_em = datetime.now(timezone.utc)
+    return evento_id, {
+        'tipo': tipo,
+        'doc_id': doc_id,
+        # Cópia dos dados do agendamento, sem o marcador do horário do servidor
+        'agendamento': {chave: valor for chave, valor in agendamento.items() if valor is not firestore.SERVER_TIMESTAMP},
+        'criado_em': criado_em,
+        # Quando o evento pode ser pego: avança enquanto uma réplica o trata (reserva) e
+        # depois de cada falha (espera antes da próxima tentativa)
+        'disponivel_em': criado_em,
+        'tentativas': 0,
+    }
+
+
+def registrar_evento(escritor, db, evento):
+    """Grava o evento pela transação ou batch `escritor` (no mesmo commit da alteração)."""
+    evento_id, dados = evento
+    escritor.set(db.collection(COLECAO_EVENTOS).document(evento_id), dados)
+
+
+def eventos_pendentes(db, limite, disponiveis=False):
+    """
+    [(evento_id, dados)] dos eventos mais antigos ainda não concluídos. Com
+    `disponiveis`, só os que podem ser pegos agora (nem reservados nem esperando
+    a próxima tentativa), na ordem em que ficaram disponíveis.
+    """
+    colecao = db.collection(COLECAO_EVENTOS)
+    if disponiveis:
+        consulta = colecao.where('disponivel_em', '<=', datetime.now(timezone.utc)).order_by('disponivel_em')
+    else:
+        consulta = colecao.order_by(FieldPath.document_id())
+    return [(doc.id, doc.to_dict()) for doc in consulta.limit(limite).stream()]
+
+
+def reservar_evento(db, evento_id, segundos):
+    """
+    Pega o evento por `segundos` numa transação: retorna os dados, ou None se ele já
+    saiu da fila ou outra réplica o pegou antes. Se a réplica cair no meio, o evento
+    volta a ficar disponível quando a reserva vence.
+    """
+    ref = db.collection(COLECAO_EVENTOS).document(evento_id)
+
+    @firestore.transactional
+    def reservar(transaction):
+        doc, = transaction.get_all([ref])
+        agora = datetime.now(timezone.utc)
+        if not doc.exists or doc.get('disponivel_em') > agora:
+            return None
+        transaction.update(ref, {'disponivel_em': agora + timedelta(seconds=segundos)})
+        return doc.to_dict()
+
+    return reservar(db.transaction())
+
+
+def adiar_evento(db, evento_id, tentativas, segundos, erro):
+    """Registra a falha: o evento volta a ficar disponível daqui a `segundos`."""
+    db.collection(COLECAO_EVENTOS).document(evento_id).update({
+        'tentativas': tentativas,
+        'disponivel_em': datetime.now(timezone.utc) + timedelta(seconds=segundos),
+        'ultimo_erro': erro,
+    })
+
+
+def descartar_evento(db, evento_id, dados, erro):
+    """Move o evento para COLECAO_EVENTOS_FALHOS (no mesmo commit em que sai da fila)."""
+    batch = db.batch()
+    batch.set(db.collection(COLECAO_EVENTOS_FALHOS).document(evento_id),
+              {**dados, 'ultimo_erro': erro, 'descartado_em': datetime.now(timezone.utc)})
+    batch.delete(db.collection(COLECAO_EVENTOS).document(evento_id))
+    batch.commit()
+
+
+def concluir_evento(db, evento_id):
+    db.collection(COLECAO_EVENTOS).document(evento_id).delete()
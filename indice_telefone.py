@@ -0,0 +1,70 @@
+import re
+
+from google.cloud import firestore
+
+# Índice secundário: um documento por telefone normalizado, com os agendamentos dele
+# telefones/{telefone} -> {'agendamentos': {doc_id: {'data', 'horario', 'barbeiro', 'servicos'}}}
+COLECAO_TELEFONES = 'telefones'
+
+_NAO_DIGITOS = re.compile(r'\D')
+
+
+def normalizar_telefone(telefone):
+    """
+    Forma canônica do telefone: só os dígitos, sem o código do país (55) quando
+    ele vem junto de DDD + número. "(11) 98765-4321", "+55 11 98765 4321" e
+    "11987654321" viram todos "11987654321".
+    """
+    digitos = _NAO_DIGITOS.sub('', telefone or '')
+    if len(digitos) in (12, 13) and digitos.startswith('55'):
+        digitos = digitos[2:]
+    return digitos
+
+
+def entrada_indice(data_para_id, horario, barbeiro, servicos):
+    """O que o índice guarda de cada agendamento: o bastante para listar e cancelar."""
+    return {
+        'data': data_para_id,
+        'horario': horario,
+        'barbeiro': barbeiro,
+        'servicos': list(servicos),
+    }
+
+
+def registrar_no_indice(escritor, db, telefone_normalizado, doc_id, entrada):
+    """
+    Acrescenta o agendamento ao documento do telefone. `escritor` é a transação
+    (ou batch) do próprio agendamento: o índice é gravado no mesmo commit e, por
+    usar merge, não precisa ser lido antes.
+    """
+    ref = db.collection(COLECAO_TELEFONES).document(telefone_normalizado)
+    escritor.set(ref, {'agendamentos': {doc_id: entrada}}, merge=True)
+
+
+def remover_do_indice(escritor, db, telefone_normalizado, doc_id):
+    ref = db.collection(COLECAO_TELEFONES).document(telefone_normalizado)
+    escritor.set(ref, {'agendamentos': {doc_id: firestore.DELETE_FIELD}}, merge=True)
+
+
+def agendamentos_do_telefone(db, telefone, a_partir_de):
+    """
+    Agendamentos do telefone a partir da data `a_partir_de` ('YYYY-MM-DD'), em
+    ordem de data e horário, com UMA leitura (o documento do índice).
+
+    Returns:
+        list: dicts com 'doc_id', 'data', 'horario', 'barbeiro' e 'servicos'.
+    """
+    telefone_normalizado = normalizar_telefone(telefone)
+    if not telefone_normalizado:
+        return []
+    doc = db.collection(COLECAO_TELEFONES).document(telefone_normalizado).get()
+    if not doc.exists:
+        return []
+    return itens_do_indice((doc.to_dict() or {}).get('agendamentos', {}), a_partir_de)
+
+
+def itens_do_indice(entradas, a_partir_de):
+    """Entradas do índice ({doc_id: entrada}) a partir de `a_partir_de`, como lista ordenada."""
+    itens = [dict(entrada, doc_id=doc_id) for doc_id, entrada in entradas.items()
+             if entrada.get('data', '') >= a_partir_de]
+    return sorted(itens, key=lambda item: (item['data'], item['horario'], item['barbeiro']))
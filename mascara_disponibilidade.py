@@ -0,0 +1,127 @@
+from collections import namedtuple
+
+from regras_horario import HORARIOS, INDICE_HORARIO, grade_do_dia
+
+# Um bit por horário de HORARIOS: o bit i vale para HORARIOS[i]
+TODOS_OS_HORARIOS = (1 << len(HORARIOS)) - 1
+
+
+class MascaraDia(namedtuple("MascaraDia", ["agendado", "bloqueado", "almoco", "fechado", "indisponivel"])):
+    """
+    Ocupação de um barbeiro em um dia como máscaras de bits (24 horários de 30 min).
+
+    - agendado: existe um agendamento no horário
+    - bloqueado: existe um documento "_BLOQUEADO" (horário seguinte de um corte + barba)
+    - almoco: horário de almoço pelas regras (e não fechado manualmente)
+    - fechado: domingo, ou horário marcado como "Fechado" no banco
+    - indisponivel: demais regras que impedem o agendamento (ex: Lucas às 08:00)
+    """
+
+    __slots__ = ()
+
+    @property
+    def livres(self):
+        return TODOS_OS_HORARIOS & ~(self.agendado | self.bloqueado | self.almoco | self.fechado | self.indisponivel)
+
+    @property
+    def ocupados(self):
+        return self.agendado | self.bloqueado
+
+    def inicios_possiveis(self, quantidade=1):
+        """
+        Máscara dos horários onde cabe um atendimento de `quantidade` horários: o
+        primeiro precisa estar livre e os seguintes só não podem ter agendamento
+        nem bloqueio (e precisam existir antes do fim do dia).
+        """
+        inicios = self.livres
+        for deslocamento in range(1, quantidade):
+            inicios &= ~(self.ocupados >> deslocamento) & (TODOS_OS_HORARIOS >> deslocamento)
+        return inicios
+
+    def comporta(self, indice, quantidade=1):
+        return 0 <= indice < len(HORARIOS) and bool(self.inicios_possiveis(quantidade) >> indice & 1)
+
+    def primeiro_livre(self, a_partir_de=0, quantidade=1):
+        """Índice do primeiro horário (>= a_partir_de) que comporta o atendimento, ou None."""
+        inicios = self.inicios_possiveis(quantidade) >> a_partir_de << a_partir_de
+        if not inicios:
+            return None
+        # O bit menos significativo ligado é o primeiro horário que serve
+        return (inicios & -inicios).bit_length() - 1
+
+
+def _bit(horario):
+    indice = INDICE_HORARIO.get(horario)
+    return 0 if indice is None else 1 << indice
+
+
+def mascaras_do_dia(data, ocupados_map, barbeiros):
+    """
+    Monta a MascaraDia de cada barbeiro a partir do ocupados_map retornado por
+    buscar_agendamentos_e_bloqueios_do_dia (IDs no formato "YYYY-MM-DD_HH:MM_Barbeiro[_BLOQUEADO]").
+    """
+    agendado = dict.fromkeys(barbeiros, 0)
+    bloqueado = dict.fromkeys(barbeiros, 0)
+    fechado_manual = dict.fromkeys(barbeiros, 0)
+
+    for doc_id, dados in ocupados_map.items():
+        partes = doc_id.split('_', 2)
+        if len(partes) < 3:
+            continue
+        _, horario, resto = partes
+        if resto.endswith('_BLOQUEADO'):
+            barbeiro = resto[:-len('_BLOQUEADO')]
+            if barbeiro in bloqueado:
+                bloqueado[barbeiro] |= _bit(horario)
+        elif resto in agendado:
+            agendado[resto] |= _bit(horario)
+            if dados and dados.get('nome') == 'Fechado':
+                fechado_manual[resto] |= _bit(horario)
+
+    mascaras = {}
+    for barbeiro in barbeiros:
+        almoco = fechado = indisponivel = 0
+        for indice, regra in enumerate(grade_do_dia(data, barbeiro).regras):
+            if regra is None:
+                continue
+            bit = 1 << indice
+            if regra.respeita_fechado and fechado_manual[barbeiro] & bit:
+                continue
+            if regra.status == "Almoço":
+                almoco |= bit
+            elif regra.status == "Fechado":
+                fechado |= bit
+            else:
+                indisponivel |= bit
+        mascaras[barbeiro] = MascaraDia(
+            agendado=agendado[barbeiro],
+            bloqueado=bloqueado[barbeiro],
+            almoco=almoco,
+            fechado=fechado | fechado_manual[barbeiro],
+            indisponivel=indisponivel,
+        )
+    return mascaras
+
+
+def escolher_barbeiro(mascaras, horario, candidatos, quantidade=1):
+    """
+    Primeiro barbeiro de `candidatos` (em ordem de preferência) que comporta um
+    atendimento de `quantidade` horários começando em `horario`, ou None.
+    """
+    indice = INDICE_HORARIO.get(horario)
+    if indice is None:
+        return None
+    for barbeiro in candidatos:
+        if mascaras[barbeiro].comporta(indice, quantidade):
+            return barbeiro
+    return None
+
+
+def primeiro_horario_livre(mascaras, candidatos, a_partir_de=0, quantidade=1):
+    """(horário, barbeiro) livre mais cedo entre os candidatos, ou None."""
+    melhor = None
+    for barbeiro in candidatos:
+        indice = mascaras[barbeiro].primeiro_livre(a_partir_de, quantidade)
+        if indice is not None and (melhor is None or indice < melhor[0]):
+            melhor = (indice, barbeiro)
+    return None if melhor is None else (HORARIOS[melhor[0]], melhor[1])
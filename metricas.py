@@ -0,0 +1,297 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from armazenamento import Armazenamento, como_lista
+
+logger = logging.getLogger(__name__)
+
+# Limites dos buckets dos histogramas, como no Prometheus: duração em segundos e documentos por execução
+BUCKETS_DURACAO = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKETS_DOCUMENTOS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+
+class Conta:
+    """Custo acumulado de uma execução do script (ou de uma sessão inteira, somando execuções)."""
+
+    def __init__(self):
+        self.inicio = time.time()
+        self.leituras = 0
+        self.escritas = 0
+        self.spans = {}  # nome -> [quantidade, segundos]
+
+    def somar(self, outra):
+        self.leituras += outra.leituras
+        self.escritas += outra.escritas
+        for nome, (quantidade, segundos) in outra.spans.items():
+            acumulado = self.spans.setdefault(nome, [0, 0.0])
+            acumulado[0] += quantidade
+            acumulado[1] += segundos
+
+    def como_dict(self):
+        return {
+            'leituras': self.leituras,
+            'escritas': self.escritas,
+            'spans_ms': {nome: round(segundos * 1000, 2) for nome, (_, segundos) in self.spans.items()},
+        }
+
+
+class Metricas:
+    """
+    Contadores e histogramas do processo, no formato de texto do Prometheus.
+
+    Além dos totais do processo, cada thread pode ter uma Conta ativa (ver
+    `usar_conta`): spans e documentos lidos/gravados naquela thread também são
+    somados nela. O app usa uma Conta por execução do script.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}    # (nome, labels) -> valor
+        self._histogramas = {}   # (nome, labels) -> (buckets, [contagem por bucket..., soma, total])
+        self._local = threading.local()
+        self._servidor = None
+
+    # --- Conta da thread ------------------------------------------------------------
+
+    def usar_conta(self, conta):
+        self._local.conta = conta
+
+    def conta_atual(self):
+        return getattr(self._local, 'conta', None)
+
+    # --- Registro -------------------------------------------------------------------
+
+    def incrementar(self, nome, valor=1, **labels):
+        chave = (nome, tuple(sorted(labels.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, nome, valor, buckets=BUCKETS_DURACAO, **labels):
+        chave = (nome, tuple(sorted(labels.items())))
+        with self._lock:
+            if chave not in self._histogramas:
+                self._histogramas[chave] = (buckets, [0] * len(buckets) + [0, 0])
+            buckets, histograma = self._histogramas[chave]
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    histograma[i] += 1
+            histograma[-2] += valor
+            histograma[-1] += 1
+
+    @contextmanager
+    def span(self, nome):
+        """Mede o bloco: histograma agenda_duracao_segundos{span=nome} e a Conta da thread."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            self.observar('agenda_duracao_segundos', duracao, span=nome)
+            conta = self.conta_atual()
+            if conta is not None:
+                acumulado = conta.spans.setdefault(nome, [0, 0.0])
+                acumulado[0] += 1
+                acumulado[1] += duracao
+
+    def contar_documentos(self, operacao, leituras=0, escritas=0):
+        if leituras:
+            self.incrementar('agenda_documentos_lidos_total', leituras, operacao=operacao)
+        if escritas:
+            self.incrementar('agenda_documentos_gravados_total', escritas, operacao=operacao)
+        conta = self.conta_atual()
+        if conta is not None:
+            conta.leituras += leituras
+            conta.escritas += escritas
+
+    def registrar_execucao(self, conta, sessao):
+        """Fecha a Conta de uma execução: soma nos totais e grava uma linha de log estruturado."""
+        self.incrementar('agenda_execucoes_total')
+        self.observar('agenda_execucao_documentos_lidos', conta.leituras, buckets=BUCKETS_DOCUMENTOS)
+        logger.info(json.dumps({'evento': 'execucao', 'sessao': sessao, **conta.como_dict()}))
+
+    # --- Exposição ------------------------------------------------------------------
+
+    def totais(self):
+        """{nome{labels}: valor} dos contadores, para o painel de depuração."""
+        with self._lock:
+            return {_nome_com_labels(nome, labels): valor for (nome, labels), valor in sorted(self._contadores.items())}
+
+    def texto_prometheus(self):
+        linhas = []
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((chave, buckets, list(valores)) for chave, (buckets, valores) in self._histogramas.items())
+        tipos_escritos = set()
+        for (nome, labels), valor in contadores:
+            if nome not in tipos_escritos:
+                linhas.append(f"# TYPE {nome} counter")
+                tipos_escritos.add(nome)
+            linhas.append(f"{_nome_com_labels(nome, labels)} {valor}")
+        for (nome, labels), buckets, valores in histogramas:
+            if nome not in tipos_escritos:
+                linhas.append(f"# TYPE {nome} histogram")
+                tipos_escritos.add(nome)
+            for limite, quantidade in zip(buckets, valores):
+                linhas.append(f"{_nome_com_labels(nome + '_bucket', labels + (('le', str(limite)),))} {quantidade}")
+            linhas.append(f"{_nome_com_labels(nome + '_bucket', labels + (('le', '+Inf'),))} {valores[-1]}")
+            linhas.append(f"{_nome_com_labels(nome + '_sum', labels)} {valores[-2]}")
+            linhas.append(f"{_nome_com_labels(nome + '_count', labels)} {valores[-1]}")
+        return "\n".join(linhas) + "\n"
+
+    def servir(self, porta, endereco='0.0.0.0'):
+        """Sobe (uma vez) um servidor HTTP em segundo plano com o texto em /metrics."""
+        if self._servidor is not None:
+            return self
+        metricas = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                corpo = metricas.texto_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass  # Um scrape a cada 15 s não precisa ir para o log
+
+        self._servidor = ThreadingHTTPServer((endereco, porta), Handler)
+        threading.Thread(target=self._servidor.serve_forever, name="metricas-http", daemon=True).start()
+        return self
+
+
+def _nome_com_labels(nome, labels):
+    if not labels:
+        return nome
+    return nome + "{" + ",".join(f'{chave}="{valor}"' for chave, valor in labels) + "}"
+
+
+class ArmazenamentoMedido(Armazenamento):
+    """
+    Repassa as chamadas para outro backend medindo cada uma (span
+    "armazenamento.<método>") e contando documentos lidos e gravados como o
+    Firestore cobraria no layout por horário.
+    """
+
+    def __init__(self, interno, metricas):
+        self.interno = interno
+        self.metricas = metricas
+
+    @property
+    def tempo_real(self):
+        return self.interno.tempo_real
+
+    @property
+    def modo_degradado(self):
+        return self.interno.modo_degradado
+
+    def ocupacao_periodo(self, ids):
+        with self.metricas.span('armazenamento.ocupacao_periodo'):
+            por_dia = self.interno.ocupacao_periodo(ids)
+        # Uma consulta cobra pelo menos uma leitura, mesmo sem resultado
+        self.metricas.contar_documentos('ocupacao_periodo', leituras=max(1, sum(len(ocupados_map) for ocupados_map in por_dia.values())))
+        return por_dia
+
+    def ler(self, doc_id):
+        with self.metricas.span('armazenamento.ler'):
+            dados = self.interno.ler(doc_id)
+        self.metricas.contar_documentos('ler', leituras=1)
+        return dados
+
+    def reservar(self, ids_verificar, gravacoes, validar, indice=None, evento=None):
+        try:
+            with self.metricas.span('armazenamento.reservar'):
+                self.interno.reservar(ids_verificar, gravacoes, validar, indice, evento)
+        except ValueError:
+            self.metricas.incrementar('agenda_conflitos_total')
+            self.metricas.contar_documentos('reservar', leituras=len(ids_verificar))
+            raise
+        self.metricas.contar_documentos('reservar', leituras=len(ids_verificar),
+                                        escritas=len(gravacoes) + len(como_lista(indice)) + len(como_lista(evento)))
+
+    def gravar(self, doc_id, dados):
+        with self.metricas.span('armazenamento.gravar'):
+            self.interno.gravar(doc_id, dados)
+        self.metricas.contar_documentos('gravar', escritas=1)
+
+    def apagar(self, doc_id, telefone_indice=None, evento=None, cancelamento=None):
+        with self.metricas.span('armazenamento.apagar'):
+            self.interno.apagar(doc_id, telefone_indice, evento, cancelamento)
+        self.metricas.contar_documentos('apagar', escritas=1 + (1 if telefone_indice else 0) + (1 if evento else 0)
+                                        + (1 if cancelamento else 0))
+
+    def liberar_bloqueios(self, doc_id, ids_bloqueio, pode_liberar):
+        with self.metricas.span('armazenamento.liberar_bloqueios'):
+            liberados = self.interno.liberar_bloqueios(doc_id, ids_bloqueio, pode_liberar)
+        self.metricas.contar_documentos('liberar_bloqueios', leituras=1, escritas=len(ids_bloqueio) if liberados else 0)
+        return liberados
+
+    def gravar_lote(self, gravacoes):
+        with self.metricas.span('armazenamento.gravar_lote'):
+            commits = self.interno.gravar_lote(gravacoes)
+        self.metricas.contar_documentos('gravar_lote', escritas=len(gravacoes))
+        return commits
+
+    def apagar_lote(self, ids, telefones=None):
+        with self.metricas.span('armazenamento.apagar_lote'):
+            commits = self.interno.apagar_lote(ids, telefones)
+        self.metricas.contar_documentos('apagar_lote', escritas=len(ids) + len(telefones or {}))
+        return commits
+
+    def primeiro_dia(self):
+        with self.metricas.span('armazenamento.primeiro_dia'):
+            primeiro = self.interno.primeiro_dia()
+        self.metricas.contar_documentos('primeiro_dia', leituras=1)
+        return primeiro
+
+    def agendamentos_do_telefone(self, telefone, a_partir_de):
+        with self.metricas.span('armazenamento.agendamentos_do_telefone'):
+            itens = self.interno.agendamentos_do_telefone(telefone, a_partir_de)
+        self.metricas.contar_documentos('agendamentos_do_telefone', leituras=1)
+        return itens
+
+    def remover_do_indice(self, telefone_normalizado, doc_id):
+        with self.metricas.span('armazenamento.remover_do_indice'):
+            self.interno.remover_do_indice(telefone_normalizado, doc_id)
+        self.metricas.contar_documentos('remover_do_indice', escritas=1)
+
+    def cancelamentos_do_mes(self, mes):
+        with self.metricas.span('armazenamento.cancelamentos_do_mes'):
+            cancelamentos = self.interno.cancelamentos_do_mes(mes)
+        self.metricas.contar_documentos('cancelamentos_do_mes', leituras=1)
+        return cancelamentos
+
+    def eventos_pendentes(self, limite=50, disponiveis=False):
+        with self.metricas.span('armazenamento.eventos_pendentes'):
+            eventos = self.interno.eventos_pendentes(limite, disponiveis)
+        self.metricas.contar_documentos('eventos_pendentes', leituras=max(1, len(eventos)))
+        return eventos
+
+    def reservar_evento(self, evento_id, segundos):
+        with self.metricas.span('armazenamento.reservar_evento'):
+            dados = self.interno.reservar_evento(evento_id, segundos)
+        self.metricas.contar_documentos('reservar_evento', leituras=1, escritas=1 if dados is not None else 0)
+        return dados
+
+    def adiar_evento(self, evento_id, tentativas, segundos, erro):
+        with self.metricas.span('armazenamento.adiar_evento'):
+            self.interno.adiar_evento(evento_id, tentativas, segundos, erro)
+        self.metricas.contar_documentos('adiar_evento', escritas=1)
+
+    def descartar_evento(self, evento_id, dados, erro):
+        with self.metricas.span('armazenamento.descartar_evento'):
+            self.interno.descartar_evento(evento_id, dados, erro)
+        self.metricas.contar_documentos('descartar_evento', escritas=2)
+
+    def concluir_evento(self, evento_id):
+        with self.metricas.span('armazenamento.concluir_evento'):
+            self.interno.concluir_evento(evento_id)
+        self.metricas.contar_documentos('concluir_evento', escritas=1)
@@ -0,0 +1,159 @@
+"""
+Migração dos agendamentos para o layout agregado por dia (ver agenda_dias.py).
+
+Uso:
+    python migrar_agenda_dias.py credenciais.json [--desde AAAA-MM-DD] [--lote 400] [--simular]
+    python migrar_agenda_dias.py credenciais.json --verificar [--desde AAAA-MM-DD]
+
+Percorre as coleções 'agendamentos' e 'agenda_dias' em ordem de ID, página por
+página, para saber quais dias existem. Cada dia é então reescrito numa transação
+que lê de novo os slots do dia (e o agregado): um agendamento cancelado enquanto a
+migração roda não volta para o agregado, e um agregado sem nenhum slot é apagado.
+Pode ser interrompida e rodada de novo quantas vezes for preciso: o resultado é o mesmo.
+
+A verificação compara os dois formatos nos dois sentidos: dias com slots e dias
+que só existem no agregado.
+
+Ordem segura para trocar o layout do app:
+    1. LAYOUT_ARMAZENAMENTO = "duplo" (novas gravações já vão para os dois formatos)
+    2. rodar esta migração e depois a verificação
+    3. LAYOUT_ARMAZENAMENTO = "dias"
+"""
+import argparse
+import sys
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from agenda_dias import (
+    COLECAO_AGENDAMENTOS, COLECAO_DIAS, MAXIMO_ESCRITAS_BATCH, agrupar_por_dia, ocupados_do_documento, ref_dia,
+)
+
+
+def paginas(db, colecao, desde, tamanho):
+    """Gera {doc_id: dados} de `tamanho` em `tamanho` documentos da coleção, em ordem de ID."""
+    consulta_base = db.collection(colecao).order_by(FieldPath.document_id()).limit(tamanho)
+    ultimo_id = None
+    while True:
+        if ultimo_id is not None:
+            consulta = consulta_base.start_after([ultimo_id])
+        elif desde:
+            consulta = consulta_base.start_at([desde])
+        else:
+            consulta = consulta_base
+        pagina = {doc.id: doc.to_dict() for doc in consulta.stream()}
+        if not pagina:
+            return
+        yield pagina
+        ultimo_id = max(pagina)
+
+
+def slots_por_dia(db, desde, tamanho):
+    """{'YYYY-MM-DD': ocupados_map} de todos os slots a partir de `desde`."""
+    por_dia = {}
+    for pagina in paginas(db, COLECAO_AGENDAMENTOS, desde, tamanho):
+        for doc_id, dados in pagina.items():
+            por_dia.setdefault(doc_id[:10], {})[doc_id] = dados
+    return por_dia
+
+
+def agregados_por_dia(db, desde, tamanho):
+    """{'YYYY-MM-DD': ocupados_map} de todos os documentos agregados a partir de `desde`."""
+    por_dia = {}
+    for pagina in paginas(db, COLECAO_DIAS, desde, tamanho):
+        for data_para_id, dados in pagina.items():
+            por_dia[data_para_id] = ocupados_do_documento(data_para_id, dados)
+    return por_dia
+
+
+def migrar_dia(db, data_para_id):
+    """
+    Reescreve o agregado do dia com os slots lidos na mesma transação (ou o apaga,
+    se o dia não tem mais slots). Uma gravação do app no mesmo dia (duplo) escreve no
+    agregado, que a transação também leu, então uma das duas é repetida.
+
+    Returns:
+        bool: True se o agregado mudou.
+    """
+    consulta = db.collection(COLECAO_AGENDAMENTOS).order_by(FieldPath.document_id()) \
+                 .start_at([data_para_id]).end_at([data_para_id + '\uf8ff'])
+    ref = ref_dia(db, data_para_id)
+
+    @firestore.transactional
+    def na_transacao(transaction):
+        slots = {doc.id: doc.to_dict() for doc in transaction.get(consulta)}
+        agregado, = transaction.get_all([ref])
+        atual = ocupados_do_documento(data_para_id, agregado.to_dict()) if agregado.exists else None
+        if slots:
+            if atual == slots:
+                return False
+            transaction.set(ref, agrupar_por_dia(slots)[data_para_id])
+        elif agregado.exists:
+            transaction.delete(ref)
+        else:
+            return False
+        return True
+
+    return na_transacao(db.transaction())
+
+
+def migrar(db, desde, tamanho_lote, simular):
+    # Os dias com slots e os que só têm agregado (ex: cancelados depois de uma migração anterior)
+    dias = sorted(set(slots_por_dia(db, desde, tamanho_lote)) | set(agregados_por_dia(db, desde, tamanho_lote)))
+    if simular:
+        print(f"Concluído: {len(dias)} dias (simulação, nada foi gravado).")
+        return
+    alterados = 0
+    for i, data_para_id in enumerate(dias, 1):
+        alterados += migrar_dia(db, data_para_id)
+        if i % tamanho_lote == 0 or i == len(dias):
+            print(f"{i} de {len(dias)} dias, até {data_para_id} ({alterados} agregado(s) reescrito(s))")
+    print(f"Concluído: {len(dias)} dias, {alterados} agregado(s) reescrito(s).")
+
+
+def verificar(db, desde, tamanho_lote):
+    """
+    Compara, dia a dia, os slots com o documento agregado, nos dois sentidos (também os
+    dias que só existem no agregado). Retorna o número de dias divergentes.
+    """
+    slots = slots_por_dia(db, desde, tamanho_lote)
+    agregados = agregados_por_dia(db, desde, tamanho_lote)
+
+    divergentes = 0
+    dias = sorted(set(slots) | set(agregados))
+    for data_para_id in dias:
+        do_slot = slots.get(data_para_id, {})
+        do_agregado = agregados.get(data_para_id, {})
+        if do_slot != do_agregado:
+            divergentes += 1
+            faltando = sorted(set(do_slot) - set(do_agregado))
+            sobrando = sorted(set(do_agregado) - set(do_slot))
+            diferentes = sorted(doc_id for doc_id in set(do_slot) & set(do_agregado) if do_slot[doc_id] != do_agregado[doc_id])
+            print(f"{data_para_id}: faltam {faltando} / sobram {sobrando} / diferentes {diferentes}")
+    print(f"{len(dias)} dias verificados, {divergentes} divergente(s).")
+    return divergentes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra 'agendamentos' para 'agenda_dias'.")
+    parser.add_argument("credenciais", help="JSON da conta de serviço do Firebase")
+    parser.add_argument("--desde", help="Primeiro dia a migrar (AAAA-MM-DD); padrão: todos")
+    parser.add_argument("--lote", type=int, default=400, help="Documentos lidos por página (e dias por linha de progresso)")
+    parser.add_argument("--simular", action="store_true", help="Só lê e conta, sem gravar")
+    parser.add_argument("--verificar", action="store_true", help="Compara os dois formatos em vez de migrar")
+    args = parser.parse_args()
+
+    if not 0 < args.lote <= MAXIMO_ESCRITAS_BATCH:
+        parser.error(f"--lote precisa estar entre 1 e {MAXIMO_ESCRITAS_BATCH}")
+
+    firebase_admin.initialize_app(credentials.Certificate(args.credenciais))
+    db = firestore.client()
+
+    if args.verificar:
+        sys.exit(1 if verificar(db, args.desde, args.lote) else 0)
+    migrar(db, args.desde, args.lote, args.simular)
+
+
+if __name__ == "__main__":
+    main()
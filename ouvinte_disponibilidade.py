@@ -0,0 +1,95 @@
+import logging
+import threading
+from datetime import timedelta
+
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from agenda_dias import COLECAO_AGENDAMENTOS, LAYOUT_DIAS, LAYOUT_SLOTS, ocupados_do_documento, ref_dia
+
+logger = logging.getLogger(__name__)
+
+
+class OuvinteDisponibilidade:
+    """
+    Mantém um listener `on_snapshot` do Firestore para cada dia ativo (hoje e os
+    próximos `dias_a_frente` dias) e publica cada snapshot no CacheOcupacao.
+
+    Assim todas as sessões leem a ocupação desses dias da memória, e agendamentos
+    feitos em outro aparelho aparecem sem uma nova consulta ao banco.
+    """
+
+    def __init__(self, db, cache, dias_a_frente, layout=LAYOUT_SLOTS, metricas=None):
+        self.db = db
+        self.cache = cache
+        self.dias_a_frente = dias_a_frente
+        # No layout agregado o listener é do documento do dia; nos outros, da faixa de
+        # slots (no duplo toda gravação ainda vai para os slots, então eles estão completos)
+        self.layout = layout
+        # Opcional (metricas.Metricas): conta as leituras cobradas a cada snapshot
+        self.metricas = metricas
+        self._lock = threading.Lock()
+        self._inscricoes = {}  # 'YYYY-MM-DD' -> Watch
+
+    def acompanhar(self, hoje):
+        """
+        Garante um listener ativo para cada dia da janela que começa em `hoje`
+        e encerra os listeners de dias que já saíram dela. Barato o suficiente
+        para ser chamado a cada execução do script.
+        """
+        desejados = {
+            (hoje + timedelta(days=i)).strftime('%Y-%m-%d')
+            for i in range(self.dias_a_frente + 1)
+        }
+        with self._lock:
+            for data_para_id in list(self._inscricoes):
+                watch = self._inscricoes[data_para_id]
+                if data_para_id not in desejados or not watch.is_active:
+                    self._encerrar(data_para_id)
+
+            for data_para_id in sorted(desejados - set(self._inscricoes)):
+                try:
+                    if self.layout == LAYOUT_DIAS:
+                        consulta = ref_dia(self.db, data_para_id)
+                    else:
+                        consulta = self.db.collection(COLECAO_AGENDAMENTOS) \
+                                          .order_by(FieldPath.document_id()) \
+                                          .start_at([data_para_id]) \
+                                          .end_at([data_para_id + '\uf8ff'])
+                    self._inscricoes[data_para_id] = consulta.on_snapshot(self._callback(data_para_id))
+                except Exception:
+                    # Sem listener o dia continua funcionando pelo cache com TTL
+                    logger.exception("Falha ao iniciar o listener do dia %s", data_para_id)
+
+    def dias_acompanhados(self):
+        with self._lock:
+            return sorted(self._inscricoes)
+
+    def parar(self):
+        with self._lock:
+            for data_para_id in list(self._inscricoes):
+                self._encerrar(data_para_id)
+
+    def _encerrar(self, data_para_id):
+        watch = self._inscricoes.pop(data_para_id)
+        try:
+            watch.unsubscribe()
+        except Exception:
+            logger.exception("Falha ao encerrar o listener do dia %s", data_para_id)
+        # O último snapshot deixa de ser atualizado: vence na hora e fica só para o modo somente leitura
+        self.cache.invalidar(data_para_id)
+
+    def _callback(self, data_para_id):
+        def ao_receber_snapshot(docs, changes, read_time):
+            # `docs` traz o resultado completo da consulta, não só as mudanças
+            if self.layout == LAYOUT_DIAS:
+                ocupados_map = {}
+                for doc in docs:
+                    if doc.exists:
+                        ocupados_map.update(ocupados_do_documento(data_para_id, doc.to_dict()))
+            else:
+                ocupados_map = {doc.id: doc.to_dict() for doc in docs}
+            self.cache.fixar(data_para_id, ocupados_map)
+            if self.metricas is not None:
+                # O Firestore cobra uma leitura por documento alterado (no primeiro snapshot, todos)
+                self.metricas.contar_documentos('listener', leituras=len(changes))
+        return ao_receber_snapshot
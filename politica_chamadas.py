@@ -0,0 +1,250 @@
+"""
+Política das chamadas ao banco: prazo por operação, novas tentativas com espera
+aleatória para erros passageiros e um disjuntor que, depois de várias falhas
+seguidas, recusa as chamadas na hora por um tempo (modo somente leitura: o app
+mostra a última ocupação conhecida e não aceita gravações).
+
+Assim, com o Firestore lento ou fora do ar, nenhuma execução do script fica
+presa mais do que o prazo da operação.
+"""
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as TempoEsgotadoFuturo
+
+from google.api_core import exceptions as erros_google
+
+from armazenamento import Armazenamento
+
+logger = logging.getLogger(__name__)
+
+# Erros que costumam passar sozinhos: vale tentar de novo (e contam como falha do banco)
+ERROS_PASSAGEIROS = (
+    erros_google.ServiceUnavailable,
+    erros_google.DeadlineExceeded,
+    erros_google.InternalServerError,
+    erros_google.TooManyRequests,
+    erros_google.ResourceExhausted,
+    erros_google.BadGateway,
+    erros_google.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+    sqlite3.OperationalError,  # "database is locked"
+)
+
+Politica = namedtuple("Politica", [
+    "prazo",           # Segundos que a operação inteira (com as novas tentativas) pode levar
+    "tentativas",      # Quantas vezes chamar no máximo (1 = sem nova tentativa)
+    "espera_inicial",  # Teto da primeira espera entre tentativas; dobra a cada tentativa
+    "espera_maxima",   # Teto de qualquer espera
+])
+
+# Leituras e gravações idempotentes (set/delete de um ID fixo) podem ser repetidas.
+# A reserva não: se o commit passou mas a resposta se perdeu, a nova tentativa
+# encontraria o próprio agendamento e responderia "Horário já ocupado". O cancelamento
+# (apagar com evento e contador) também não: somaria o cancelamento duas vezes e
+# gravaria de novo o evento, que pode já ter sido concluído (e-mail e liberação repetidos).
+POLITICA_LEITURA = Politica(prazo=5.0, tentativas=3, espera_inicial=0.1, espera_maxima=1.0)
+POLITICA_GRAVACAO = Politica(prazo=8.0, tentativas=2, espera_inicial=0.2, espera_maxima=1.0)
+POLITICA_RESERVA = Politica(prazo=10.0, tentativas=1, espera_inicial=0.0, espera_maxima=0.0)
+POLITICA_LOTE = Politica(prazo=30.0, tentativas=2, espera_inicial=0.5, espera_maxima=2.0)
+
+POLITICAS = {
+    'ocupacao_periodo': POLITICA_LEITURA,
+    'ler': POLITICA_LEITURA,
+    'agendamentos_do_telefone': POLITICA_LEITURA,
+    'primeiro_dia': POLITICA_LEITURA,
+    'eventos_pendentes': POLITICA_LEITURA,
+    'cancelamentos_do_mes': POLITICA_LEITURA,
+    'gravar': POLITICA_GRAVACAO,
+    'apagar': POLITICA_GRAVACAO,
+    'cancelar': POLITICA_RESERVA,  # apagar com evento/contador de cancelamento
+    'liberar_bloqueios': POLITICA_GRAVACAO,  # repetir confere o horário de novo
+    'remover_do_indice': POLITICA_GRAVACAO,
+    'concluir_evento': POLITICA_GRAVACAO,
+    'adiar_evento': POLITICA_GRAVACAO,
+    'descartar_evento': POLITICA_GRAVACAO,
+    'reservar': POLITICA_RESERVA,
+    # Se o commit passou e a resposta se perdeu, a nova tentativa veria o evento já reservado
+    'reservar_evento': POLITICA_RESERVA,
+    'gravar_lote': POLITICA_LOTE,
+    'apagar_lote': POLITICA_LOTE,
+}
+
+
+class BancoIndisponivel(RuntimeError):
+    """O banco não respondeu a tempo ou o disjuntor está aberto. A mensagem vai para o cliente."""
+
+
+class PrazoEsgotado(BancoIndisponivel):
+    """A operação passou do prazo; uma gravação pode ter sido feita ou não."""
+
+
+class Disjuntor:
+    """
+    Conta as falhas seguidas do banco. Ao chegar em `limite_falhas`, abre: as
+    chamadas são recusadas sem ir ao banco por `tempo_aberto` segundos. Depois
+    disso deixa passar uma chamada de teste; se ela der certo, fecha.
+    """
+
+    def __init__(self, limite_falhas=5, tempo_aberto=30.0):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self._lock = threading.Lock()
+        self._falhas = 0
+        self._aberto_desde = None
+        self._testando = False
+
+    @property
+    def aberto(self):
+        """True enquanto o banco é considerado fora do ar (inclui o período de teste)."""
+        with self._lock:
+            return self._aberto_desde is not None
+
+    def permitir(self):
+        """True se a chamada pode ir ao banco (fechado, ou a chamada de teste)."""
+        with self._lock:
+            if self._aberto_desde is None:
+                return True
+            if self._testando or time.monotonic() - self._aberto_desde < self.tempo_aberto:
+                return False
+            self._testando = True
+            return True
+
+    def sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._aberto_desde = None
+            self._testando = False
+
+    def falha(self):
+        """Registra a falha; retorna True se o disjuntor abriu (ou reabriu) agora."""
+        with self._lock:
+            self._falhas += 1
+            if self._testando or (self._aberto_desde is None and self._falhas >= self.limite_falhas):
+                self._aberto_desde = time.monotonic()
+                self._testando = False
+                return True
+            return False
+
+
+class ArmazenamentoProtegido(Armazenamento):
+    """
+    Repassa as chamadas para outro backend aplicando a Politica de cada método
+    (POLITICAS) e o Disjuntor, compartilhado por todas as sessões do processo.
+
+    Cada tentativa roda numa thread do pool e é esperada só até o prazo: uma
+    chamada presa continua lá, mas a execução do script segue com BancoIndisponivel.
+    Só ERROS_PASSAGEIROS e o prazo esgotado contam como falha do banco; os outros
+    erros (ex: ValueError de horário já ocupado) passam direto.
+    """
+
+    def __init__(self, interno, disjuntor=None, metricas=None, politicas=POLITICAS, max_threads=16):
+        self.interno = interno
+        self.disjuntor = disjuntor or Disjuntor()
+        self.metricas = metricas
+        self.politicas = politicas
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="banco")
+
+    @property
+    def tempo_real(self):
+        return self.interno.tempo_real
+
+    @property
+    def modo_degradado(self):
+        return self.disjuntor.aberto
+
+    def _contar(self, nome, **labels):
+        if self.metricas is not None:
+            self.metricas.incrementar(nome, **labels)
+
+    def _chamar(self, operacao, *args, politica=None):
+        politica = politica or self.politicas[operacao]
+        limite = time.monotonic() + politica.prazo
+        funcao = getattr(self.interno, operacao)
+        for tentativa in range(1, politica.tentativas + 1):
+            if not self.disjuntor.permitir():
+                self._contar('agenda_chamadas_recusadas_total', operacao=operacao)
+                raise BancoIndisponivel("A agenda está em modo somente leitura: o banco de dados não está "
+                                        "respondendo. Tente novamente em alguns instantes.")
+            futuro = self._executor.submit(funcao, *args)
+            try:
+                resultado = futuro.result(timeout=max(0.0, limite - time.monotonic()))
+            except TempoEsgotadoFuturo:
+                erro = PrazoEsgotado(f"O banco de dados não respondeu em {politica.prazo:g} s.")
+            except ERROS_PASSAGEIROS as e:
+                erro = e
+            except Exception:
+                # O banco respondeu, com um erro que nova tentativa não resolve (ex: conflito na reserva)
+                self.disjuntor.sucesso()
+                raise
+            else:
+                self.disjuntor.sucesso()
+                return resultado
+
+            if self.disjuntor.falha():
+                logger.warning("Disjuntor do banco aberto depois de falha em %s: %r", operacao, erro)
+                self._contar('agenda_disjuntor_aberturas_total')
+            espera = random.uniform(0, min(politica.espera_maxima, politica.espera_inicial * 2 ** (tentativa - 1)))
+            if tentativa == politica.tentativas or time.monotonic() + espera >= limite:
+                if isinstance(erro, BancoIndisponivel):
+                    raise erro
+                raise BancoIndisponivel(f"O banco de dados não está respondendo ({type(erro).__name__}). "
+                                        "Tente novamente em alguns instantes.") from erro
+            self._contar('agenda_chamadas_repetidas_total', operacao=operacao)
+            time.sleep(espera)
+
+    def ocupacao_periodo(self, ids):
+        return self._chamar('ocupacao_periodo', ids)
+
+    def ler(self, doc_id):
+        return self._chamar('ler', doc_id)
+
+    def reservar(self, ids_verificar, gravacoes, validar, indice=None, evento=None):
+        return self._chamar('reservar', ids_verificar, gravacoes, validar, indice, evento)
+
+    def gravar(self, doc_id, dados):
+        return self._chamar('gravar', doc_id, dados)
+
+    def apagar(self, doc_id, telefone_indice=None, evento=None, cancelamento=None):
+        politica = self.politicas['cancelar'] if evento or cancelamento else None
+        return self._chamar('apagar', doc_id, telefone_indice, evento, cancelamento, politica=politica)
+
+    def liberar_bloqueios(self, doc_id, ids_bloqueio, pode_liberar):
+        return self._chamar('liberar_bloqueios', doc_id, ids_bloqueio, pode_liberar)
+
+    def gravar_lote(self, gravacoes):
+        return self._chamar('gravar_lote', gravacoes)
+
+    def apagar_lote(self, ids, telefones=None):
+        return self._chamar('apagar_lote', ids, telefones)
+
+    def primeiro_dia(self):
+        return self._chamar('primeiro_dia')
+
+    def agendamentos_do_telefone(self, telefone, a_partir_de):
+        return self._chamar('agendamentos_do_telefone', telefone, a_partir_de)
+
+    def remover_do_indice(self, telefone_normalizado, doc_id):
+        return self._chamar('remover_do_indice', telefone_normalizado, doc_id)
+
+    def cancelamentos_do_mes(self, mes):
+        return self._chamar('cancelamentos_do_mes', mes)
+
+    def eventos_pendentes(self, limite=50, disponiveis=False):
+        return self._chamar('eventos_pendentes', limite, disponiveis)
+
+    def reservar_evento(self, evento_id, segundos):
+        return self._chamar('reservar_evento', evento_id, segundos)
+
+    def adiar_evento(self, evento_id, tentativas, segundos, erro):
+        return self._chamar('adiar_evento', evento_id, tentativas, segundos, erro)
+
+    def descartar_evento(self, evento_id, dados, erro):
+        return self._chamar('descartar_evento', evento_id, dados, erro)
+
+    def concluir_evento(self, evento_id):
+        return self._chamar('concluir_evento', evento_id)
@@ -0,0 +1,119 @@
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+# Horários exibidos na tabela e oferecidos no formulário (de 30 em 30 minutos)
+HORARIOS = tuple(f"{h:02d}:{m:02d}" for h in range(8, 20) for m in (0, 30))
+INDICE_HORARIO = {horario: i for i, horario in enumerate(HORARIOS)}
+
+BARBEIROS = ("Aluizio", "Lucas Borges")
+
+# Períodos com horário especial (nenhuma das regras marcadas com fora_do_intervalo_especial
+# vale neles): (mês, dia inicial, dia final), com os dois dias inclusos
+INTERVALOS_ESPECIAIS = (
+    (7, 10, 19),
+)
+
+DIAS_UTEIS = frozenset(range(5))  # Segunda (0) a sexta (4)
+
+Regra = namedtuple("Regra", [
+    "status",                      # Texto mostrado na tabela
+    "dias_semana",                 # frozenset de weekday(), ou None para todos
+    "horarios",                    # frozenset de "HH:MM", ou None para todos
+    "barbeiros",                   # frozenset de nomes, ou None para todos
+    "fora_do_intervalo_especial",  # True: a regra não vale nos INTERVALOS_ESPECIAIS
+    "respeita_fechado",            # True: um horário "Fechado" manualmente aparece como Fechado
+    "mensagem",                    # Erro mostrado ao tentar agendar ({barbeiro} é substituído)
+])
+
+# Regras de funcionamento, em ordem de prioridade: a primeira que casar define o horário.
+# Horário sem regra é agendável (Disponível/Ocupado conforme o banco).
+REGRAS = (
+    Regra(
+        status="Fechado",
+        dias_semana=frozenset({6}),
+        horarios=None,
+        barbeiros=None,
+        fora_do_intervalo_especial=True,
+        respeita_fechado=False,
+        mensagem="Desculpe, estamos fechados aos domingos.",
+    ),
+    Regra(
+        status="SDJ",
+        dias_semana=None,
+        horarios=frozenset({"07:00", "07:30"}),
+        barbeiros=None,
+        fora_do_intervalo_especial=True,
+        respeita_fechado=False,
+        mensagem="Os horários de 07:00 e 07:30 só estão disponíveis entre os dias 11 e 19 de julho.",
+    ),
+    # Vale também aos sábados: o formulário sempre recusou o Lucas às 08:00 em qualquer dia
+    # (só a tabela antiga o mostrava Disponível no sábado)
+    Regra(
+        status="Indisponível",
+        dias_semana=None,
+        horarios=frozenset({"08:00"}),
+        barbeiros=frozenset({"Lucas Borges"}),
+        fora_do_intervalo_especial=True,
+        respeita_fechado=False,
+        mensagem="Lucas Borges não atende às 08:00. Por favor, escolha a partir das 08:30 ou selecione o barbeiro Aluizio.",
+    ),
+    Regra(
+        status="Almoço",
+        dias_semana=DIAS_UTEIS,
+        horarios=frozenset({"12:00", "12:30", "13:00", "13:30"}),
+        barbeiros=None,
+        fora_do_intervalo_especial=True,
+        respeita_fechado=True,
+        mensagem="{barbeiro} está em horário de almoço. Por favor, escolha outro horário.",
+    ),
+)
+
+
+def em_intervalo_especial(data):
+    return any(data.month == mes and inicio <= data.day <= fim for mes, inicio, fim in INTERVALOS_ESPECIAIS)
+
+
+def avaliar_regra(data, barbeiro, horario):
+    """Primeira regra de REGRAS que se aplica ao horário, ou None se ele é agendável."""
+    especial = em_intervalo_especial(data)
+    dia_da_semana = data.weekday()
+    for regra in REGRAS:
+        if regra.fora_do_intervalo_especial and especial:
+            continue
+        if regra.dias_semana is not None and dia_da_semana not in regra.dias_semana:
+            continue
+        if regra.horarios is not None and horario not in regra.horarios:
+            continue
+        if regra.barbeiros is not None and barbeiro not in regra.barbeiros:
+            continue
+        return regra
+    return None
+
+
+class GradeDia(namedtuple("GradeDia", ["data", "barbeiro", "regras"])):
+    """Regras já resolvidas de um barbeiro em um dia: regras[i] vale para HORARIOS[i]."""
+
+    __slots__ = ()
+
+    def regra(self, horario):
+        indice = INDICE_HORARIO.get(horario)
+        if indice is None:
+            # Fora da grade (ex: 07:00): avalia na hora, é raro
+            return avaliar_regra(self.data, self.barbeiro, horario)
+        return self.regras[indice]
+
+
+@lru_cache(maxsize=1024)
+def _compilar_grade(data, barbeiro):
+    return GradeDia(data, barbeiro, tuple(avaliar_regra(data, barbeiro, horario) for horario in HORARIOS))
+
+
+def grade_do_dia(data, barbeiro):
+    """
+    Grade imutável de regras do barbeiro no dia. É compilada uma vez por
+    (data, barbeiro) e reaproveitada pela tabela, pelo formulário e por todas as sessões.
+    """
+    if isinstance(data, datetime):
+        data = data.date()
+    return _compilar_grade(data, barbeiro)
@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+
+from google.cloud import firestore
+
+from contagem_cancelamentos import cancelamento_do_agendamento
+from eventos_agenda import AGENDAMENTO_CANCELADO, AGENDAMENTO_CRIADO, novo_evento
+from indice_telefone import entrada_indice, normalizar_telefone
+
+# Serviços de corte: corte + barba ocupa também o horário seguinte
+SERVICOS_CORTE = ("Tradicional", "Social", "Degradê", "Navalhado")
+
+
+def dados_bloqueio(data_obj, horario, barbeiro):
+    # Documento gravado nos horários "_BLOQUEADO" (usado pelo bloqueio avulso e pelas reservas)
+    return {
+        'nome': "BLOQUEADO",
+        'telefone': "BLOQUEADO",
+        'servicos': ["BLOQUEADO"],
+        'barbeiro': barbeiro,
+        'data': data_obj,  # Salva o objeto de data no documento
+        'horario': horario,
+        'agendado_por': 'bloqueio_interno' # Campo para identificar a origem
+    }
+
+
+def horarios_seguintes(horario, quantidade):
+    """Os `quantidade` horários de 30 min logo depois de `horario` (ex: "10:00", 1 -> ["10:30"])."""
+    horario_dt = datetime.strptime(horario, '%H:%M')
+    return [(horario_dt + timedelta(minutes=30 * i)).strftime('%H:%M') for i in range(1, quantidade + 1)]
+
+
+def horarios_necessarios(servicos):
+    """Quantos horários de 30 min o atendimento ocupa (2 para corte + barba)."""
+    return 2 if any(corte in servicos for corte in SERVICOS_CORTE) and "Barba" in servicos else 1
+
+
+def ids_do_atendimento(data_para_id, horarios, barbeiro):
+    """IDs que precisam estar livres para atender nos `horarios`: o agendamento e o bloqueio de cada um."""
+    return [f"{data_para_id}_{h}_{barbeiro}{sufixo}" for h in horarios for sufixo in ("", "_BLOQUEADO")]
+
+
+def montar_atendimento(data_obj, horario, nome, telefone, servicos, barbeiro, seguintes, id_envio=None):
+    """
+    O que uma reserva grava: o agendamento, os bloqueios dos horários `seguintes`,
+    a entrada no índice por telefone (ou None) e o evento AGENDAMENTO_CRIADO.
+
+    Returns:
+        tuple: (chave_agendamento, gravacoes, indice, evento), no formato de `Armazenamento.reservar`.
+    """
+    data_para_id = data_obj.strftime('%Y-%m-%d')
+    chave_agendamento = f"{data_para_id}_{horario}_{barbeiro}"
+    telefone_normalizado = normalizar_telefone(telefone)
+    gravacoes = {
+        chave_agendamento: {
+            'data': data_obj,
+            'horario': horario,
+            'nome': nome,
+            'telefone': telefone,
+            'telefone_normalizado': telefone_normalizado,
+            'servicos': servicos,
+            'barbeiro': barbeiro,
+            'timestamp': firestore.SERVER_TIMESTAMP
+        },
+    }
+    if id_envio:
+        gravacoes[chave_agendamento]['id_envio'] = id_envio
+    for h in seguintes:
+        gravacoes[f"{data_para_id}_{h}_{barbeiro}_BLOQUEADO"] = dados_bloqueio(data_obj, h, barbeiro)
+    indice = None
+    if telefone_normalizado:
+        indice = (telefone_normalizado, chave_agendamento, entrada_indice(data_para_id, horario, barbeiro, servicos))
+    evento = novo_evento(AGENDAMENTO_CRIADO, chave_agendamento, gravacoes[chave_agendamento])
+    return chave_agendamento, gravacoes, indice, evento
+
+
+def reservar_atendimento(armazenamento, data_obj, horario, nome, telefone, servicos, barbeiro, quantidade_bloqueios=0,
+                         id_envio=None):
+    """
+    Grava o agendamento e bloqueia os `quantidade_bloqueios` horários seguintes do
+    mesmo barbeiro (ex: 1 para corte + barba) com um único `armazenamento.reservar`:
+    todos os horários são lidos juntos e gravados no mesmo commit, ou nada é gravado.
+    O índice por telefone é atualizado no mesmo commit, e o evento
+    AGENDAMENTO_CRIADO (e-mail para a barbearia) entra na fila no mesmo commit.
+
+    `id_envio` identifica o envio do formulário e é gravado no agendamento: se o
+    horário já estiver ocupado por um agendamento com o mesmo `id_envio` (o mesmo
+    envio repetido, ex: cliques seguidos), a reserva é considerada feita.
+
+    Sem st.*: é o mesmo caminho usado pelo app e pelo teste de carga.
+
+    Returns:
+        str: ID do agendamento gravado.
+
+    Raises:
+        ValueError: com a mensagem para o cliente, se algum horário já estiver ocupado.
+    """
+    data_para_id = data_obj.strftime('%Y-%m-%d')
+
+    seguintes = horarios_seguintes(horario, quantidade_bloqueios)
+    for horario_seguinte in seguintes:
+        if horario_seguinte >= "20:00":
+            raise ValueError(f"O barbeiro {barbeiro} não poderá atender para corte e barba, pois o horário {horario} é o último do dia. Por favor, escolha serviços que caibam em 30 minutos ou selecione outro horário.")
+
+    # Para cada horário envolvido: o agendamento e o bloqueio precisam estar livres
+    ids_verificar = ids_do_atendimento(data_para_id, [horario] + seguintes, barbeiro)
+
+    def validar(ocupados):
+        if any(f"{data_para_id}_{horario}_{barbeiro}{sufixo}" in ocupados for sufixo in ("", "_BLOQUEADO")):
+            # Se o documento já existe, a transação falha para evitar agendamento duplo
+            raise ValueError("Horário já ocupado por outra pessoa.")
+        for h in seguintes:
+            if any(f"{data_para_id}_{h}_{barbeiro}{sufixo}" in ocupados for sufixo in ("", "_BLOQUEADO")):
+                raise ValueError(f"O barbeiro {barbeiro} não poderá atender para corte e barba, pois já está ocupado no horário seguinte ({h}). Por favor, escolha serviços que caibam em 30 minutos ou selecione outro horário/barbeiro.")
+
+    # Se os horários estiverem livres, a transação grava o agendamento e os bloqueios juntos
+    chave_agendamento, gravacoes, indice, evento = montar_atendimento(data_obj, horario, nome, telefone, servicos,
+                                                                       barbeiro, seguintes, id_envio)
+    try:
+        armazenamento.reservar(ids_verificar, gravacoes, validar, indice, evento)
+    except ValueError:
+        # Só no conflito, uma leitura a mais: o horário pode ser deste mesmo envio
+        if id_envio:
+            existente = armazenamento.ler(chave_agendamento)
+            if existente and existente.get('id_envio') == id_envio:
+                return chave_agendamento
+        raise
+    return chave_agendamento
+
+
+def cancelar_reserva(armazenamento, doc_id, telefone_cliente):
+    """
+    Apaga o agendamento `doc_id` se o telefone confere. O agendamento e a sua
+    entrada no índice por telefone são apagados no mesmo commit, junto com o evento
+    AGENDAMENTO_CANCELADO (o TrabalhadorEventos libera o horário seguinte do corte +
+    barba e avisa a barbearia depois) e o contador de cancelamentos do mês.
+
+    Um telefone sem nenhum dígito nunca confere: seria igual ao dos bloqueios
+    ("BLOQUEADO", "Fechado") e dos agendamentos antigos sem telefone.
+
+    Returns:
+        dict com os dados do agendamento cancelado, "not_found" ou "phone_mismatch".
+    """
+    agendamento_data = armazenamento.ler(doc_id)
+    if agendamento_data is None:
+        return "not_found"
+
+    # Agendamentos antigos não têm o telefone normalizado: normaliza o que foi digitado na época
+    telefone_no_banco = agendamento_data.get('telefone_normalizado') or normalizar_telefone(agendamento_data.get('telefone', ''))
+    telefone_digitado = normalizar_telefone(telefone_cliente)
+    if not telefone_digitado or telefone_no_banco != telefone_digitado:
+        return "phone_mismatch"
+
+    # Só agendamentos com telefone normalizado foram gravados no índice
+    armazenamento.apagar(doc_id, agendamento_data.get('telefone_normalizado'),
+                         novo_evento(AGENDAMENTO_CANCELADO, doc_id, agendamento_data),
+                         cancelamento_do_agendamento(doc_id, agendamento_data))
+    return agendamento_data
@@ -0,0 +1,124 @@
+import io
+import threading
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Formatos de saída do resumo: nome -> (formato do Pillow, mime, extensão, opções do save)
+# PNG_256 reduz a imagem a uma paleta de 256 cores: o arquivo fica ~10x menor e a
+# compressão bem mais rápida, sem perda visível no template (fundo liso + texto).
+FORMATOS_SAIDA = {
+    'PNG': ('PNG', 'image/png', 'png', {}),
+    'PNG_256': ('PNG', 'image/png', 'png', {}),
+    'JPEG': ('JPEG', 'image/jpeg', 'jpg', {'quality': 85, 'optimize': True}),
+    'WEBP': ('WEBP', 'image/webp', 'webp', {'quality': 85}),
+}
+
+# Largura máxima em pixels que o nome pode ocupar
+LARGURA_MAXIMA_NOME = 800
+# Tamanhos possíveis da fonte do nome, do menor para o maior (de 5 em 5 pontos)
+TAMANHOS_FONTE_NOME = tuple(range(30, 86, 5))
+TAMANHO_FONTE_CORPO = 65
+
+# (X, Y) -> Distância da esquerda, Distância do topo
+POSICAO_NOME = (180, 700)
+POSICAO_DETALHES = (180, 800)
+COR_TEXTO = (0, 0, 0)  # Preto
+
+
+class RenderizadorResumo:
+    """
+    Desenha a imagem de resumo do agendamento.
+
+    O template é decodificado uma única vez e copiado a cada pedido, e as fontes
+    ficam guardadas por tamanho, então um mesmo renderizador pode (e deve) ser
+    reaproveitado entre agendamentos.
+    """
+
+    def __init__(self, template_path, font_path):
+        with Image.open(template_path) as img:
+            self._template = img.convert("RGBA")
+        self._font_path = font_path
+        self._fontes = {}
+        # O FreeType não garante uso simultâneo da mesma fonte por várias threads
+        self._lock = threading.Lock()
+
+    def fonte(self, tamanho):
+        fonte = self._fontes.get(tamanho)
+        if fonte is None:
+            fonte = self._fontes[tamanho] = ImageFont.truetype(self._font_path, tamanho)
+        return fonte
+
+    def tamanho_fonte_nome(self, nome):
+        """
+        Maior tamanho de TAMANHOS_FONTE_NOME em que o nome cabe em LARGURA_MAXIMA_NOME
+        (ou o menor tamanho, se nem ele couber). Como a largura cresce com o tamanho,
+        uma busca binária resolve em O(log n) medições.
+        """
+        inicio, fim = 0, len(TAMANHOS_FONTE_NOME) - 1
+        escolhido = TAMANHOS_FONTE_NOME[0]
+        while inicio <= fim:
+            meio = (inicio + fim) // 2
+            tamanho = TAMANHOS_FONTE_NOME[meio]
+            if self.fonte(tamanho).getbbox(nome)[2] <= LARGURA_MAXIMA_NOME:
+                escolhido = tamanho
+                inicio = meio + 1
+            else:
+                fim = meio - 1
+        return escolhido
+
+    def renderizar(self, nome, data, horario, barbeiro, servicos, formato='PNG'):
+        """
+        Args:
+            nome (str): Nome do cliente.
+            data (str): Data do agendamento (ex: "22/08/2025").
+            horario (str): Horário do agendamento (ex: "10:30").
+            barbeiro (str): Nome do barbeiro.
+            servicos (list): Lista de serviços selecionados.
+            formato (str): Uma das chaves de FORMATOS_SAIDA.
+
+        Returns:
+            bytes: A imagem no formato pedido, pronta para download.
+        """
+        formato_pil, _, _, opcoes = FORMATOS_SAIDA[formato]
+        img = self._template.copy()
+        draw = ImageDraw.Draw(img)
+
+        with self._lock:
+            font_nome = self.fonte(self.tamanho_fonte_nome(nome))
+            font_corpo = self.fonte(TAMANHO_FONTE_CORPO)
+            draw.text(POSICAO_NOME, nome, fill=COR_TEXTO, font=font_nome)
+            draw.multiline_text(POSICAO_DETALHES, texto_resumo(data, horario, barbeiro, servicos),
+                                fill=COR_TEXTO, font=font_corpo, spacing=10)
+
+        if formato == 'PNG_256':
+            img = img.quantize(256)
+        elif formato_pil == 'JPEG':
+            # JPEG não tem transparência: achata sobre fundo branco
+            fundo = Image.new("RGB", img.size, (255, 255, 255))
+            fundo.paste(img, mask=img.getchannel("A"))
+            img = fundo
+
+        # Salva a imagem em um buffer de memória (sem criar um arquivo no disco)
+        buf = io.BytesIO()
+        img.save(buf, format=formato_pil, **opcoes)
+        return buf.getvalue()
+
+
+def texto_resumo(data, horario, barbeiro, servicos):
+    # Junta a lista de serviços em uma única string, com quebra de linha se for longa
+    servicos_str = ", ".join(servicos)
+    if len(servicos_str) > 30:  # Se a linha de serviços for muito longa
+        servicos_formatados = '\n'.join(servicos)  # Coloca um serviço por linha
+        return f"""
+Data: {data}
+Horário: {horario}
+Barbeiro: {barbeiro}
+Serviços:
+{servicos_formatados}
+"""
+    return f"""
+Data: {data}
+Horário: {horario}
+Barbeiro: {barbeiro}
+Serviços: {servicos_str}
+"""
@@ -1,18 +1,25 @@
 import streamlit as st
 import firebase_admin
-from firebase_admin import credentials, firestore, auth
-from google.cloud.firestore_v1.field_path import FieldPath
+from firebase_admin import credentials, firestore
 from datetime import datetime, timedelta
-import smtplib
-from email.mime.text import MIMEText
 import json
-import google.api_core.exceptions
-import google.api_core.retry as retry
+import logging
+import os
 import random
-import pandas as pd
-import time
-from PIL import Image, ImageDraw, ImageFont
-import io
+from cache_ocupacao import CacheOcupacao, PreCarregador, carregar_periodo
+from ouvinte_disponibilidade import OuvinteDisponibilidade
+# caixa_saida_email (smtplib) e resumo_imagem (Pillow) só são importados depois do
+# primeiro agendamento, dentro das funções que os usam: a primeira página abre mais rápido
+from regras_horario import BARBEIROS, HORARIOS, grade_do_dia
+from mascara_disponibilidade import escolher_barbeiro, mascaras_do_dia, primeiro_horario_livre
+from tabela_disponibilidade import CSS_TABELA, RenderizadorTabela
+from agenda_dias import LAYOUT_SLOTS
+from armazenamento import criar_armazenamento
+from indice_telefone import normalizar_telefone
+from reservas import cancelar_reserva, horarios_necessarios, horarios_seguintes, reservar_atendimento
+from eventos_agenda import AGENDAMENTO_CANCELADO, AGENDAMENTO_CRIADO
+from metricas import ArmazenamentoMedido, Conta, Metricas
+from politica_chamadas import ArmazenamentoProtegido, BancoIndisponivel, PrazoEsgotado
 
 st.set_page_config(
     page_title="Agendamentos-Barbearia Lucas Borges",
@@ -29,27 +36,25 @@ st.markdown(
         table { display: block !important; width: fit-content !important; }
         div[data-testid="stForm"] { display: block !important; }
 
-        /* --- CÓDIGO FINAL E VENCEDOR PARA OS BOTÕES --- */
+        /* --- BOTÕES DOS FORMULÁRIOS --- */
+        /* Cada formulário fica num container com key: o Streamlit põe a classe st-key-<key>
+           no bloco, então o seletor não depende da posição dos elementos na página */
 
         /* --- BOTÃO VERDE (CONFIRMAR AGENDAMENTO) --- */
-        /* Alvo: O botão exato que o seu navegador indicou */
-        #root > div:nth-child(1) > div.withScreencast > div > div > section > div.stMainBlockContainer.block-container.st-emotion-cache-mtjnbi.eht7o1d4 > div > div > div > div:nth-child(8) > div > div > div > div > div > div > button {
+        .st-key-form_agendar div[data-testid="stFormSubmitButton"] button {
             background-color: #28a745 !important;
             border-color: #28a745 !important;
         }
-        /* Alvo: O texto dentro do botão verde */
-        #root > div:nth-child(1) > div.withScreencast > div > div > section > div.stMainBlockContainer.block-container.st-emotion-cache-mtjnbi.eht7o1d4 > div > div > div > div:nth-child(8) > div > div > div > div > div > div > button p {
+        .st-key-form_agendar div[data-testid="stFormSubmitButton"] button p {
             color: white !important;
         }
 
         /* --- BOTÃO VERMELHO (CANCELAR AGENDAMENTO) --- */
-        /* Alvo: O segundo botão exato que o seu navegador indicou */
-        #root > div:nth-child(1) > div.withScreencast > div > div > section > div.stMainBlockContainer.block-container.st-emotion-cache-mtjnbi.eht7o1d4 > div > div > div > div:nth-child(9) > div > div > div > div > div > div > button {
+        .st-key-form_cancelar div[data-testid="stFormSubmitButton"] button {
             background-color: #dc3545 !important;
             border-color: #dc3545 !important;
         }
-        /* Alvo: O texto dentro do botão vermelho */
-        #root > div:nth-child(1) > div.withScreencast > div > div > section > div.stMainBlockContainer.block-container.st-emotion-cache-mtjnbi.eht7o1d4 > div > div > div > div:nth-child(9) > div > div > div > div > div > div > button p {
+        .st-key-form_cancelar div[data-testid="stFormSubmitButton"] button p {
             color: white !important;
         }
     </style>
@@ -57,19 +62,55 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+# Estilo da tabela de disponibilidade: as células só carregam a classe do status
+st.markdown(f"<style>{CSS_TABELA}</style>", unsafe_allow_html=True)
+
 # Carregar as credenciais do Firebase e-mail a partir do Streamlit secrets
 FIREBASE_CREDENTIALS = None
 EMAIL = None
 SENHA = None
+# Servidor SMTP (pode apontar para um servidor local em testes)
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORTA = 587
+SMTP_STARTTLS = True
+# Pasta onde os e-mails ainda não entregues ficam guardados (None = só em memória)
+PASTA_SPOOL_EMAIL = None
+# Senha da área da barbearia (bloqueio em lote), em [admin] SENHA; sem ela a área não aparece
+SENHA_ADMIN = None
+
+# Os secrets são lidos e decodificados uma vez por processo. Se der erro, nada fica em
+# cache e a próxima execução tenta de novo (e mostra o erro de novo)
+@st.cache_resource
+def carregar_credenciais_firebase():
+    return json.loads(st.secrets["firebase"]["FIREBASE_CREDENTIALS"])
+
+@st.cache_resource
+def carregar_configuracao_email():
+    email = st.secrets["email"]
+    return {
+        'EMAIL': email["EMAIL_CREDENCIADO"],
+        'SENHA': email["EMAIL_SENHA"],
+        'SMTP_HOST': email.get("SMTP_HOST", SMTP_HOST),
+        'SMTP_PORTA': int(email.get("SMTP_PORTA", SMTP_PORTA)),
+        'SMTP_STARTTLS': bool(email.get("SMTP_STARTTLS", SMTP_STARTTLS)),
+        'PASTA_SPOOL': email.get("PASTA_SPOOL", PASTA_SPOOL_EMAIL),
+    }
 
 try:
+    # Opcional: .get para não cair no erro de chave ausente
+    SENHA_ADMIN = st.secrets.get("admin", {}).get("SENHA")
+
     # Carregar credenciais do Firebase
-    firebase_credentials_json = st.secrets["firebase"]["FIREBASE_CREDENTIALS"]
-    FIREBASE_CREDENTIALS = json.loads(firebase_credentials_json)
+    FIREBASE_CREDENTIALS = carregar_credenciais_firebase()
 
     # Carregar credenciais de e-mail
-    EMAIL = st.secrets["email"]["EMAIL_CREDENCIADO"]
-    SENHA = st.secrets["email"]["EMAIL_SENHA"]
+    configuracao_email = carregar_configuracao_email()
+    EMAIL = configuracao_email['EMAIL']
+    SENHA = configuracao_email['SENHA']
+    SMTP_HOST = configuracao_email['SMTP_HOST']
+    SMTP_PORTA = configuracao_email['SMTP_PORTA']
+    SMTP_STARTTLS = configuracao_email['SMTP_STARTTLS']
+    PASTA_SPOOL_EMAIL = configuracao_email['PASTA_SPOOL']
 
 except KeyError as e:
     st.error(f"Chave ausente no arquivo secrets.toml: {e}")
@@ -78,18 +119,66 @@ except json.JSONDecodeError as e:
 except Exception as e:
     st.error(f"Erro inesperado: {e}")
 
-# Inicializar Firebase com as credenciais
-if FIREBASE_CREDENTIALS:
+@st.cache_resource
+def obter_db():
+    # App do Firebase e cliente do Firestore criados uma vez por processo
     if not firebase_admin._apps:  # Verifica se o Firebase já foi inicializado
-        try:
-            cred = credentials.Certificate(FIREBASE_CREDENTIALS)
-            firebase_admin.initialize_app(cred)
-        except Exception as e:
-            st.error(f"Erro ao inicializar o Firebase: {e}")
+        firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS))
+    return firestore.client()
 
-
-# Obter referência do Firestore
-db = firestore.client() if firebase_admin._apps else None
+# Inicializar Firebase com as credenciais e obter referência do Firestore
+db = None
+if FIREBASE_CREDENTIALS:
+    try:
+        db = obter_db()
+    except Exception as e:
+        st.error(f"Erro ao inicializar o Firebase: {e}")
+
+# Onde os agendamentos ficam guardados (ver armazenamento.py): "firestore" em produção;
+# "sqlite" ou "memoria" rodam o app inteiro sem rede (testes de carga, profiling).
+# Ex.: AGENDA_BACKEND=sqlite AGENDA_SQLITE=agenda_local.db streamlit run "si (2) (1).py"
+BACKEND_ARMAZENAMENTO = os.environ.get("AGENDA_BACKEND", "firestore")
+CAMINHO_SQLITE = os.environ.get("AGENDA_SQLITE", "agenda_local.db")
+# Porta do endpoint /metrics no formato do Prometheus (sem a variável, as métricas só vão para o log)
+PORTA_METRICAS = os.environ.get("AGENDA_METRICAS_PORTA")
+
+@st.cache_resource
+def obter_metricas():
+    # Contadores e histogramas do processo, somados por todas as sessões
+    metricas = Metricas()
+    if PORTA_METRICAS:
+        try:
+            metricas.servir(int(PORTA_METRICAS))
+        except (ValueError, OSError) as e:
+            st.error(f"Erro ao iniciar o endpoint de métricas: {e}")
+    return metricas
+
+metricas = obter_metricas()
+
+# Custo (documentos lidos/gravados e tempo das operações) de cada execução do script.
+# A conta da execução anterior é fechada aqui, no começo da seguinte, porque st.rerun()
+# e st.stop() interrompem o script antes do fim.
+def abrir_conta_execucao():
+    if '_id_sessao' not in st.session_state:
+        st.session_state._id_sessao = f"{random.getrandbits(32):08x}"
+        st.session_state._conta_sessao = Conta()
+    anterior = st.session_state.get('_conta_execucao')
+    if anterior is not None:
+        metricas.registrar_execucao(anterior, st.session_state._id_sessao)
+        st.session_state._conta_sessao.somar(anterior)
+        st.session_state._ultima_conta = anterior
+    st.session_state._conta_execucao = Conta()
+    metricas.usar_conta(st.session_state._conta_execucao)
+
+abrir_conta_execucao()
+st.session_state._fragmentos_executados = set()
+
+def abrir_conta_do_fragmento(nome):
+    # Na execução completa o fragmento entra na conta da página; quando só ele é
+    # reexecutado (interação dentro dele ou run_every), ganha uma conta própria
+    if nome in st.session_state._fragmentos_executados:
+        abrir_conta_execucao()
+    st.session_state._fragmentos_executados.add(nome)
 
 # Dados básicos
 # A lista de horários base será gerada dinamicamente na tabela
@@ -108,70 +197,158 @@ servicos = {
 # Lista de serviços para exibição
 lista_servicos = servicos
 
-barbeiros = ["Aluizio", "Lucas Borges"]
+# Barbeiros, horários e regras de funcionamento (almoço, domingos, intervalo especial...)
+# ficam declarados em regras_horario.py
+barbeiros = list(BARBEIROS)
+
+# Tempo (em segundos) que o snapshot de ocupação de um dia fica em cache.
+# As gravações feitas por este app invalidam o dia na hora; o TTL só limita
+# quanto tempo uma alteração feita fora do app (ex.: pelo console) demora a aparecer.
+TTL_CACHE_OCUPACAO = 60
+
+# Como os horários ficam guardados no Firestore (ver agenda_dias.py):
+# "slots" = um documento por horário, "dias" = um documento por dia, e "duplo" grava nos
+# dois e ainda lê os slots, para a transição. Para migrar: mudar para "duplo", rodar
+# migrar_agenda_dias.py (e conferir com --verificar) e só então mudar para "dias".
+LAYOUT_ARMAZENAMENTO = LAYOUT_SLOTS
+
+@st.cache_resource
+def obter_armazenamento():
+    # Um backend por processo (a conexão SQLite e os dados em memória são compartilhados)
+    # Toda chamada passa pelo ArmazenamentoMedido, que mede o tempo e conta os documentos,
+    # e pelo ArmazenamentoProtegido: prazo, novas tentativas e disjuntor (ver politica_chamadas.py)
+    interno = criar_armazenamento(BACKEND_ARMAZENAMENTO, db, LAYOUT_ARMAZENAMENTO, CAMINHO_SQLITE)
+    if not interno:
+        return None
+    return ArmazenamentoMedido(ArmazenamentoProtegido(interno, metricas=metricas), metricas)
+
+armazenamento = obter_armazenamento()
+
+@st.cache_resource
+def obter_cache_ocupacao():
+    # Um único cache por processo, compartilhado entre todas as sessões
+    return CacheOcupacao(TTL_CACHE_OCUPACAO)
+
+# Quantos dias à frente de hoje ficam com listener em tempo real do Firestore
+DIAS_OUVIDOS = 7
+# De quanto em quanto tempo a tabela se redesenha a partir da memória (timedelta e não
+# "30s": o Streamlit importa o pandas só para converter o texto, ~0,4 s a mais no cold start)
+INTERVALO_ATUALIZACAO_TABELA = timedelta(seconds=30)
+
+@st.cache_resource
+def obter_ouvinte_disponibilidade():
+    return OuvinteDisponibilidade(db, obter_cache_ocupacao(), DIAS_OUVIDOS, LAYOUT_ARMAZENAMENTO, metricas)
+
+# Quantos dias a visão da semana mostra (e quantos dias cada consulta da tabela traz)
+DIAS_VISAO_SEMANA = 7
+
+@st.cache_resource
+def obter_pre_carregador():
+    return PreCarregador(armazenamento, obter_cache_ocupacao())
+
+if armazenamento and armazenamento.tempo_real:
+    # Abre os listeners que faltarem (ex.: virou o dia) e reabre os que caíram
+    obter_ouvinte_disponibilidade().acompanhar(datetime.today().date())
+
+# Porta da API JSON de disponibilidade (ver api_disponibilidade.py), para o bot e o link da
+# bio: responde do mesmo cache da tabela, sem abrir sessão do Streamlit. Sem a variável, não sobe
+PORTA_API_DISPONIBILIDADE = os.environ.get("AGENDA_API_PORTA")
 
-# Função para enviar e-mail
-def enviar_email(assunto, mensagem):
-    # Proteção extra para caso as credenciais não carreguem
-    if not EMAIL or not SENHA:
-        st.warning("Credenciais de e-mail não configuradas. E-mail não enviado.")
-        return
+@st.cache_resource
+def obter_api_disponibilidade():
+    from api_disponibilidade import ApiDisponibilidade
+    ouvinte = obter_ouvinte_disponibilidade() if armazenamento.tempo_real else None
+    api = ApiDisponibilidade(armazenamento, obter_cache_ocupacao(), barbeiros, ouvinte, metricas)
+    return api.servir(int(PORTA_API_DISPONIBILIDADE))
+
+if PORTA_API_DISPONIBILIDADE and armazenamento:
     try:
-        msg = MIMEText(mensagem)
-        msg['Subject'] = assunto
-        msg['From'] = EMAIL
-        msg['To'] = EMAIL
-
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(EMAIL, SENHA)  # Login usando as credenciais do e-mail
-            server.sendmail(EMAIL, EMAIL, msg.as_string())
-    except Exception as e:
-        st.error(f"Erro ao enviar e-mail: {e}")
+        obter_api_disponibilidade()
+    except (ValueError, OSError) as e:
+        st.error(f"Erro ao iniciar a API de disponibilidade: {e}")
+
+# Consequências dos agendamentos (e-mail, liberar o horário seguinte do corte + barba):
+# o agendamento e o cancelamento gravam um evento no mesmo commit, e esta thread trata a
+# fila em segundo plano (ver trabalhador_eventos.py). O cliente só espera a gravação
+@st.cache_resource
+def obter_trabalhador_eventos():
+    from functools import cache
+    from trabalhador_eventos import TrabalhadorEventos, avisar_por_email, liberar_horario_seguinte
+
+    @cache
+    def caixa_saida_email():
+        # Criada no primeiro e-mail (smtplib fica fora da abertura da página). Uma única thread
+        # de envio por processo, com a sessão SMTP reaproveitada entre e-mails
+        from caixa_saida_email import CaixaSaidaEmail
+        return CaixaSaidaEmail(
+            EMAIL, SENHA,
+            host=SMTP_HOST,
+            porta=SMTP_PORTA,
+            usar_starttls=SMTP_STARTTLS,
+            pasta_spool=PASTA_SPOOL_EMAIL,
+            metricas=metricas,
+        ).iniciar()
+
+    tratadores = {
+        AGENDAMENTO_CRIADO: [],
+        AGENDAMENTO_CANCELADO: [liberar_horario_seguinte(armazenamento, obter_cache_ocupacao())],
+    }
+    if EMAIL and SENHA:
+        for lista in tratadores.values():
+            # O evento só é concluído depois que o servidor SMTP aceita o e-mail
+            lista.append(avisar_por_email(caixa_saida_email, metricas))
+    else:
+        logging.getLogger(__name__).warning("Credenciais de e-mail não configuradas: os avisos de agendamento não serão enviados.")
+    # No Firestore, um listener na fila acorda a thread na hora; nos outros backends ela é
+    # acordada pelo próprio app depois de gravar (e confere a fila de tempos em tempos)
+    return TrabalhadorEventos(armazenamento, tratadores, db=db if armazenamento.tempo_real else None,
+                              metricas=metricas).iniciar()
 
-# SUBSTITUA A FUNÇÃO INTEIRA
-def salvar_agendamento(data_str, horario, nome, telefone, servicos, barbeiro):
-    if not db:
+if armazenamento:
+    obter_trabalhador_eventos()
+
+def salvar_agendamento(data_str, horario, nome, telefone, servicos, barbeiro, quantidade_bloqueios=0, envio=None):
+    """
+    Salva o agendamento e bloqueia os `quantidade_bloqueios` horários seguintes do
+    mesmo barbeiro (ex: 1 para corte + barba) em UMA única transação: todos os
+    horários são lidos juntos e gravados no mesmo commit, ou nada é gravado.
+    O índice por telefone (coleção 'telefones') é atualizado no mesmo commit.
+    Com `envio` (ver envio_do_formulario), repetir o mesmo envio não dá "Horário já
+    ocupado" (ver reservar_atendimento); se o horário foi mesmo ocupado por outro
+    cliente, o barbeiro guardado no envio é esquecido para o próximo envio escolher de novo.
+    """
+    if not armazenamento:
         st.error("Firestore não inicializado.")
         return False
 
+    # Converte a data string (que vem do formulário) para um objeto datetime
+    data_obj = datetime.strptime(data_str, '%d/%m/%Y')
     try:
-        # Converte a data string (que vem do formulário) para um objeto datetime
-        data_obj = datetime.strptime(data_str, '%d/%m/%Y')
-        
-        # Cria o ID do documento no formato correto YYYY-MM-DD
-        data_para_id = data_obj.strftime('%Y-%m-%d')
-        chave_agendamento = f"{data_para_id}_{horario}_{barbeiro}"
-        agendamento_ref = db.collection('agendamentos').document(chave_agendamento)
-        
-        # Esta é a parte que você perguntou, agora dentro da função principal
-        @firestore.transactional
-        def update_in_transaction(transaction, doc_ref):
-            doc = doc_ref.get(transaction=transaction)
-            if doc.exists:
-                # Se o documento já existe, a transação falha para evitar agendamento duplo
-                raise ValueError("Horário já ocupado por outra pessoa.")
-            
-            # Se o horário estiver livre, a transação define os novos dados
-            transaction.set(doc_ref, {
-                'data': data_obj,
-                'horario': horario,
-                'nome': nome,
-                'telefone': telefone,
-                'servicos': servicos,
-                'barbeiro': barbeiro,
-                'timestamp': firestore.SERVER_TIMESTAMP
-            })
-        
-        # Executa a transação
-        transaction = db.transaction()
-        update_in_transaction(transaction, agendamento_ref)
+        reservar_atendimento(armazenamento, data_obj, horario, nome, telefone, servicos, barbeiro, quantidade_bloqueios,
+                             envio['id_envio'] if envio else None)
+        obter_cache_ocupacao().invalidar(data_obj.strftime('%Y-%m-%d'))
+        obter_trabalhador_eventos().acordar()  # E-mail em segundo plano
         return True # Retorna sucesso
 
     except ValueError as e:
-        # Captura o erro "Horário já ocupado" e exibe ao utilizador
+        # Captura o erro "Horário já ocupado" e exibe ao utilizador. O dia em cache estava
+        # desatualizado (foi ele que mostrou o horário livre): é lido de novo na próxima vez
+        obter_cache_ocupacao().invalidar(data_obj.strftime('%Y-%m-%d'))
+        if envio:
+            # Conflito certo (nada foi gravado): o barbeiro só fica guardado quando a execução foi
+            # interrompida ou o prazo esgotou, casos em que o agendamento pode ter sido gravado
+            envio['barbeiro'] = None
         st.error(f"Erro ao agendar: {e}")
         return False
+    except PrazoEsgotado:
+        # A transação pode ter sido gravada depois do prazo: o dia é relido na próxima vez
+        obter_cache_ocupacao().invalidar(data_obj.strftime('%Y-%m-%d'))
+        st.error("O banco de dados demorou a responder e não foi possível confirmar o agendamento. "
+                 "Confira em \"Meus Agendamentos\" antes de tentar de novo.")
+        return False
+    except BancoIndisponivel as e:
+        st.error(str(e))
+        return False
     except Exception as e:
         st.error(f"Erro inesperado ao salvar o agendamento: {e}")
         return False
@@ -180,128 +357,95 @@ def salvar_agendamento(data_str, horario, nome, telefone, servicos, barbeiro):
 def cancelar_agendamento(doc_id, telefone_cliente):
     """
     Cancela um agendamento no Firestore de forma segura.
+    O agendamento e a sua entrada no índice por telefone são apagados no mesmo commit.
     """
-    if not db:
+    if not armazenamento:
         st.error("Firestore não inicializado.")
         return None
     
     try:
-        doc_ref = db.collection('agendamentos').document(doc_id)
-        doc = doc_ref.get()
+        resultado = cancelar_reserva(armazenamento, doc_id, telefone_cliente)
 
         # PASSO CHAVE: VERIFICA SE O DOCUMENTO EXISTE ANTES DE TUDO
-        if not doc.exists:
+        if resultado == "not_found":
             st.error(f"Nenhum agendamento encontrado com o ID: {doc_id}")
-            return "not_found" # Retorna um código de erro
-
-        agendamento_data = doc.to_dict()
-        telefone_no_banco = agendamento_data.get('telefone', '') # Pega o telefone de forma segura
-
-        # Compara os telefones
-        if telefone_no_banco.replace(" ", "").replace("-", "") != telefone_cliente.replace(" ", "").replace("-", ""):
+        elif resultado == "phone_mismatch":
             st.error("O número de telefone não corresponde ao agendamento.")
-            return "phone_mismatch" # Retorna outro código de erro
-
-        # Se tudo deu certo, deleta e retorna os dados
-        doc_ref.delete()
-        return agendamento_data
-
+        else:
+            obter_cache_ocupacao().invalidar(doc_id[:10])  # O ID começa com YYYY-MM-DD
+            obter_trabalhador_eventos().acordar()  # Horário seguinte e e-mail em segundo plano
+        return resultado
+
+    except PrazoEsgotado:
+        # O cancelamento não é repetido (contaria duas vezes): pode ter sido gravado depois do prazo
+        obter_cache_ocupacao().invalidar(doc_id[:10])
+        st.error("O banco de dados demorou a responder e não foi possível confirmar o cancelamento. "
+                 "Confira em \"Meus Agendamentos\" antes de tentar de novo.")
+        return None
+    except BancoIndisponivel as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"Ocorreu um erro ao tentar cancelar: {e}")
         return None
 
-# no seu arquivo si (9).py
-
-def desbloquear_horario(data_para_id, horario, barbeiro):
-    """
-    Desbloqueia um horário usando a data já no formato correto (YYYY-MM-DD).
-    """
-    if not db:
-        st.error("Firestore não inicializado. Não é possível desbloquear.")
-        return
-
-    # A função agora recebe a data JÁ no formato YYY-MM-DD, então não precisa converter.
-    # As linhas que causavam o erro foram removidas.
-    
-    chave_bloqueio = f"{data_para_id}_{horario}_{barbeiro}_BLOQUEADO"
-    agendamento_ref = db.collection('agendamentos').document(chave_bloqueio)
-    
-    try:
-        # Tenta apagar o documento de bloqueio diretamente.
-        # Se o documento não existir, o Firestore não faz nada e não gera erro.
-        agendamento_ref.delete()
-        # A mensagem de sucesso agora é mostrada na tela principal.
-
-    except Exception as e:
-        st.error(f"Erro ao tentar desbloquear o horário seguinte: {e}")
-
 # SUBSTITUA A FUNÇÃO INTEIRA PELA VERSÃO ABAIXO:
 def buscar_agendamentos_e_bloqueios_do_dia(data_obj):
     """
     Busca todos os agendamentos e bloqueios do dia, retornando um dicionário
     com o ID do documento como chave e os dados do documento como valor.
+
+    O resultado fica no cache compartilhado (obter_cache_ocupacao) até expirar
+    ou até alguma gravação no mesmo dia invalidá-lo.
     """
-    if not db:
+    return buscar_agendamentos_e_bloqueios_do_periodo(data_obj, 1).get(data_obj.strftime('%Y-%m-%d'), {})
+
+def buscar_agendamentos_e_bloqueios_do_periodo(data_inicio, dias):
+    """
+    Igual à busca do dia, mas para `dias` dias seguidos a partir de `data_inicio`,
+    com UMA consulta por faixa de ID para todos os dias que não estão no cache.
+
+    Returns:
+        dict: {'YYYY-MM-DD': ocupados_map} com todos os dias do período.
+    """
+    if not armazenamento:
         st.error("Firestore não inicializado.")
         return {}
 
-    ocupados_map = {}
-    prefixo_id = data_obj.strftime('%Y-%m-%d')
-
     try:
-        docs = db.collection('agendamentos') \
-                 .order_by(FieldPath.document_id()) \
-                 .start_at([prefixo_id]) \
-                 .end_at([prefixo_id + '\uf8ff']) \
-                 .stream()
-
-        for doc in docs:
-            ocupados_map[doc.id] = doc.to_dict()
-
+        return carregar_periodo(armazenamento, obter_cache_ocupacao(), data_inicio, dias)
+    except BancoIndisponivel as e:
+        # Modo somente leitura: mostra o último snapshot guardado de cada dia, se houver
+        ids = [(data_inicio + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(dias)]
+        ultimos = {data_para_id: obter_cache_ocupacao().ultimo_conhecido(data_para_id) for data_para_id in ids}
+        if None in ultimos.values():
+            st.error(f"Erro ao buscar agendamentos do dia: {e}")
+            return {}
+        st.warning("O banco de dados não está respondendo: esta é a última disponibilidade conhecida "
+                   "e pode estar desatualizada.")
+        return ultimos
     except Exception as e:
+        # Em caso de erro nada vai para o cache; a próxima execução tenta de novo
         st.error(f"Erro ao buscar agendamentos do dia: {e}")
+        return {}
 
-    return ocupados_map
-    
-# A SUA FUNÇÃO, COM A CORREÇÃO DO NOME DA VARIÁVEL
-def verificar_disponibilidade_horario_seguinte(data, horario, barbeiro):
-    if not db:
-        st.error("Firestore não inicializado.")
-        return False
-
-    try:
-        horario_dt = datetime.strptime(horario, '%H:%M')
-        horario_seguinte_dt = horario_dt + timedelta(minutes=30)
-        if horario_seguinte_dt.hour >= 20:
-            return False 
-
-        horario_seguinte_str = horario_seguinte_dt.strftime('%H:%M')
-        data_obj = datetime.strptime(data, '%d/%m/%Y')
-        data_para_id = data_obj.strftime('%Y-%m-%d')
-
-        # --- A CORREÇÃO ESTÁ AQUI ---
-        # O nome da variável foi padronizado para "chave_agendamento_seguinte"
-        chave_agendamento_seguinte = f"{data_para_id}_{horario_seguinte_str}_{barbeiro}"
-        agendamento_ref_seguinte = db.collection('agendamentos').document(chave_agendamento_seguinte)
-        # --- FIM DA CORREÇÃO ---
-
-        chave_bloqueio_seguinte = f"{data_para_id}_{horario_seguinte_str}_{barbeiro}_BLOQUEADO"
-        bloqueio_ref_seguinte = db.collection('agendamentos').document(chave_bloqueio_seguinte)
+# Formato da imagem de resumo (ver resumo_imagem.FORMATOS_SAIDA). "PNG_256", "JPEG" e
+# "WEBP" geram arquivos bem menores que o PNG original
+FORMATO_IMAGEM_RESUMO = "PNG"
 
-        doc_agendamento_seguinte = agendamento_ref_seguinte.get()
-        doc_bloqueio_seguinte = bloqueio_ref_seguinte.get()
+@st.cache_resource
+def obter_renderizador_tabela():
+    # Peças do HTML montadas uma vez e tabelas prontas compartilhadas entre as sessões
+    return RenderizadorTabela(barbeiros)
 
-        return not doc_agendamento_seguinte.exists and not doc_bloqueio_seguinte.exists
-
-    except google.api_core.exceptions.RetryError as e:
-        st.error(f"Erro de conexão com o Firestore ao verificar horário seguinte: {e}")
-        return False
-    except Exception as e:
-        st.error(f"Erro inesperado ao verificar disponibilidade do horário seguinte: {e}")
-        return False
+@st.cache_resource
+def obter_renderizador_resumo():
+    # Template e fontes carregados uma vez por processo
+    from resumo_imagem import RenderizadorResumo
+    return RenderizadorResumo("template_resumo.png", "font.ttf")
 
 # NOVA FUNÇÃO PARA GERAR A IMAGEM DE RESUMO
-def gerar_imagem_resumo(nome, data, horario, barbeiro, servicos):
+def gerar_imagem_resumo(nome, data, horario, barbeiro, servicos, formato=FORMATO_IMAGEM_RESUMO):
     """
     Gera uma imagem de resumo do agendamento.
 
@@ -311,116 +455,31 @@ def gerar_imagem_resumo(nome, data, horario, barbeiro, servicos):
         horario (str): Horário do agendamento (ex: "10:30").
         barbeiro (str): Nome do barbeiro.
         servicos (list): Lista de serviços selecionados.
+        formato (str): Formato de saída (chave de resumo_imagem.FORMATOS_SAIDA).
 
     Returns:
-        bytes: A imagem gerada em formato PNG como bytes, pronta para download.
+        bytes: A imagem gerada no formato pedido como bytes, pronta para download.
     """
     try:
-        template_path = "template_resumo.png"  # <-- LINHA CORRIGIDA
-        font_path = "font.ttf"
-        img = Image.open(template_path).convert("RGBA") # Adicionado .convert("RGBA") para melhor compatibilidade com PNG
-        draw = ImageDraw.Draw(img)
-        
-        # 1. Defina a largura máxima em pixels que o nome pode ocupar.
-        LARGURA_MAXIMA_NOME = 800
-
-        # 2. Defina o tamanho inicial e o tamanho mínimo da fonte.
-        tamanho_fonte_nome = 85  # Começa com o tamanho que você gostou
-        tamanho_fonte_minimo = 30 
-
-        # 3. Carrega a fonte com o tamanho inicial.
-        font_nome = ImageFont.truetype(font_path, tamanho_fonte_nome)
-
-        # 4. Loop para reduzir o tamanho da fonte se o nome for muito largo.
-        while font_nome.getbbox(nome)[2] > LARGURA_MAXIMA_NOME and tamanho_fonte_nome > tamanho_fonte_minimo:
-            tamanho_fonte_nome -= 5 
-            font_nome = ImageFont.truetype(font_path, tamanho_fonte_nome)
-
-        # Carrega a fonte para o corpo do texto (esta linha continua existindo).
-        font_corpo = ImageFont.truetype(font_path, 65)
-
-        # 2. Formata o texto do resumo
-        # Junta a lista de serviços em uma única string, com quebra de linha se for longa
-        servicos_str = ", ".join(servicos)
-        if len(servicos_str) > 30: # Se a linha de serviços for muito longa
-            servicos_formatados = '\n'.join(servicos) # Coloca um serviço por linha
-            texto_resumo = f"""
-Data: {data}
-Horário: {horario}
-Barbeiro: {barbeiro}
-Serviços:
-{servicos_formatados}
-"""
-        else:
-            texto_resumo = f"""
-Data: {data}
-Horário: {horario}
-Barbeiro: {barbeiro}
-Serviços: {servicos_str}
-"""
-
-        # 3. Define a posição e as cores do texto
-        #    (X, Y) -> Distância da esquerda, Distância do topo
-        #    VOCÊ PROVAVELMENTE PRECISARÁ AJUSTAR ESSES VALORES!
-        posicao_nome = (180, 700)
-        posicao_detalhes = (180, 800)
-        
-        cor_texto = (0, 0, 0) # Preto
-
-        # 4. "Desenha" o texto na imagem
-        draw.text(posicao_nome, nome, fill=cor_texto, font=font_nome)
-        draw.multiline_text(posicao_detalhes, texto_resumo, fill=cor_texto, font=font_corpo, spacing=10)
-
-        # 5. Salva a imagem em um buffer de memória (sem criar um arquivo no disco)
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        return buf.getvalue()
+        with metricas.span('gerar_imagem_resumo'):
+            return obter_renderizador_resumo().renderizar(nome, data, horario, barbeiro, servicos, formato)
 
     except FileNotFoundError:
-        st.error(f"Erro: Verifique se os arquivos 'template_resumo.jpg' e 'font.ttf' estão na pasta do projeto.")
+        st.error(f"Erro: Verifique se os arquivos 'template_resumo.png' e 'font.ttf' estão na pasta do projeto.")
         return None
     except Exception as e:
         st.error(f"Ocorreu um erro ao gerar a imagem: {e}")
         return None
         
-# Função para bloquear horário para um barbeiro específico
-def bloquear_horario(data, horario, barbeiro):
-    if not db:
-        st.error("Firestore não inicializado. Não é possível bloquear.")
-        return False
-
-    # 1. Converte a string de data "dd/mm/yyyy" para um objeto de data.
-    try:
-        data_obj = datetime.strptime(data, '%d/%m/%Y')
-    except ValueError:
-        st.error("Formato de data inválido para bloqueio.")
-        return False
-
-    # 2. Usa o objeto de data para criar o ID no formato CORRETO (YYYY-MM-DD).
-    data_para_id = data_obj.strftime('%Y-%m-%d')
-    chave_bloqueio = f"{data_para_id}_{horario}_{barbeiro}_BLOQUEADO"
-
-    try:
-        # 3. Usa a chave correta para criar o documento de bloqueio.
-        db.collection('agendamentos').document(chave_bloqueio).set({
-            'nome': "BLOQUEADO",
-            'telefone': "BLOQUEADO",
-            'servicos': ["BLOQUEADO"],
-            'barbeiro': barbeiro,
-            'data': data_obj,  # Salva o objeto de data no documento
-            'horario': horario,
-            'agendado_por': 'bloqueio_interno' # Campo para identificar a origem
-        })
-        return True
-    except Exception as e:
-        st.error(f"Erro ao bloquear horário: {e}")
-        return False
-
 # Interface Streamlit
 st.title("Barbearia Lucas Borges - Agendamentos")
 st.header("Faça seu agendamento ou cancele")
 st.image("https://i.imgur.com/XVOXz8F.png", use_container_width=True)
 
+if armazenamento and armazenamento.modo_degradado:
+    st.warning("Estamos com instabilidade no sistema: por enquanto só é possível consultar os horários, "
+               "e novos agendamentos e cancelamentos ficam suspensos. Tente novamente em alguns instantes.")
+
 # Gerenciamento da Data Selecionada no Session State
 if 'data_agendamento' not in st.session_state:
     st.session_state.data_agendamento = datetime.today().date()  # Inicializar como objeto date
@@ -434,437 +493,615 @@ def handle_date_change():
     st.session_state['date_changed'] = True # Indica que a data mudou
     # st.rerun() # Força o rerender da página para atualizar a tabela imediatamente (opcional, mas melhora UX)
 
-data_agendamento_obj = st.date_input(
-    "Data para visualizar disponibilidade",
-    value=st.session_state.data_agendamento, # Usa o valor do session state
-    min_value=datetime.today().date(), # Garante que seja um objeto date
-    key="data_input_widget",
-    on_change=handle_date_change
-)
+# A página é dividida em fragmentos que se reexecutam sozinhos: trocar a data só redesenha a
+# tabela, e mexer num formulário só reexecuta aquele formulário (sem CSS, banner ou consulta
+# da tabela). Agendar e cancelar chamam st.rerun(), que reexecuta a página inteira.
+#
+# A tabela também se reexecuta a cada INTERVALO_ATUALIZACAO_TABELA: como os dias próximos são
+# lidos da memória (atualizada pelo listener), agendamentos feitos em outro aparelho aparecem
+# sem recarregar
+@st.fragment(run_every=INTERVALO_ATUALIZACAO_TABELA)
+def exibir_tabela_disponibilidade():
+    abrir_conta_do_fragmento("tabela")
+
+    data_agendamento_obj = st.date_input(
+        "Data para visualizar disponibilidade",
+        value=st.session_state.data_agendamento, # Usa o valor do session state
+        min_value=datetime.today().date(), # Garante que seja um objeto date
+        key="data_input_widget",
+        on_change=handle_date_change
+    )
+
+    # Atualiza o session state se o valor do widget for diferente (necessário se não usar on_change ou rerun)
+    if data_agendamento_obj != st.session_state.data_agendamento:
+        st.session_state.data_agendamento = data_agendamento_obj
+
+    # Sempre usa a data do session_state para consistência
+    data_obj_tabela = st.session_state.data_agendamento
+
+    st.subheader("Disponibilidade dos Barbeiros")
+
+    # 1. CHAMA A FUNÇÃO RÁPIDA UMA ÚNICA VEZ
+    # Traz a semana inteira a partir da data escolhida em uma só consulta (os dias
+    # acompanhados pelo listener ou já em cache nem vão ao banco)
+    semana = buscar_agendamentos_e_bloqueios_do_periodo(data_obj_tabela, DIAS_VISAO_SEMANA)
+
+    # 2. CRIA A VARIÁVEL COM O FORMATO CORRETO PARA O ID
+    # Esta é a adição importante. Usamos o objeto de data para criar a string YYYY-MM-DD
+    data_para_id_tabela = data_obj_tabela.strftime('%Y-%m-%d')
+    agendamentos_do_dia = semana.get(data_para_id_tabela, {})
+
+    # Deixa carregando em segundo plano a semana seguinte e o dia anterior,
+    # para que trocar de data não precise esperar o banco
+    if armazenamento:
+        obter_pre_carregador().agendar(data_obj_tabela + timedelta(days=DIAS_VISAO_SEMANA), DIAS_VISAO_SEMANA)
+        dia_anterior = data_obj_tabela - timedelta(days=1)
+        if dia_anterior >= datetime.today().date():
+            obter_pre_carregador().agendar(dia_anterior, 1)
+
+    # O HTML do dia fica guardado pela versão do snapshot em cache: enquanto o dia não
+    # muda, as reexecuções do fragmento (e as outras sessões) reaproveitam a tabela pronta
+    snapshot = obter_cache_ocupacao().obter_com_versao(data_para_id_tabela) if armazenamento else None
+    versao = None
+    if snapshot:
+        # Versão e mapa lidos juntos, para a tabela guardada corresponder à versão
+        versao, agendamentos_do_dia = snapshot
+    with metricas.span('tabela_disponibilidade'):
+        html_table = obter_renderizador_tabela().tabela_do_dia(data_obj_tabela, agendamentos_do_dia, versao)
+    st.markdown(html_table, unsafe_allow_html=True)
+
+    # Atalho para quem quer ser atendido hoje: o primeiro horário livre a partir de agora
+    agora = datetime.now()
+    if data_obj_tabela == agora.date():
+        proximo_indice = sum(1 for horario in HORARIOS if horario <= agora.strftime('%H:%M'))
+        mascaras = mascaras_do_dia(data_obj_tabela, agendamentos_do_dia, barbeiros)
+        proximo_livre = primeiro_horario_livre(mascaras, barbeiros, a_partir_de=proximo_indice)
+        if proximo_livre:
+            st.caption(f"Próximo horário livre hoje: **{proximo_livre[0]}** com {proximo_livre[1]}")
+
+    # Visão da semana: horários livres de cada barbeiro nos próximos dias, a partir
+    # da mesma consulta usada pela tabela
+    if semana and st.toggle("Ver a semana", key="ver_semana"):
+        with metricas.span('tabela_disponibilidade'):
+            html_semana = obter_renderizador_tabela().tabela_da_semana(data_obj_tabela, semana, DIAS_VISAO_SEMANA)
+        st.markdown(html_semana, unsafe_allow_html=True)
+
+exibir_tabela_disponibilidade()
 
-# Atualiza o session state se o valor do widget for diferente (necessário se não usar on_change ou rerun)
-if data_agendamento_obj != st.session_state.data_agendamento:
-     st.session_state.data_agendamento = data_agendamento_obj
-    
-
-# Sempre usa a data do session_state para consistência
-# --- Tabela de Disponibilidade ---
-
-# SUAS LINHAS - MANTIDAS EXATAMENTE COMO PEDIU
-data_para_tabela = st.session_state.data_agendamento.strftime('%d/%m/%Y')
-data_obj_tabela = st.session_state.data_agendamento
-
-st.subheader("Disponibilidade dos Barbeiros")
-
-# 1. CHAMA A FUNÇÃO RÁPIDA UMA ÚNICA VEZ
-# Usamos o objeto de data que você já tem
-agendamentos_do_dia = buscar_agendamentos_e_bloqueios_do_dia(data_obj_tabela)
-
-# 2. CRIA A VARIÁVEL COM O FORMATO CORRETO PARA O ID
-# Esta é a adição importante. Usamos o objeto de data para criar a string YYYY-MM-DD
-data_para_id_tabela = data_obj_tabela.strftime('%Y-%m-%d')
-
-# --- O resto da sua lógica de construção da tabela continua, mas usando a variável correta ---
-html_table = '<table style="font-size: 14px; border-collapse: collapse; width: 100%; border: 1px solid #ddd;"><tr><th style="padding: 8px; border: 1px solid #ddd; background-color: #0e1117; color: white;">Horário</th>'
-for barbeiro in barbeiros:
-    html_table += f'<th style="padding: 8px; border: 1px solid #ddd; background-color: #0e1117; color: white; min-width: 120px; text-align: center;">{barbeiro}</th>'
-html_table += '</tr>'
-
-dia_da_semana_tabela = data_obj_tabela.weekday()
-horarios_tabela = [f"{h:02d}:{m:02d}" for h in range(8, 20) for m in (0, 30)]
-dia_tabela = data_obj_tabela.day
-mes_tabela = data_obj_tabela.month
-intervalo_especial = mes_tabela == 7 and 10 <= dia_tabela <= 19
-
-for horario in horarios_tabela:
-    html_table += f'<tr><td style="padding: 8px; border: 1px solid #ddd; text-align: center;">{horario}</td>'
-    for barbeiro in barbeiros:
-        # A nova regra: SÓ bloqueia as 8:00 se NÃO for o intervalo especial
-        if dia_da_semana_tabela < 5 and not intervalo_especial and horario == "08:00" and barbeiro == "Lucas Borges":
-            status = "Indisponível"
-            bg_color = "#808080"
-            color_text = "white"
-            html_table += f'<td style="padding: 8px; border: 1px solid #ddd; background-color: {bg_color}; text-align: center; color: {color_text}; height: 30px;">{status}</td>'
-            continue
-            
-        status = "Indisponível"
-        bg_color = "grey"
-        color_text = "white"
-        hora_int = int(horario.split(':')[0])
-
-        # A sua lógica de SDJ (mantida igual)
-        if horario in ["07:00", "07:30"]:
-            dia_do_mes = data_obj_tabela.day
-            mes_do_ano = data_obj_tabela.month
-            if not intervalo_especial:
-                status = "SDJ"
-                bg_color = "#696969"
-                html_table += f'<td style="padding: 8px; border: 1px solid #ddd; background-color: {bg_color}; text-align: center; color: {color_text}; height: 30px;">{status}</td>'
-                continue
-
-        # 3. A CORREÇÃO CRUCIAL
-        # Usamos a nova variável `data_para_id_tabela` para criar a chave
-        chave_agendamento = f"{data_para_id_tabela}_{horario}_{barbeiro}"
-        chave_bloqueio = f"{chave_agendamento}_BLOQUEADO"
-
-        disponivel = (chave_agendamento not in agendamentos_do_dia) and (chave_bloqueio not in agendamentos_do_dia)
-
-        # A sua lógica de dias da semana (mantida igual)
-        if dia_da_semana_tabela < 5:
-            almoco_lucas = not intervalo_especial and (hora_int == 12 or hora_int == 13)
-            almoco_aluizio = not intervalo_especial and (hora_int == 12 or hora_int == 13)
-
-            # ===== AQUI ESTÁ A MUDANÇA =====
-            # Verificamos o almoço primeiro
-            if (barbeiro == "Lucas Borges" and almoco_lucas) or (barbeiro == "Aluizio" and almoco_aluizio):
-                # Agora, verificamos se esse horário de almoço foi fechado manualmente
-                dados_agendamento = agendamentos_do_dia.get(chave_agendamento)
-                if dados_agendamento and dados_agendamento.get('nome') == 'Fechado':
-                    status, bg_color, color_text = "Fechado", "#A9A9A9", "black"
-                else:
-                    # Se não foi fechado, continua como Almoço
-                    status, bg_color, color_text = "Almoço", "orange", "black"
-            else:
-                dados_agendamento = agendamentos_do_dia.get(chave_agendamento)
-                if dados_agendamento and dados_agendamento.get('nome') == 'Fechado':
-                    status = "Fechado"
-                    bg_color = "#A9A9A9"
-                    color_text = "black"
-                elif disponivel:
-                    status = "Disponível"
-                    bg_color = "forestgreen"
-                else:
-                    status = "Ocupado"
-                    bg_color = "firebrick"
-
-        elif dia_da_semana_tabela == 5:
-            dados_agendamento = agendamentos_do_dia.get(chave_agendamento)
-            if dados_agendamento and dados_agendamento.get('nome') == 'Fechado':
-                status = "Fechado"
-                bg_color = "#A9A9A9"
-                color_text = "black"
-            elif disponivel:
-                status = "Disponível"
-                bg_color = "forestgreen"
-            else:
-                status = "Ocupado"
-                bg_color = "firebrick"
-
-        elif dia_da_semana_tabela == 6:
-            if intervalo_especial: # Se for o domingo do intervalo especial
-                dados_agendamento = agendamentos_do_dia.get(chave_agendamento)
-                if dados_agendamento and dados_agendamento.get('nome') == 'Fechado':
-                    status, bg_color, color_text = "Fechado", "#A9A9A9", "black"
-                elif disponivel:
-                    status, bg_color = "Disponível", "forestgreen"
-                else:
-                    status, bg_color = "Ocupado", "firebrick"
-            else: # Domingo normal
-                status, bg_color, color_text = "Fechado", "#A9A9A9", "black"
-
-        
-        html_table += f'<td style="padding: 8px; border: 1px solid #ddd; background-color: {bg_color}; text-align: center; color: {color_text}; height: 30px;">{status}</td>'
-    
-    html_table += '</tr>'
+# Aba de Agendamento (FORMULÁRIO)
+# Envio idempotente do formulário: cliques repetidos em "Confirmar Agendamento" (comuns com
+# a conexão lenta) trazem os mesmos campos e reaproveitam o mesmo envio. Se ele já deu certo,
+# o resultado é mostrado de novo sem transação, e-mail ou imagem; se a execução anterior foi
+# interrompida no meio da gravação, a reserva é repetida com o mesmo id_envio
+def envio_do_formulario(campos, chave='_envio_agendamento'):
+    envio = st.session_state.get(chave)
+    if envio is None or envio['campos'] != campos:
+        envio = {
+            'campos': campos,
+            'id_envio': f"{st.session_state._id_sessao}-{random.getrandbits(32):08x}",
+            'barbeiro': None,      # Barbeiro escolhido quando o envio chegou à gravação
+            'confirmacao': None,   # O agendamento_confirmado, quando deu certo
+        }
+        st.session_state[chave] = envio
+    return envio
 
-html_table += '</table>'
-st.markdown(html_table, unsafe_allow_html=True)
+@st.fragment
+def formulario_agendamento():
+    abrir_conta_do_fragmento("agendamento")
 
-# Aba de Agendamento (FORMULÁRIO)
-with st.form("agendar_form"):
-    st.subheader("Agendar Horário")
-    nome = st.text_input("Nome")
-    telefone = st.text_input("Telefone")
+    with st.container(key="form_agendar"), st.form("agendar_form"):
+        st.subheader("Agendar Horário")
+        nome = st.text_input("Nome")
+        telefone = st.text_input("Telefone")
 
-    # Usar o valor do session state para a data DENTRO do formulário
-    # A data exibida aqui será a mesma da tabela, pois ambas usam session_state
-    st.write(f"Data selecionada: **{st.session_state.data_agendamento.strftime('%d/%m/%Y')}**")
-    data_agendamento_str_form = st.session_state.data_agendamento.strftime('%d/%m/%Y') # String para salvar
-    data_obj_agendamento_form = st.session_state.data_agendamento # Objeto date para validações
+        # A data é a escolhida na tabela (session_state). Trocar a data só reexecuta a tabela,
+        # então o formulário não repete a data: ela é lida de novo no envio e vai no resumo
+        st.caption("O agendamento é feito para a data escolhida na tabela de disponibilidade.")
+        data_agendamento_str_form = st.session_state.data_agendamento.strftime('%d/%m/%Y') # String para salvar
+        data_obj_agendamento_form = st.session_state.data_agendamento # Objeto date para validações
 
-    # Geração da lista de horários completa para agendamento
-    horarios_base_agendamento = [f"{h:02d}:{m:02d}" for h in range(8, 20) for m in (0, 30)]
+        # Geração da lista de horários completa para agendamento
+        horarios_base_agendamento = list(HORARIOS)
 
-    barbeiro_selecionado = st.selectbox("Escolha o barbeiro", barbeiros + ["Sem preferência"])
+        barbeiro_selecionado = st.selectbox("Escolha o barbeiro", barbeiros + ["Sem preferência"])
 
-    # Filtrar horários de almoço com base no barbeiro selecionado ou "Sem preferência"
-    # (Opcional: Poderia filtrar aqui, mas a validação no submit é mais robusta)
-    horarios_disponiveis_dropdown = horarios_base_agendamento # Por enquanto, mostra todos
-    # --- Lógica de filtragem complexa poderia entrar aqui ---
-    # Mas é mais seguro validar APÓS o submit, pois a disponibilidade pode mudar
+        # Filtrar horários de almoço com base no barbeiro selecionado ou "Sem preferência"
+        # (Opcional: Poderia filtrar aqui, mas a validação no submit é mais robusta)
+        horarios_disponiveis_dropdown = horarios_base_agendamento # Por enquanto, mostra todos
+        # --- Lógica de filtragem complexa poderia entrar aqui ---
+        # Mas é mais seguro validar APÓS o submit, pois a disponibilidade pode mudar
 
-    horario_agendamento = st.selectbox("Horário", horarios_disponiveis_dropdown)
+        horario_agendamento = st.selectbox("Horário", horarios_disponiveis_dropdown)
 
-    servicos_selecionados = st.multiselect("Serviços", lista_servicos)
+        servicos_selecionados = st.multiselect("Serviços", lista_servicos)
 
-    # Exibir os preços com o símbolo R$
-    st.write("Serviços disponíveis:")
-    for servico in servicos:
-        st.write(f"- {servico}")
+        # Exibir os preços com o símbolo R$
+        st.write("Serviços disponíveis:")
+        for servico in servicos:
+            st.write(f"- {servico}")
 
-    submitted = st.form_submit_button("Confirmar Agendamento")
+        submitted = st.form_submit_button("Confirmar Agendamento")
     
 
-if submitted:
-    with st.spinner("Processando agendamento..."):
-        # Usar o objeto date diretamente do session state para obter o dia da semana
-        dia_da_semana_agendamento = data_obj_agendamento_form.weekday() # 0=Segunda, 6=Domingo
-        dia = data_obj_agendamento_form.day
-        mes = data_obj_agendamento_form.month
-        data_para_id = data_obj_agendamento_form.strftime('%Y-%m-%d')
-        # >>> FIM DA MUDANÇA <<<
-        
-        if dia_da_semana_agendamento == 6:
-            if not (mes == 7 and 10 <= dia <= 19):
-                st.error("Desculpe, estamos fechados aos domingos.")
+    envio = None
+    if submitted:
+        envio = envio_do_formulario((data_agendamento_str_form, horario_agendamento, nome, telefone,
+                                     tuple(servicos_selecionados), barbeiro_selecionado))
+        if envio['confirmacao'] is not None:
+            metricas.incrementar('agenda_envios_repetidos_total')
+            st.session_state.agendamento_confirmado = envio['confirmacao']
+
+    if submitted and envio['confirmacao'] is None:
+        with st.spinner("Processando agendamento..."):
+            data_para_id = data_obj_agendamento_form.strftime('%Y-%m-%d')
+            # Leitura da memória (cache/listener), sem ida ao banco na maioria das vezes
+            agendamentos_do_dia = buscar_agendamentos_e_bloqueios_do_dia(data_obj_agendamento_form)
+
+            # Validações básicas de preenchimento
+            if not nome or not telefone or not servicos_selecionados:
+                st.error("Por favor, preencha seu nome, telefone e selecione pelo menos um serviço.")
                 st.stop()
 
-        # <<< MODIFICAÇÃO 2: Verificar se é Domingo ANTES de tudo >>>
-        #if dia_da_semana_agendamento == 6:
-            #st.error("Desculpe, não realizamos agendamentos aos domingos.")
-            #st.stop() # Interrompe a execução do agendamento
-        # <<< FIM MODIFICAÇÃO 2 >>>
+            # --- Validação de Visagismo ---
+            servicos_visagismo = ["Abordagem de visagismo", "Consultoria de visagismo"]
+            visagismo_selecionado = any(servico in servicos_selecionados for servico in servicos_visagismo)
 
-        # Validações básicas de preenchimento
-        if not nome or not telefone or not servicos_selecionados:
-            st.error("Por favor, preencha seu nome, telefone e selecione pelo menos um serviço.")
-            st.stop()
-        if horario_agendamento in ["07:00", "07:30"]:
-           dia = data_obj_agendamento_form.day
-           mes = data_obj_agendamento_form.month
-           
-           if not (mes == 7 and 10 <= dia <= 19):
-            st.error("Os horários de 07:00 e 07:30 só estão disponíveis entre os dias 11 e 19 de julho.")
-            st.stop()
-
-        # --- Validações de Horário de Almoço ---
-        intervalo_especial = mes == 7 and 10 <= dia <= 19
-        hora_agendamento_int = int(horario_agendamento.split(':')[0])
-        em_horario_de_almoco = (hora_agendamento_int == 12 or hora_agendamento_int == 13)
-
-        barbeiro_encontrado = None
-        
-        # CASO 1: O USUÁRIO ESCOLHEU UM BARBEIRO ESPECÍFICO
-        if barbeiro_selecionado != "Sem preferência":
-            # Regra 1: Verifica o bloqueio das 8:00 para o Lucas
-            if not intervalo_especial and horario_agendamento == "08:00" and barbeiro_selecionado == "Lucas Borges":
-                st.error("Lucas Borges não atende às 08:00. Por favor, escolha a partir das 08:30 ou selecione o barbeiro Aluizio.")
-                st.stop()
-            
-            # Regra 2: Verifica o horário de almoço para o barbeiro selecionado
-            if not intervalo_especial and em_horario_de_almoco and dia_da_semana_agendamento < 5:
-                st.error(f"{barbeiro_selecionado} está em horário de almoço. Por favor, escolha outro horário.")
-                st.stop()
-            
-            # Se passou nas regras, verifica a disponibilidade no banco de dados
-            chave_agendamento = f"{data_para_id}_{horario_agendamento}_{barbeiro_selecionado}"
-            chave_bloqueio = f"{chave_agendamento}_BLOQUEADO"
-            if (chave_agendamento not in agendamentos_do_dia) and (chave_bloqueio not in agendamentos_do_dia):
-                barbeiro_encontrado = barbeiro_selecionado
-        
-        # CASO 2: O USUÁRIO ESCOLHEU "SEM PREFERÊNCIA"
-        else:
-            barbeiros_a_verificar = ["Aluizio", "Lucas Borges"]  # Ordem de preferência
+            if visagismo_selecionado and barbeiro_selecionado == "Aluizio":
+                 st.error("Apenas Lucas Borges realiza atendimentos de visagismo. Por favor, selecione Lucas Borges ou remova o serviço de visagismo.")
+                 st.stop()
+
+            # --- Barbeiros que podem atender, em ordem de preferência ---
+            if visagismo_selecionado and barbeiro_selecionado == "Sem preferência":
+                barbeiros_a_verificar = ["Lucas Borges"]
+                st.info("Serviço de visagismo selecionado. Agendamento direcionado para Lucas Borges.")
+            elif barbeiro_selecionado != "Sem preferência":
+                barbeiros_a_verificar = [barbeiro_selecionado]
+            else:
+                barbeiros_a_verificar = list(barbeiros)
+
+            # --- Corte+Barba ocupa também o horário seguinte ---
+            quantidade_horarios = horarios_necessarios(servicos_selecionados)
+            precisa_bloquear_proximo = quantidade_horarios > 1
+
+            # --- Regras de funcionamento ---
+            regras_encontradas = []
+            barbeiros_que_atendem = []
             for b in barbeiros_a_verificar:
-                # Regra 1: Pula o Lucas se for 8:00 e não for intervalo especial
-                if not intervalo_especial and horario_agendamento == "08:00" and b == "Lucas Borges":
-                    continue  # Pula para o próximo barbeiro da lista
-
-                # Regra 2: Pula o barbeiro se ele estiver em horário de almoço
-                if not intervalo_especial and em_horario_de_almoco and dia_da_semana_agendamento < 5:
-                    continue # Pula para o próximo barbeiro da lista
-
-                # Se passou nas regras, verifica a disponibilidade no banco de dados
-                chave_agendamento = f"{data_para_id}_{horario_agendamento}_{b}"
-                chave_bloqueio = f"{chave_agendamento}_BLOQUEADO"
-                if (chave_agendamento not in agendamentos_do_dia) and (chave_bloqueio not in agendamentos_do_dia):
-                    barbeiro_encontrado = b  # Encontramos um barbeiro!
-                    st.info(f"Agendando com {barbeiro_encontrado}, o primeiro disponível.")
-                    break  # Sai do loop, pois não precisa procurar mais
-
-        # --- Validação de Visagismo ---
-        servicos_visagismo = ["Abordagem de visagismo", "Consultoria de visagismo"]
-        visagismo_selecionado = any(servico in servicos_selecionados for servico in servicos_visagismo)
-
-        if visagismo_selecionado and barbeiro_selecionado == "Aluizio":
-             st.error("Apenas Lucas Borges realiza atendimentos de visagismo. Por favor, selecione Lucas Borges ou remova o serviço de visagismo.")
-             st.stop()
-        # Se selecionou "Sem preferência" e visagismo, força a seleção para Lucas Borges
-        if visagismo_selecionado and barbeiro_selecionado == "Sem preferência":
-            barbeiro_final = "Lucas Borges"
-            st.info("Serviço de visagismo selecionado. Agendamento direcionado para Lucas Borges.")
-        elif barbeiro_selecionado != "Sem preferência":
-            barbeiro_final = barbeiro_selecionado
-        else:
-             barbeiro_final = None # Será definido abaixo
-
-        # --- Lógica de Atribuição e Verificação de Disponibilidade ---
-        barbeiros_a_verificar = []
-        if barbeiro_final: # Se já foi definido (Visagismo ou escolha específica)
-            barbeiros_a_verificar.append(barbeiro_final)
-        else: # Se for "Sem preferência" e sem visagismo
-            barbeiros_a_verificar = list(barbeiros) # Verifica ambos
-
-# DEPOIS (CORRETO)
-        barbeiro_agendado = None
-# A data já está como objeto em data_obj_agendamento_form
-        data_para_id_form = data_obj_agendamento_form.strftime('%Y-%-m-%d')
-
-        intervalo_especial = False
-        if dia_da_semana_agendamento < 5:
-            intervalo_especial = (mes == 7 and 10 <= dia <= 19)
-            
-        for b in barbeiros_a_verificar:
-            if not intervalo_especial:
-                if b == "Lucas Borges" and (hora_agendamento_int == 12 or hora_agendamento_int == 13):
-                    continue # Pula este barbeiro se estiver em almoço
-                if b == "Aluizio" and (hora_agendamento_int == 12 or hora_agendamento_int == 13):
-                    continue # Pula este barbeiro se estiver em almoço
-
-            chave_agendamento_form = f"{data_para_id_form}_{horario_agendamento}_{b}"
-            chave_bloqueio_form = f"{chave_agendamento_form}_BLOQUEADO"
-
-    # Verifica de forma instantânea no conjunto que já foi carregado
-            if (chave_agendamento_form not in agendamentos_do_dia) and (chave_bloqueio_form not in agendamentos_do_dia):
-                barbeiro_agendado = b
-                break # Encontrou um barbeiro disponível
-
-# O resto do seu código a partir daqui continua igual...
-        if not barbeiro_agendado:
-            st.error(f"Horário {horario_agendamento} indisponível para os barbeiros selecionados/disponíveis. Por favor, escolha outro horário ou verifique a tabela de disponibilidade.")
-            st.stop()
-
-        # --- Verificação de Horário Seguinte para Corte+Barba ---
-        precisa_bloquear_proximo = False
-        corte_selecionado = any(corte in servicos_selecionados for corte in ["Tradicional", "Social", "Degradê", "Navalhado"])
-        barba_selecionada = "Barba" in servicos_selecionados
-
-        if corte_selecionado and barba_selecionada:
-            if not verificar_disponibilidade_horario_seguinte(data_agendamento_str_form, horario_agendamento, barbeiro_agendado):
-                horario_seguinte_dt = datetime.strptime(horario_agendamento, '%H:%M') + timedelta(minutes=30)
-                horario_seguinte_str = horario_seguinte_dt.strftime('%H:%M')
-                st.error(f"O barbeiro {barbeiro_agendado} não poderá atender para corte e barba, pois já está ocupado no horário seguinte ({horario_seguinte_str}). Por favor, escolha serviços que caibam em 30 minutos ou selecione outro horário/barbeiro.")
+                regra = grade_do_dia(data_obj_agendamento_form, b).regra(horario_agendamento)
+                if regra:
+                    regras_encontradas.append((b, regra))  # Pula este barbeiro (almoço, folga, fechado...)
+                else:
+                    barbeiros_que_atendem.append(b)
+
+            if not barbeiros_que_atendem:
+                regras_distintas = {regra for _, regra in regras_encontradas}
+                b, regra = regras_encontradas[0]
+                if len(regras_encontradas) == 1 or (len(regras_distintas) == 1 and "{barbeiro}" not in regra.mensagem):
+                    # Nenhum barbeiro atende neste horário pelo mesmo motivo: mostra a mensagem da regra
+                    st.error(regra.mensagem.format(barbeiro=b))
+                else:
+                    st.error(f"Horário {horario_agendamento} indisponível para os barbeiros selecionados/disponíveis. Por favor, escolha outro horário ou verifique a tabela de disponibilidade.")
+                st.stop()
+
+            if envio['barbeiro']:
+                # O mesmo envio já chegou à gravação numa execução interrompida: a tabela pode estar
+                # mostrando o próprio agendamento, então vai direto para a reserva (que reconhece o id_envio)
+                barbeiro_agendado = envio['barbeiro']
+            else:
+                # --- Disponibilidade no dia já carregado, com as máscaras de bits de cada barbeiro ---
+                mascaras = mascaras_do_dia(data_obj_agendamento_form, agendamentos_do_dia, barbeiros)
+                barbeiro_agendado = escolher_barbeiro(mascaras, horario_agendamento, barbeiros_que_atendem, quantidade_horarios)
+
+            if not barbeiro_agendado:
+                livre_so_no_horario = escolher_barbeiro(mascaras, horario_agendamento, barbeiros_que_atendem)
+                if precisa_bloquear_proximo and livre_so_no_horario:
+                    horario_seguinte_str = horarios_seguintes(horario_agendamento, 1)[0]
+                    st.error(f"O barbeiro {livre_so_no_horario} não poderá atender para corte e barba, pois já está ocupado no horário seguinte ({horario_seguinte_str}). Por favor, escolha serviços que caibam em 30 minutos ou selecione outro horário/barbeiro.")
+                else:
+                    st.error(f"Horário {horario_agendamento} indisponível para os barbeiros selecionados/disponíveis. Por favor, escolha outro horário ou verifique a tabela de disponibilidade.")
                 st.stop()
+
+            if barbeiro_selecionado == "Sem preferência" and not visagismo_selecionado:
+                st.info(f"Agendando com {barbeiro_agendado}, o primeiro disponível.")
+
+            # --- Salvar Agendamento e Bloquear (se necessário), na mesma transação ---
+            envio['barbeiro'] = barbeiro_agendado
+            agendamento_salvo = salvar_agendamento(data_agendamento_str_form, horario_agendamento, nome, telefone, servicos_selecionados, barbeiro_agendado,
+                                                   quantidade_bloqueios=1 if precisa_bloquear_proximo else 0, envio=envio)
+
+            if agendamento_salvo:
+                horario_seguinte_bloqueado = precisa_bloquear_proximo
+                if horario_seguinte_bloqueado:
+                    horario_seguinte_str = horarios_seguintes(horario_agendamento, 1)[0]
+
+                # --- Resumo (o e-mail para a barbearia sai pelo TrabalhadorEventos) ---
+                resumo = f"""
+                Nome: {nome}
+                Telefone: {telefone}
+                Data: {data_agendamento_str_form}
+                Horário: {horario_agendamento}
+                Barbeiro: {barbeiro_agendado}
+                Serviços: {', '.join(servicos_selecionados)}
+                """
+
+                # ### INÍCIO DA MODIFICAÇÃO ###
+                # Chama a função para gerar a imagem com os dados do agendamento
+                imagem_bytes = gerar_imagem_resumo(
+                    nome=nome,
+                    data=data_agendamento_str_form,
+                    horario=horario_agendamento,
+                    barbeiro=barbeiro_agendado,
+                    servicos=servicos_selecionados
+                )
+
+                # --- Mensagem de Sucesso e Rerun ---
+                from resumo_imagem import FORMATOS_SAIDA  # já carregado por gerar_imagem_resumo
+                # O resultado fica na sessão e a página é reexecutada na hora: a tabela já volta
+                # atualizada e o resumo continua na tela, sem prender a thread do script esperando
+                envio['confirmacao'] = st.session_state.agendamento_confirmado = {
+                    'resumo': resumo,
+                    'barbeiro': barbeiro_agendado,
+                    'horario_seguinte_bloqueado': horario_seguinte_str if horario_seguinte_bloqueado else None,
+                    'imagem_bytes': imagem_bytes,
+                    'nome_arquivo': f"agendamento_{nome.split(' ')[0]}_{data_agendamento_str_form.replace('/', '-')}.{FORMATOS_SAIDA[FORMATO_IMAGEM_RESUMO][2]}",
+                    'mime': FORMATOS_SAIDA[FORMATO_IMAGEM_RESUMO][1],
+                }
+                st.rerun()
             else:
-                precisa_bloquear_proximo = True
-
-        # --- Salvar Agendamento e Bloquear (se necessário) ---
-        agendamento_salvo = salvar_agendamento(data_agendamento_str_form, horario_agendamento, nome, telefone, servicos_selecionados, barbeiro_agendado)
-
-        if agendamento_salvo:
-            horario_seguinte_bloqueado = False
-            if precisa_bloquear_proximo:
-                horario_seguinte_dt = datetime.strptime(horario_agendamento, '%H:%M') + timedelta(minutes=30)
-                horario_seguinte_str = horario_seguinte_dt.strftime('%H:%M')
-                horario_seguinte_bloqueado = bloquear_horario(data_agendamento_str_form, horario_seguinte_str, barbeiro_agendado)
-                if not horario_seguinte_bloqueado:
-                     st.warning("O agendamento principal foi salvo, mas houve um erro ao bloquear o horário seguinte. Por favor, entre em contato com a barbearia se necessário.")
-
-
-            # --- Preparar e Enviar E-mail ---
-            resumo = f"""
-            Nome: {nome}
-            Telefone: {telefone}
-            Data: {data_agendamento_str_form}
-            Horário: {horario_agendamento}
-            Barbeiro: {barbeiro_agendado}
-            Serviços: {', '.join(servicos_selecionados)}
-            """
-            enviar_email("Agendamento Confirmado", resumo)
-
-            # --- Mensagem de Sucesso e Rerun ---
-            st.success("Agendamento confirmado com sucesso!")
-            st.info("Resumo do agendamento:\n" + resumo)
-            if horario_seguinte_bloqueado:
-                st.info(f"O horário das {horario_seguinte_str} com {barbeiro_agendado} foi bloqueado para acomodar todos os serviços.")
-            
-            # ### INÍCIO DA MODIFICAÇÃO ###
-            # Chama a função para gerar a imagem com os dados do agendamento
-            imagem_bytes = gerar_imagem_resumo(
-                nome=nome,
-                data=data_agendamento_str_form,
-                horario=horario_agendamento,
-                barbeiro=barbeiro_agendado,
-                servicos=servicos_selecionados
+                # Mensagem de erro se salvar_agendamento falhar (já exibida pela função)
+                st.error("Não foi possível completar o agendamento. Verifique as mensagens de erro acima ou tente novamente.")
+
+    # Confirmação do último agendamento da sessão: fica visível (com o download) até o cliente fechar
+    if 'agendamento_confirmado' in st.session_state:
+        confirmacao = st.session_state.agendamento_confirmado
+        st.success("Agendamento confirmado com sucesso!")
+        st.info("Resumo do agendamento:\n" + confirmacao['resumo'])
+        if confirmacao['horario_seguinte_bloqueado']:
+            st.info(f"O horário das {confirmacao['horario_seguinte_bloqueado']} com {confirmacao['barbeiro']} foi bloqueado para acomodar todos os serviços.")
+
+        # Se a imagem foi gerada corretamente, mostra o botão de download
+        if confirmacao['imagem_bytes']:
+            st.download_button(
+                label="📥 Baixar Resumo do Agendamento",
+                data=confirmacao['imagem_bytes'],
+                file_name=confirmacao['nome_arquivo'],
+                mime=confirmacao['mime']
             )
+        st.button("Fechar resumo", on_click=lambda: st.session_state.pop('agendamento_confirmado', None))
+
+formulario_agendamento()
+
+
+# Agendamento recorrente: as próximas visitas do cliente de sempre (mesmo horário e
+# barbeiro) com uma leitura de todas as datas e um único commit (ver agendamento_recorrente.py)
+@st.fragment
+def formulario_recorrente():
+    abrir_conta_do_fragmento("agendamento_recorrente")
+
+    with st.expander("Agendamento recorrente"):
+        from agendamento_recorrente import INTERVALOS_SEMANAS, MAX_OCORRENCIAS, agendar_serie, datas_da_serie
+
+        with st.form("agendamento_recorrente_form"):
+            st.caption("Para quem vem sempre no mesmo horário e com o mesmo barbeiro: agende as próximas visitas de uma vez.")
+            nome = st.text_input("Nome")
+            telefone = st.text_input("Telefone")
+            primeira_data = st.date_input("Primeira visita", min_value=datetime.today().date())
+            horario = st.selectbox("Horário", HORARIOS)
+            barbeiro = st.selectbox("Barbeiro", barbeiros)
+            servicos_escolhidos = st.multiselect("Serviços", lista_servicos)
+            intervalo = st.selectbox("Repetir", INTERVALOS_SEMANAS, index=1,
+                                     format_func=lambda semanas: "toda semana" if semanas == 1 else f"a cada {semanas} semanas")
+            ocorrencias = st.number_input("Quantidade de visitas", min_value=2, max_value=MAX_OCORRENCIAS, value=4)
+            todas_ou_nenhuma = st.checkbox("Só agendar se todas as datas estiverem livres")
+            submitted_recorrente = st.form_submit_button("Agendar visitas")
+
+        if not submitted_recorrente:
+            return
+        if not nome or not telefone or not servicos_escolhidos:
+            st.error("Por favor, preencha seu nome, telefone e selecione pelo menos um serviço.")
+            return
+        if barbeiro == "Aluizio" and any(s in servicos_escolhidos for s in ["Abordagem de visagismo", "Consultoria de visagismo"]):
+            st.error("Apenas Lucas Borges realiza atendimentos de visagismo. Por favor, selecione Lucas Borges ou remova o serviço de visagismo.")
+            return
+        if not armazenamento:
+            st.error("Firestore não inicializado.")
+            return
+
+        envio = envio_do_formulario((primeira_data, horario, nome, telefone, tuple(servicos_escolhidos), barbeiro,
+                                     intervalo, ocorrencias, todas_ou_nenhuma), chave='_envio_recorrente')
+        resultado = None
+        try:
+            with st.spinner("Agendando as visitas..."):
+                resultado = agendar_serie(armazenamento, primeira_data, horario, nome, telefone, servicos_escolhidos,
+                                          barbeiro, intervalo, int(ocorrencias), envio['id_envio'], todas_ou_nenhuma)
+        except ValueError as e:
+            st.error(f"Erro ao agendar: {e}")
+        except PrazoEsgotado:
+            st.error("O banco de dados demorou a responder e não foi possível confirmar as visitas. "
+                     "Confira em \"Meus Agendamentos\" antes de tentar de novo.")
+        except BancoIndisponivel as e:
+            st.error(str(e))
+        except Exception as e:
+            st.error(f"Erro inesperado ao agendar as visitas: {e}")
+        finally:
+            # Mesmo sem resposta, o commit pode ter sido feito: as datas são relidas na próxima vez
+            for data in datas_da_serie(primeira_data, intervalo, int(ocorrencias)):
+                obter_cache_ocupacao().invalidar(data.strftime('%Y-%m-%d'))
 
-            # Se a imagem foi gerada corretamente, mostra o botão de download
-            if imagem_bytes:
-                st.download_button(
-                    label="📥 Baixar Resumo do Agendamento",
-                    data=imagem_bytes,
-                    file_name=f"agendamento_{nome.split(' ')[0]}_{data_agendamento_str_form.replace('/', '-')}.png",
-                    mime="image/png"
-                )
-            st.info("A página será atualizada em 15 segundos.")
-            time.sleep(15) 
+        if resultado is None:
+            return
+        if resultado['agendados']:
+            obter_trabalhador_eventos().acordar()  # E-mails em segundo plano
+
+        def formatar(doc_id):
+            return datetime.strptime(doc_id[:10], '%Y-%m-%d').strftime('%d/%m/%Y')
+
+        confirmados = sorted(resultado['agendados'] + resultado['ja_agendados'])
+        if confirmados:
+            st.success(f"{len(confirmados)} visita(s) agendada(s) às {horario} com {barbeiro}: "
+                       + ", ".join(formatar(doc_id) for doc_id in confirmados) + ".")
+        if resultado['conflitos']:
+            nao_agendadas = "Nenhuma visita foi agendada. Datas" if todas_ou_nenhuma and not confirmados else "Datas não agendadas"
+            st.warning(f"{nao_agendadas}:\n" + "\n".join(
+                f"- {formatar(data_para_id)}: {motivo}" for data_para_id, motivo in resultado['conflitos']))
+
+formulario_recorrente()
+
+
+def processar_cancelamento(doc_id, telefone):
+    """
+    Cancela e reexecuta a página. O horário seguinte (corte + barba) é liberado e a
+    barbearia é avisada em segundo plano, pelo evento gravado junto com o cancelamento.
+    """
+    with st.spinner("Processando cancelamento..."):
+        resultado_cancelamento = cancelar_agendamento(doc_id, telefone)
+
+        if isinstance(resultado_cancelamento, dict):
+            agendamento_cancelado_data = resultado_cancelamento
+            seguintes = horarios_seguintes(agendamento_cancelado_data['horario'],
+                                           horarios_necessarios(agendamento_cancelado_data.get('servicos', [])) - 1)
+            horario_seguinte_desbloqueado = any(h < "20:00" for h in seguintes)
+
+            st.success("Agendamento cancelado com sucesso!")
+            # Mesma ideia do agendamento: guarda o resultado e reexecuta sem esperar
+            st.session_state.cancelamento_confirmado = {
+                'horario_seguinte_desbloqueado': horario_seguinte_desbloqueado,
+            }
+            # A lista de "Meus agendamentos" mudou: será buscada de novo
+            st.session_state.pop('meus_agendamentos', None)
+            # Um novo envio igual ao último agendamento é um agendamento novo, não uma repetição
+            st.session_state.pop('_envio_agendamento', None)
+            st.session_state.pop('_envio_recorrente', None)
             st.rerun()
-        else:
-            # Mensagem de erro se salvar_agendamento falhar (já exibida pela função)
-            st.error("Não foi possível completar o agendamento. Verifique as mensagens de erro acima ou tente novamente.")
+    return resultado_cancelamento
+
+
+# Meus agendamentos: com o índice por telefone, uma única leitura traz todos os
+# próximos agendamentos do cliente, e cada um pode ser cancelado direto da lista
+@st.fragment
+def meus_agendamentos():
+    abrir_conta_do_fragmento("meus_agendamentos")
+
+    with st.container(key="form_meus_agendamentos"), st.form("meus_agendamentos_form"):
+        st.subheader("Meus Agendamentos")
+        telefone_consulta = st.text_input("Telefone usado no Agendamento", key="telefone_meus_agendamentos")
+        submitted_consulta = st.form_submit_button("Ver meus agendamentos")
 
+    if submitted_consulta:
+        if not normalizar_telefone(telefone_consulta):
+            st.error("Por favor, informe o telefone utilizado no agendamento.")
+        elif not armazenamento:
+            st.error("Firestore não inicializado.")
+        else:
+            try:
+                st.session_state.meus_agendamentos = {
+                    'telefone': telefone_consulta,
+                    'itens': armazenamento.agendamentos_do_telefone(telefone_consulta, datetime.today().strftime('%Y-%m-%d')),
+                }
+            except Exception as e:
+                st.error(f"Erro ao buscar seus agendamentos: {e}")
+
+    if 'meus_agendamentos' in st.session_state:
+        consulta = st.session_state.meus_agendamentos
+        if not consulta['itens']:
+            st.info("Nenhum agendamento futuro encontrado para este telefone.")
+        for item in consulta['itens']:
+            col_info, col_botao = st.columns([4, 1])
+            data_item = datetime.strptime(item['data'], '%Y-%m-%d').strftime('%d/%m/%Y')
+            col_info.write(f"**{data_item} às {item['horario']}** com {item['barbeiro']} — {', '.join(item.get('servicos', []))}")
+            if col_botao.button("Cancelar", key=f"cancelar_{item['doc_id']}"):
+                if processar_cancelamento(item['doc_id'], consulta['telefone']) == "not_found":
+                    # O agendamento já não existe (ex: apagado pela barbearia): tira do índice
+                    try:
+                        armazenamento.remover_do_indice(normalizar_telefone(consulta['telefone']), item['doc_id'])
+                        consulta['itens'] = [outro for outro in consulta['itens'] if outro is not item]
+                    except Exception as e:
+                        st.error(f"Erro ao atualizar seus agendamentos: {e}")
+
+meus_agendamentos()
 
 
 # Aba de Cancelamento
-with st.form("cancelar_form"):
-    st.subheader("Cancelar Agendamento")
-    telefone_cancelar = st.text_input("Telefone usado no Agendamento")
-    data_cancelar = st.date_input("Data do Agendamento", min_value=datetime.today().date()) # Usar date()
+@st.fragment
+def formulario_cancelamento():
+    abrir_conta_do_fragmento("cancelamento")
 
-    # Geração da lista de horários completa para cancelamento
-    horarios_base_cancelamento = [f"{h:02d}:{m:02d}" for h in range(8, 20) for m in (0, 30)]
+    with st.container(key="form_cancelar"), st.form("cancelar_form"):
+        st.subheader("Cancelar Agendamento")
+        telefone_cancelar = st.text_input("Telefone usado no Agendamento")
+        data_cancelar = st.date_input("Data do Agendamento", min_value=datetime.today().date()) # Usar date()
 
-    horario_cancelar = st.selectbox("Horário do Agendamento", horarios_base_cancelamento) # Usa a lista completa
+        # Geração da lista de horários completa para cancelamento
+        horarios_base_cancelamento = list(HORARIOS)
 
-    barbeiro_cancelar = st.selectbox("Barbeiro do Agendamento", barbeiros)
-    submitted_cancelar = st.form_submit_button("Cancelar Agendamento")
+        horario_cancelar = st.selectbox("Horário do Agendamento", horarios_base_cancelamento) # Usa a lista completa
 
-if submitted_cancelar:
-    if not telefone_cancelar:
-        st.error("Por favor, informe o telefone utilizado no agendamento.")
-    else:
-        with st.spinner("Processando cancelamento..."):
+        barbeiro_cancelar = st.selectbox("Barbeiro do Agendamento", barbeiros)
+        submitted_cancelar = st.form_submit_button("Cancelar Agendamento")
+
+    if submitted_cancelar:
+        if not normalizar_telefone(telefone_cancelar):
+            st.error("Por favor, informe o telefone utilizado no agendamento.")
+        else:
             data_para_id = data_cancelar.strftime('%Y-%m-%d')
             doc_id_cancelar = f"{data_para_id}_{horario_cancelar}_{barbeiro_cancelar}"
-
-            resultado_cancelamento = cancelar_agendamento(doc_id_cancelar, telefone_cancelar)
-
-            if isinstance(resultado_cancelamento, dict):
-                agendamento_cancelado_data = resultado_cancelamento
-                servicos_cancelados = agendamento_cancelado_data.get('servicos', [])
-                corte_no_cancelado = any(corte in servicos_cancelados for corte in ["Tradicional", "Social", "Degradê", "Navalhado"])
-                barba_no_cancelado = "Barba" in servicos_cancelados
-                horario_seguinte_desbloqueado = False
-
-                if corte_no_cancelado and barba_no_cancelado:
-                    horario_agendamento_original = agendamento_cancelado_data['horario']
-                    barbeiro_original = agendamento_cancelado_data['barbeiro']
-                    data_obj_original = agendamento_cancelado_data['data']
-
-                    horario_seguinte_dt = (datetime.strptime(horario_agendamento_original, '%H:%M') + timedelta(minutes=30))
-                    if horario_seguinte_dt.hour < 20:
-                        horario_seguinte_str = horario_seguinte_dt.strftime('%H:%M')
-                        data_para_id_desbloqueio = data_obj_original.strftime('%Y-%m-%d')
-                        desbloquear_horario(data_para_id_desbloqueio, horario_seguinte_str, barbeiro_original)
-                        horario_seguinte_desbloqueado = True
-
-        # --- A sua lógica de E-mail e Mensagem de Sucesso (MANTIDA) ---
-                resumo_cancelamento = f"""
-                Agendamento Cancelado:
-                Nome: {agendamento_cancelado_data.get('nome', 'N/A')}
-                Telefone: {agendamento_cancelado_data.get('telefone', 'N/A')}
-                Data: {data_cancelar.strftime('%d/%m/%Y')}
-                Horário: {agendamento_cancelado_data.get('horario', 'N/A')}
-                Barbeiro: {agendamento_cancelado_data.get('barbeiro', 'N/A')}
-                Serviços: {', '.join(agendamento_cancelado_data.get('servicos', []))}
-                """
-                enviar_email("Agendamento Cancelado", resumo_cancelamento)
-        
-                st.success("Agendamento cancelado com sucesso!")
-                if horario_seguinte_desbloqueado:
-                    st.info("O horário seguinte, que estava bloqueado, foi liberado.")
-        
-                time.sleep(5)
-                st.rerun()
-                
-
+            processar_cancelamento(doc_id_cancelar, telefone_cancelar)
+
+    # Mostrado uma única vez, logo após o cancelamento
+    if 'cancelamento_confirmado' in st.session_state:
+        cancelamento = st.session_state.pop('cancelamento_confirmado')
+        st.success("Agendamento cancelado com sucesso!")
+        if cancelamento['horario_seguinte_desbloqueado']:
+            st.info("O horário seguinte, que estava bloqueado, será liberado em instantes.")
+
+formulario_cancelamento()
+
+# Área da barbearia: bloqueia ou libera muitos horários de uma vez (férias, folga, dia
+# fechado), com uma leitura do período (ver bloqueio_lote.py)
+@st.fragment
+def area_da_barbearia():
+    abrir_conta_do_fragmento("area_da_barbearia")
+
+    with st.expander("Área da barbearia"):
+        hoje = datetime.today().date()
+        with st.form("bloqueio_lote_form"):
+            st.subheader("Bloquear ou liberar horários")
+            senha_digitada = st.text_input("Senha", type="password")
+            acao = st.radio("Ação", ["Bloquear", "Liberar"], horizontal=True)
+            periodo = st.date_input("Período", value=(hoje, hoje), min_value=hoje)
+            barbeiros_lote = st.multiselect("Barbeiros", barbeiros, default=barbeiros)
+            horarios_lote = st.multiselect("Horários (vazio = o dia inteiro)", HORARIOS)
+            submitted_lote = st.form_submit_button("Aplicar")
+
+        if not submitted_lote:
+            return
+        import hmac
+        from bloqueio_lote import bloquear_periodo, desbloquear_periodo
+
+        if not hmac.compare_digest(senha_digitada.encode(), SENHA_ADMIN.encode()):
+            st.error("Senha incorreta.")
+            return
+        if not armazenamento:
+            st.error("Firestore não inicializado.")
+            return
+        if not barbeiros_lote or not periodo:
+            st.error("Escolha pelo menos um barbeiro e o período.")
+            return
+        data_inicio, data_fim = periodo[0], periodo[-1]
+
+        operacao = bloquear_periodo if acao == "Bloquear" else desbloquear_periodo
+        try:
+            with st.spinner("Aplicando..."):
+                resultado = operacao(armazenamento, data_inicio, data_fim, barbeiros_lote, horarios_lote)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        except Exception as e:
+            st.error(f"Erro ao {acao.lower()} os horários: {e}")
+            resultado = None
+        finally:
+            # Mesmo com erro no meio, parte dos lotes pode ter sido gravada
+            for i in range((data_fim - data_inicio).days + 1):
+                obter_cache_ocupacao().invalidar((data_inicio + timedelta(days=i)).strftime('%Y-%m-%d'))
+
+        if resultado is None:
+            return
+        verbo = "bloqueado(s)" if acao == "Bloquear" else "liberado(s)"
+        st.success(f"{len(resultado['alterados'])} horário(s) {verbo} em {resultado['commits']} gravação(ões).")
+        if resultado['ja_estavam'] or resultado['fora_do_expediente']:
+            st.info(f"{resultado['ja_estavam']} horário(s) já estavam assim e {resultado['fora_do_expediente']} "
+                    "já ficam fechados pelas regras de funcionamento.")
+        if resultado['conflitos']:
+            st.warning("Horários não alterados:\n" + "\n".join(
+                f"- {doc_id.replace('_', ' ')}: {motivo}" for doc_id, motivo in resultado['conflitos']))
+
+@st.cache_resource
+def obter_analise_ocupacao():
+    # pandas só é importado quando alguém abre o painel (ver analise_ocupacao.py)
+    from analise_ocupacao import AnaliseOcupacao
+    return AnaliseOcupacao(armazenamento, barbeiros=barbeiros)
+
+# Painel de ocupação: cada mês é lido uma vez e guardado já agregado, então trocar
+# o período só soma contagens em memória
+@st.fragment
+def painel_ocupacao():
+    abrir_conta_do_fragmento("painel_ocupacao")
+
+    with st.expander("Análise de ocupação"):
+        # Os últimos 12 meses, do mais antigo ao atual ('AAAA-MM')
+        hoje = datetime.today().date()
+        indice_mes = hoje.year * 12 + hoje.month - 1
+        meses = [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(indice_mes - 11, indice_mes + 1)]
+        with st.form("painel_ocupacao_form"):
+            senha_digitada = st.text_input("Senha", type="password")
+            primeiro_mes, ultimo_mes = st.select_slider("Meses", options=meses, value=(meses[-3], meses[-1]))
+            submitted_painel = st.form_submit_button("Ver análise")
+
+        if not submitted_painel:
+            return
+        import hmac
+
+        if not hmac.compare_digest(senha_digitada.encode(), SENHA_ADMIN.encode()):
+            st.error("Senha incorreta.")
+            return
+        if not armazenamento:
+            st.error("Firestore não inicializado.")
+            return
+        try:
+            with st.spinner("Calculando..."), metricas.span('analise_ocupacao'):
+                from analise_ocupacao import DIAS_SEMANA, taxa_de_cancelamento, taxa_de_ocupacao
+                agregados = obter_analise_ocupacao().periodo(primeiro_mes, ultimo_mes)
+        except Exception as e:
+            st.error(f"Erro ao calcular a análise: {e}")
+            return
+
+        por_barbeiro = taxa_de_ocupacao(agregados['barbeiro'])
+        cancelamento = taxa_de_cancelamento(agregados['cancelamento'])
+        cancelados = int(cancelamento['cancelamentos'].sum())
+        col_agendamentos, col_cancelamentos = st.columns(2)
+        col_agendamentos.metric("Agendamentos no período", agregados['agendamentos'])
+        col_cancelamentos.metric("Cancelamentos", cancelados,
+                                 f"{cancelados / max(agregados['agendamentos'] + cancelados, 1):.0%} do que foi agendado",
+                                 delta_color="off")
+        st.caption("Ocupação = horários com cliente / horários abertos que a barbearia não bloqueou. "
+                   "Taxa de cancelamento = cancelados / (agendamentos que ficaram + cancelados), "
+                   "contados desde que o contador de cancelamentos foi criado.")
+        colunas = st.columns(len(por_barbeiro) or 1)
+        for coluna, (barbeiro, linha) in zip(colunas, por_barbeiro.iterrows()):
+            coluna.metric(barbeiro, f"{linha['ocupacao']:.0%}", f"{int(linha['ocupados'])} de {int(linha['abertos'] - linha['bloqueados'])}", delta_color="off")
+            if barbeiro in cancelamento.index:
+                coluna.caption(f"Cancelamentos: {cancelamento.loc[barbeiro, 'taxa']:.0%} "
+                               f"({int(cancelamento.loc[barbeiro, 'cancelamentos'])})")
+
+        st.write("Ocupação por horário")
+        st.bar_chart(taxa_de_ocupacao(agregados['horario'])['ocupacao'])
+        por_dia_semana = taxa_de_ocupacao(agregados['dia_semana'])
+        por_dia_semana.index = [DIAS_SEMANA[i] for i in por_dia_semana.index]
+        st.write("Ocupação por dia da semana")
+        st.bar_chart(por_dia_semana['ocupacao'])
+
+        col_categorias, col_servicos = st.columns(2)
+        col_categorias.write("Mix de atendimentos")
+        col_categorias.dataframe((agregados['categorias'] * 100 / max(agregados['agendamentos'], 1)).rename("participação"),
+                                 column_config={"participação": st.column_config.ProgressColumn(format="%.0f%%", min_value=0, max_value=100)})
+        col_servicos.write("Serviços mais pedidos")
+        col_servicos.dataframe(agregados['servicos'].rename("vezes"))
+
+if SENHA_ADMIN:
+    area_da_barbearia()
+    painel_ocupacao()
+
+# Painel de depuração (abrir a página com ?debug=1): custo desta execução e da sessão
+if st.query_params.get("debug") == "1":
+    with st.sidebar:
+        st.subheader("Depuração")
+        st.caption(f"Sessão {st.session_state._id_sessao} · backend {BACKEND_ARMAZENAMENTO}")
+        st.write("Esta execução (até aqui)")
+        st.json(st.session_state._conta_execucao.como_dict())
+        if '_ultima_conta' in st.session_state:
+            st.write("Execução anterior")
+            st.json(st.session_state._ultima_conta.como_dict())
+        st.write("Sessão (execuções já encerradas)")
+        st.json(st.session_state._conta_sessao.como_dict())
+        st.write("Processo")
+        st.json(metricas.totais())
@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from html import escape
+
+from mascara_disponibilidade import TODOS_OS_HORARIOS, mascaras_do_dia
+from regras_horario import HORARIOS, grade_do_dia
+
+# Classe CSS de cada status da tabela
+CLASSES_STATUS = {
+    "Disponível": "disp",
+    "Ocupado": "ocup",
+    "Fechado": "fech",
+    "Almoço": "almo",
+    "Indisponível": "indi",
+    "SDJ": "sdj",
+    "Lotado": "ocup",
+}
+
+# Estilo da tabela, injetado uma vez junto com o CSS da página: cada célula leva só a classe
+CSS_TABELA = """
+        .tabela-disp { font-size: 14px; border-collapse: collapse; width: 100%; border: 1px solid #ddd; }
+        .tabela-disp th, .tabela-disp td { padding: 8px; border: 1px solid #ddd; text-align: center; }
+        .tabela-disp th { background-color: #0e1117; color: white; }
+        .tabela-disp th.barbeiro { min-width: 120px; }
+        .tabela-disp td.st { height: 30px; color: white; }
+        .tabela-disp td.disp { background-color: forestgreen; }
+        .tabela-disp td.ocup { background-color: firebrick; }
+        .tabela-disp td.fech { background-color: #A9A9A9; color: black; }
+        .tabela-disp td.almo { background-color: orange; color: black; }
+        .tabela-disp td.indi { background-color: #808080; }
+        .tabela-disp td.sdj { background-color: #696969; }
+"""
+
+NOMES_DIAS = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
+
+
+def status_do_horario(regra, ocupados_map, chave_agendamento):
+    """Texto da célula para um horário, a partir da regra do horário e do snapshot do dia."""
+    dados_agendamento = ocupados_map.get(chave_agendamento)
+    fechado_manualmente = bool(dados_agendamento) and dados_agendamento.get('nome') == 'Fechado'
+
+    if regra and not (regra.respeita_fechado and fechado_manualmente):
+        return regra.status
+    if fechado_manualmente:
+        return "Fechado"
+    if chave_agendamento not in ocupados_map and f"{chave_agendamento}_BLOQUEADO" not in ocupados_map:
+        return "Disponível"
+    return "Ocupado"
+
+
+class RenderizadorTabela:
+    """
+    Gera o HTML das tabelas de disponibilidade.
+
+    Os pedaços fixos (cabeçalho, início das linhas e cada célula possível) são
+    montados uma vez no construtor; renderizar uma tabela é só juntar pedaços.
+    O HTML do dia fica guardado por (dia, versão do snapshot), então uma nova
+    execução sem mudança nos dados não monta a tabela de novo.
+    """
+
+    def __init__(self, barbeiros, max_entradas=256):
+        self.barbeiros = list(barbeiros)
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._html_por_versao = OrderedDict()
+
+        colunas = "".join(f'<th class="barbeiro">{escape(b)}</th>' for b in self.barbeiros)
+        self._cabecalho_dia = f'<table class="tabela-disp"><tr><th>Horário</th>{colunas}</tr>'
+        self._cabecalho_semana = f'<table class="tabela-disp"><tr><th>Dia</th>{colunas}</tr>'
+        self._inicio_linha = {horario: f'<tr><td>{horario}</td>' for horario in HORARIOS}
+        self._celulas = {status: f'<td class="st {classe}">{status}</td>' for status, classe in CLASSES_STATUS.items()}
+
+    def tabela_do_dia(self, data, ocupados_map, versao=None):
+        """HTML da tabela do dia. Com `versao`, o resultado é reaproveitado enquanto ela não mudar."""
+        data_para_id = data.strftime('%Y-%m-%d')
+        chave_cache = (data_para_id, versao)
+        if versao is not None:
+            with self._lock:
+                html = self._html_por_versao.get(chave_cache)
+                if html is not None:
+                    self._html_por_versao.move_to_end(chave_cache)
+                    return html
+
+        grades = [grade_do_dia(data, barbeiro) for barbeiro in self.barbeiros]
+        partes = [self._cabecalho_dia]
+        for indice, horario in enumerate(HORARIOS):
+            partes.append(self._inicio_linha[horario])
+            for barbeiro, grade in zip(self.barbeiros, grades):
+                status = status_do_horario(grade.regras[indice], ocupados_map, f"{data_para_id}_{horario}_{barbeiro}")
+                partes.append(self._celulas[status])
+            partes.append('</tr>')
+        partes.append('</table>')
+        html = "".join(partes)
+
+        if versao is not None:
+            with self._lock:
+                self._html_por_versao[chave_cache] = html
+                while len(self._html_por_versao) > self.max_entradas:
+                    self._html_por_versao.popitem(last=False)
+        return html
+
+    def tabela_da_semana(self, data_inicio, ocupados_por_dia, dias):
+        """HTML da visão da semana: quantos horários cada barbeiro tem livres em cada dia."""
+        partes = [self._cabecalho_semana]
+        for i in range(dias):
+            dia = data_inicio + timedelta(days=i)
+            mascaras = mascaras_do_dia(dia, ocupados_por_dia.get(dia.strftime('%Y-%m-%d'), {}), self.barbeiros)
+            partes.append(f'<tr><td>{NOMES_DIAS[dia.weekday()]} {dia.strftime("%d/%m")}</td>')
+            for barbeiro in self.barbeiros:
+                mascara = mascaras[barbeiro]
+                livres = mascara.livres.bit_count()
+                if mascara.fechado == TODOS_OS_HORARIOS:
+                    partes.append(self._celulas["Fechado"])
+                elif livres:
+                    partes.append(f'<td class="st disp">{livres} livres</td>')
+                else:
+                    partes.append(self._celulas["Lotado"])
+            partes.append('</tr>')
+        partes.append('</table>')
+        return "".join(partes)
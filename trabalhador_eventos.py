@@ -0,0 +1,196 @@
+"""
+Consome a fila de eventos (ver eventos_agenda.py) em segundo plano e executa as
+consequências de cada agendamento criado ou cancelado: e-mail para a barbearia e,
+no cancelamento de um corte + barba, a liberação do horário seguinte.
+
+O evento é gravado no mesmo commit da alteração, então nada se perde se o script
+parar logo depois de gravar: o evento continua na fila até ser tratado. Cada
+tratador pode rodar mais de uma vez para o mesmo evento (ex: o processo caiu
+antes de concluí-lo) e precisa ser idempotente.
+
+Várias réplicas do app podem consumir a mesma fila: cada evento é reservado numa
+transação antes de ser tratado, e as tentativas e a espera entre elas ficam no
+próprio evento, não na memória de um processo.
+"""
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+from eventos_agenda import AGENDAMENTO_CANCELADO, AGENDAMENTO_CRIADO, COLECAO_EVENTOS
+from reservas import horarios_necessarios, horarios_seguintes
+
+logger = logging.getLogger(__name__)
+
+
+class TrabalhadorEventos:
+    """
+    Thread que lê os eventos disponíveis em ordem, reserva cada um por `reserva`
+    segundos, chama os tratadores do tipo ({tipo: [tratador(evento_id, evento)]}) e
+    conclui o evento quando todos dão certo. `reserva` precisa cobrir o tratador
+    mais lento (ex: a espera pelo servidor SMTP em `avisar_por_email`).
+
+    Sem listener, a fila é lida a cada `intervalo` segundos e sempre que alguém chama
+    `acordar` (o app chama logo depois de gravar). Com `db` (Firestore), um listener na
+    coleção de eventos acorda a thread assim que um evento chega, de qualquer processo.
+
+    Um evento que falha fica na fila e só volta a ser tentado depois de uma espera
+    que dobra a cada falha (de `espera_base` até `espera_maxima` segundos); depois
+    de `max_tentativas` falhas ele vai para os eventos falhos (dead letter), com o
+    último erro, para não travar a fila sem se perder.
+    """
+
+    def __init__(self, armazenamento, tratadores, intervalo=5.0, tamanho_lote=50, max_tentativas=10,
+                 espera_base=30.0, espera_maxima=3600.0, reserva=300.0, db=None, metricas=None):
+        self.armazenamento = armazenamento
+        self.tratadores = tratadores
+        self.intervalo = intervalo
+        self.tamanho_lote = tamanho_lote
+        self.max_tentativas = max_tentativas
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.reserva = reserva
+        self.db = db
+        self.metricas = metricas
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._listener = None
+
+    def iniciar(self):
+        if self._thread is not None:
+            return self
+        if self.db is not None:
+            self._listener = self.db.collection(COLECAO_EVENTOS).on_snapshot(lambda *_: self._acordar.set())
+        self._thread = threading.Thread(target=self._trabalhar, name="trabalhador-eventos", daemon=True)
+        self._thread.start()
+        return self
+
+    def acordar(self):
+        self._acordar.set()
+
+    def drenar(self, timeout=30):
+        """
+        Espera a fila esvaziar (para testes e para encerrar o processo). Retorna True se
+        esvaziou; um evento esperando a próxima tentativa faz a espera ir até o timeout.
+        """
+        limite = time.monotonic() + timeout
+        while self.armazenamento.eventos_pendentes(1):
+            if time.monotonic() >= limite:
+                return False
+            self._acordar.set()
+            time.sleep(0.05)
+        return True
+
+    def parar(self, timeout=10):
+        if self._listener is not None:
+            self._listener.unsubscribe()
+            self._listener = None
+        if self._thread is not None:
+            self._parar.set()
+            self._acordar.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _trabalhar(self):
+        while not self._parar.is_set():
+            self._acordar.clear()
+            try:
+                if self.processar_pendentes():
+                    continue  # Lote cheio: pode haver mais na fila
+            except Exception:
+                logger.exception("Falha ao ler a fila de eventos")
+            self._acordar.wait(self.intervalo)
+
+    def processar_pendentes(self):
+        """Trata um lote de eventos. Retorna True se o lote veio cheio (pode haver mais na fila)."""
+        eventos = self.armazenamento.eventos_pendentes(self.tamanho_lote, disponiveis=True)
+        for evento_id, _ in eventos:
+            evento = self.armazenamento.reservar_evento(evento_id, self.reserva)
+            if evento is None:
+                continue  # Outra réplica pegou (ou já concluiu) o evento
+            try:
+                for tratador in self.tratadores.get(evento.get('tipo'), ()):
+                    tratador(evento_id, evento)
+            except Exception as e:
+                self._registrar_falha(evento_id, evento, e)
+            else:
+                self.armazenamento.concluir_evento(evento_id)
+                self._contar('agenda_eventos_tratados_total', evento)
+        return len(eventos) == self.tamanho_lote
+
+    def _registrar_falha(self, evento_id, evento, erro):
+        tentativas = evento.get('tentativas', 0) + 1
+        if tentativas < self.max_tentativas:
+            espera = min(self.espera_maxima, self.espera_base * 2 ** (tentativas - 1))
+            logger.warning("Evento %s (%s) falhou (tentativa %d); nova tentativa em %.0fs",
+                           evento_id, evento.get('tipo'), tentativas, espera, exc_info=erro)
+            self.armazenamento.adiar_evento(evento_id, tentativas, espera, repr(erro))
+            self._contar('agenda_eventos_falhas_total', evento)
+            return
+        logger.error("Evento %s (%s) movido para os eventos falhos depois de %d tentativas",
+                     evento_id, evento.get('tipo'), tentativas, exc_info=erro)
+        self.armazenamento.descartar_evento(evento_id, {**evento, 'tentativas': tentativas}, repr(erro))
+        self._contar('agenda_eventos_descartados_total', evento)
+
+    def _contar(self, nome, evento):
+        if self.metricas is not None:
+            self.metricas.incrementar(nome, tipo=evento.get('tipo'))
+
+
+# --- Tratadores ------------------------------------------------------------------------
+
+def liberar_horario_seguinte(armazenamento, cache=None):
+    """
+    Tratador do cancelamento: apaga o bloqueio do horário seguinte de um corte + barba.
+    A conferência do horário cancelado e a exclusão são uma transação só: um novo
+    corte + barba gravado no meio não perde o bloqueio dele.
+    """
+    def pode_liberar(atual):
+        # Se o horário já foi agendado de novo com corte + barba, o bloqueio é do novo agendamento
+        return not (atual and horarios_necessarios(atual.get('servicos', [])) > 1)
+
+    def tratar(evento_id, evento):
+        agendamento = evento['agendamento']
+        doc_id = evento['doc_id']
+        seguintes = [h for h in horarios_seguintes(agendamento['horario'], horarios_necessarios(agendamento.get('servicos', [])) - 1)
+                     if h < "20:00"]
+        if not seguintes:
+            return
+        ids_bloqueio = [f"{doc_id[:10]}_{h}_{agendamento['barbeiro']}_BLOQUEADO" for h in seguintes]
+        if armazenamento.liberar_bloqueios(doc_id, ids_bloqueio, pode_liberar) and cache is not None:
+            cache.invalidar(doc_id[:10])
+    return tratar
+
+
+def resumo_do_agendamento(evento):
+    agendamento = evento['agendamento']
+    return f"""
+            Nome: {agendamento.get('nome', 'N/A')}
+            Telefone: {agendamento.get('telefone', 'N/A')}
+            Data: {datetime.strptime(evento['doc_id'][:10], '%Y-%m-%d').strftime('%d/%m/%Y')}
+            Horário: {agendamento.get('horario', 'N/A')}
+            Barbeiro: {agendamento.get('barbeiro', 'N/A')}
+            Serviços: {', '.join(agendamento.get('servicos', []))}
+            """
+
+
+def avisar_por_email(caixa_saida, metricas=None, timeout=120.0):
+    """
+    Tratador dos dois eventos: manda o e-mail pela CaixaSaidaEmail com o ID do evento
+    e só retorna quando o servidor SMTP aceita a mensagem, então o evento só é
+    concluído depois do envio (se a caixa desistir ou passar do `timeout`, o evento
+    falha e é tentado de novo). Um e-mail deste evento já entregue por este processo
+    não é mandado de novo. `caixa_saida` é chamada para obter a caixa (criada só
+    quando há o que enviar).
+    """
+    assuntos = {AGENDAMENTO_CRIADO: "Agendamento Confirmado", AGENDAMENTO_CANCELADO: "Agendamento Cancelado"}
+
+    def tratar(evento_id, evento):
+        resumo = resumo_do_agendamento(evento)
+        if evento['tipo'] == AGENDAMENTO_CANCELADO:
+            resumo = "\n            Agendamento Cancelado:" + resumo
+        with metricas.span('enviar_email') if metricas is not None else nullcontext():
+            caixa_saida().enviar(assuntos[evento['tipo']], resumo, item_id=f"evento-{evento_id}", timeout=timeout)
+    return tratar